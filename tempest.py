@@ -7,11 +7,15 @@
 # station data
 #
 
+import datetime
 import json
-import urllib3
 from wg_helper import wg_error_print
 from wg_helper import wg_trace_print
 from wg_helper import wg_trace_pprint
+from wg_http import wg_http_request
+from tempest_udp import tempest_udp_snapshot
+from tempest_udp import tempest_udp_seed_rain
+from weather_model import Observation
 # Tempest device parameters
 from tempest_account_settings import PWS_TOKEN
 from tempest_account_settings import PWS_DeviceID
@@ -46,48 +50,75 @@ tempest_PA_none     = 0
 tempest_PA_disp_on  = 1
 tempest_PA_disp_off = 2
 
-TEMPEST_VERSION = "1.0"
+TEMPEST_VERSION = "1.2"
 
 Trace = False
 
 ###############################################################################
 #
-# Get weather data from Tempest personal weather station
+# Fill in the weather data structure from one observation (see
+# weather_model.py)
+# Args:
+#   dsd = dictionary to fill in
+#   obs = observation fields (see the tempest_obs_* indices above)
+#   feels_like = apparent temperature (C)
+#   day_rain = rain so far today (mm), None if we don't know
+#
+def _fillPWSdata(dsd, obs, feels_like, day_rain):
+    """Convert a Tempest observation to an Observation"""
+    if obs[tempest_obs_StaPressure] is None:
+        wg_trace_print("Barometric Pressure failed", True)
+    # The Tempest already reports in SI units
+    dsd['obs'] = Observation(time=datetime.datetime.fromtimestamp(obs[tempest_obs_TimeEpoch]),
+                             temp_c=obs[tempest_obs_AirTemp],
+                             feels_like_c=feels_like,
+                             humidity=obs[tempest_obs_RelHumid],
+                             pressure_hpa=obs[tempest_obs_StaPressure],
+                             wind_ms=obs[tempest_obs_WindAvg],
+                             gust_ms=obs[tempest_obs_WindGust],
+                             wind_dir_deg=obs[tempest_obs_WindDir],
+                             rain_today_mm=day_rain)
+
+###############################################################################
+#
+# Get weather data from Tempest personal weather station.  If the hub's UDP
+# broadcasts are being received (see tempest_udp.py), use them; otherwise ask
+# the WeatherFlow servers.
 #
 def getPWSdata(dsd):
-    wind_directions = ["N", "NNE", "NE", "ENE",
-                       "E", "ESE", "SE", "SSE",
-                       "S", "SSW", "SW", "WSW",
-                       "W", "WNW", "NW", "NNW"]
+    snap = tempest_udp_snapshot()
+    if snap is not None and snap['rain_today_mm'] is not None:
+        _fillPWSdata(dsd, snap['obs'], snap['feels_like_c'], snap['rain_today_mm'])
+        wg_trace_print("Tempest data from UDP (" + str(int(snap['age'])) + " seconds old)",
+                       Trace)
+        return True
 
     try:
         status = 0
-        pman = urllib3.PoolManager()
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        ret = pman.request('GET', 'https://swd.weatherflow.com/swd/rest/' +
-                           'observations/?device_id=' + PWS_DeviceID +
-                           '&token=' + PWS_TOKEN)
+        ret = wg_http_request('GET', 'https://swd.weatherflow.com/swd/rest/' +
+                              'observations/?device_id=' + PWS_DeviceID +
+                              '&token=' + PWS_TOKEN, service="Tempest")
         #wg_trace_pprint(ret.data, True)
         status = 1
         curr = json.loads(ret.data.decode('utf-8'))
         #wg_trace_pprint(curr, True)
-        temp_c = curr['obs'][0][tempest_obs_AirTemp]
-        dsd['temp_f'] = int(round(((temp_c * 9 / 5) + 32), 0))
-        dsd['relative_humidity'] = str(int(curr['obs'][0][tempest_obs_RelHumid]))
-        dsd['wind_dir'] = (wind_directions[int(((curr['obs'][0][tempest_obs_WindDir] /
-                           22.5)+.5) % 16)])
-        dsd['wind_mph'] = (curr['obs'][0][tempest_obs_WindAvg] * 2.237)
-        dsd['wind_gust_mph'] = (curr['obs'][0][tempest_obs_WindGust] * 2.237)
-        if type(curr['obs'][0][tempest_obs_StaPressure]) == type(None) :
-            wg_trace_print("Barometric Pressure failed", True)
-            dsd['pressure_in'] = "0" # something wrong with call ... next time
-        else :
-            dsd['pressure_in'] = str(round(curr['obs'][0][tempest_obs_StaPressure] / 33.8639, 2))
-        temp_c = curr['summary']['feels_like']
-        dsd['windchill'] = int(round(((temp_c * 9 / 5) + 32), 0))
-        dsd['precip_today_in'] = round((curr['obs'][0][tempest_obs_DayRainAcc] / 25.4), 2)
+        obs = curr['obs'][0]
+        _fillPWSdata(dsd, obs, curr['summary']['feels_like'], obs[tempest_obs_DayRainAcc])
+        if snap is not None:
+            # The UDP data is good but we haven't been listening long enough to
+            # know today's rain.  Give the listener the total so far.
+            tempest_udp_seed_rain(obs[tempest_obs_DayRainAcc])
         return True
     except ValueError:
         wg_error_print("getPWSdata", "Weather Collection Error #1 (status = " +
                        str(status) + ")")
+    except Exception: #pylint: disable=W0703
+        if snap is None:
+            raise
+        wg_error_print("getPWSdata", "Weather Collection Error #2 (status = " +
+                       str(status) + ")")
+    if snap is not None:
+        # Still have good UDP data, we just don't know today's rain
+        _fillPWSdata(dsd, snap['obs'], snap['feels_like_c'], None)
+        return True
     return False
@@ -0,0 +1,320 @@
+"""Listen for the observations a Tempest hub broadcasts on the local network."""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to receive the Tempest hub's UDP broadcasts
+# (port 50222).  The hub sends an obs_st observation every minute, rapid_wind
+# every few seconds, and evt_strike / evt_precip events as they happen, so
+# this gives us current conditions without a trip to the WeatherFlow servers.
+#
+# Run this file directly to watch, capture or replay packets:
+#   python3 tempest_udp.py --listen
+#   python3 tempest_udp.py --capture packets.txt
+#   python3 tempest_udp.py --replay packets.txt [--host 127.0.0.1] [--delay 0.1]
+#
+import argparse
+import collections
+import datetime
+import json
+import socket
+import sys
+import threading
+import time
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+
+TEMPEST_UDP_VERSION = "1.2"
+
+TEMPEST_UDP_PORT = 50222
+TEMPEST_UDP_MAX_AGE = 180       # seconds before the last obs_st is too old to use
+
+Trace = False
+
+# Compact records for each kind of message.  The obs_st fields are in the
+# same order as the tempest_obs_* indices in tempest.py.
+TempestObs = collections.namedtuple('TempestObs',
+                                    ['epoch', 'wind_lull', 'wind_avg', 'wind_gust',
+                                     'wind_dir', 'wind_interval', 'pressure_mb',
+                                     'temp_c', 'humidity', 'illuminance', 'uv',
+                                     'solar_rad', 'rain_mm', 'precip_type',
+                                     'strike_dist', 'strike_count', 'battery',
+                                     'report_interval'])
+TempestWind = collections.namedtuple('TempestWind', ['epoch', 'speed', 'direction'])
+TempestStrike = collections.namedtuple('TempestStrike', ['epoch', 'distance', 'energy'])
+TempestPrecip = collections.namedtuple('TempestPrecip', ['epoch'])
+
+_LISTENER = None
+
+###############################################################################
+#
+# Turn one UDP packet into a list of records (empty if it's a message we
+# don't care about or can't read)
+#
+def parse_packet(packet):
+    """Parse a Tempest hub broadcast into TempestObs/Wind/Strike/Precip records"""
+    try:
+        msg = json.loads(packet.decode('utf-8') if isinstance(packet, bytes) else packet)
+        msg_type = msg.get('type')
+        if msg_type == 'obs_st':
+            nfields = len(TempestObs._fields)
+            return [TempestObs(*((list(row) + [None] * nfields)[:nfields]))
+                    for row in msg['obs']]
+        if msg_type == 'rapid_wind':
+            return [TempestWind(*msg['ob'][:3])]
+        if msg_type == 'evt_strike':
+            return [TempestStrike(*msg['evt'][:3])]
+        if msg_type == 'evt_precip':
+            return [TempestPrecip(msg['evt'][0])]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        wg_error_print("tempest_udp", "Unreadable packet: " + repr(packet[:80]))
+    return []
+
+###############################################################################
+#
+# What the temperature feels like (NWS wind chill and heat index formulas)
+#
+def feels_like_c(temp_c, humidity, wind_ms):
+    """Return the apparent temperature in C"""
+    temp_f = temp_c * 9 / 5 + 32
+    wind_mph = wind_ms * 2.237
+    if temp_f <= 50 and wind_mph > 3:
+        vel = wind_mph ** 0.16
+        feels_f = 35.74 + 0.6215 * temp_f - 35.75 * vel + 0.4275 * temp_f * vel
+    elif temp_f >= 80:
+        feels_f = (-42.379 + 2.04901523 * temp_f + 10.14333127 * humidity -
+                   0.22475541 * temp_f * humidity - 0.00683783 * temp_f * temp_f -
+                   0.05481717 * humidity * humidity +
+                   0.00122874 * temp_f * temp_f * humidity +
+                   0.00085282 * temp_f * humidity * humidity -
+                   0.00000199 * temp_f * temp_f * humidity * humidity)
+    else:
+        feels_f = temp_f
+    return (feels_f - 32) * 5 / 9
+
+
+class TempestListener:
+    """Receive Tempest hub broadcasts and keep the current conditions"""
+
+    ###########################################################################
+    def __init__(self, port=TEMPEST_UDP_PORT, bind_addr=""):
+        self.port = port
+        self.bind_addr = bind_addr
+        self.sock = None
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.obs = None             # latest TempestObs
+        self.obs_received = None    # time.monotonic() it arrived
+        self.wind = None            # latest TempestWind
+        self.strike = None          # latest TempestStrike
+        self.strikes_today = 0
+        self.precip = None          # latest TempestPrecip (rain started)
+        self.packets = 0
+        # Rain today is added up from the per-minute amounts, so it's only
+        # complete if we've been listening since midnight (or were told the
+        # total so far with seed_rain_today)
+        self.day = datetime.date.today()
+        self.rain_today_mm = 0.0
+        self.rain_complete = False
+
+    ###########################################################################
+    #
+    # Open the socket and start the listening thread
+    #
+    def start(self):
+        """Start listening"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind((self.bind_addr, self.port))
+        self.sock.settimeout(1.0)   # so stop() doesn't wait forever
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="tempest_udp", daemon=True)
+        self.thread.start()
+
+    ###########################################################################
+    def stop(self):
+        """Stop listening"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(5)
+            self.thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    ###########################################################################
+    def _run(self):
+        """Listening thread"""
+        while self.running:
+            try:
+                (packet, _) = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.running:
+                    wg_error_print("tempest_udp", "Socket error, listener stopped")
+                return
+            for record in parse_packet(packet):
+                self.add_record(record)
+
+    ###########################################################################
+    #
+    # Fold a record into the current conditions
+    #
+    def add_record(self, record):
+        """Update the current conditions with a parsed record"""
+        with self.lock:
+            self.packets += 1
+            # The day the record is from (not when it got here, replayed
+            # and late packets are from earlier)
+            if record.epoch is None:
+                day = datetime.date.today()
+            else:
+                day = datetime.date.fromtimestamp(record.epoch)
+            if day > self.day:
+                # Listening at midnight, so tomorrow's total will be complete
+                self.day = day
+                self.rain_today_mm = 0.0
+                self.strikes_today = 0
+                self.rain_complete = True
+            if isinstance(record, TempestObs):
+                if self.obs is None or record.epoch > self.obs.epoch:
+                    # Only count the rain once, hubs repeat broadcasts
+                    if record.rain_mm and day == self.day:
+                        self.rain_today_mm += record.rain_mm
+                    self.obs = record
+                    self.obs_received = time.monotonic()
+            elif isinstance(record, TempestWind):
+                self.wind = record
+            elif isinstance(record, TempestStrike):
+                self.strike = record
+                self.strikes_today += 1
+            elif isinstance(record, TempestPrecip):
+                self.precip = record
+        wg_trace_print(str(record), Trace)
+
+    ###########################################################################
+    #
+    # Tell the listener how much rain there has been today (from the REST
+    # API) so its running total is complete
+    #
+    def seed_rain_today(self, rain_mm):
+        """Set today's rain total so far"""
+        with self.lock:
+            self.rain_today_mm = rain_mm
+            self.rain_complete = True
+
+    ###########################################################################
+    #
+    # Return the current conditions, or None if we haven't heard an obs_st
+    # recently.  rain_today_mm is None if we don't have a complete total.
+    #
+    def snapshot(self, max_age=TEMPEST_UDP_MAX_AGE):
+        """Return a copy of the current conditions"""
+        with self.lock:
+            if self.obs is None or (time.monotonic() - self.obs_received) > max_age:
+                return None
+            obs = self.obs
+            wind_avg = obs.wind_avg if obs.wind_avg is not None else 0.0
+            if obs.temp_c is None or obs.humidity is None:
+                feels_like = None   # the hub sends null for a failed sensor
+            else:
+                feels_like = feels_like_c(obs.temp_c, obs.humidity, wind_avg)
+            return {'obs' : obs,
+                    'age' : time.monotonic() - self.obs_received,
+                    'wind' : self.wind,
+                    'strike' : self.strike,
+                    'strikes_today' : self.strikes_today,
+                    'precip' : self.precip,
+                    'feels_like_c' : feels_like,
+                    'rain_today_mm' : self.rain_today_mm if self.rain_complete else None}
+
+###############################################################################
+#
+# Start the one listener for this process.  Returns False if the port can't
+# be opened (we'll just use the REST API).
+#
+def tempest_udp_start(port=TEMPEST_UDP_PORT):
+    """Start listening for Tempest broadcasts"""
+    global _LISTENER
+    if _LISTENER is not None:
+        return True
+    listener = TempestListener(port)
+    try:
+        listener.start()
+    except OSError as err:
+        wg_error_print("tempest_udp_start", "Unable to listen on port " + str(port) +
+                       ": " + str(err))
+        return False
+    _LISTENER = listener
+    return True
+
+###############################################################################
+#
+# Current conditions from the listener, None if it isn't running or hasn't
+# heard from the hub lately
+#
+def tempest_udp_snapshot():
+    """Return the listener's current conditions"""
+    if _LISTENER is None:
+        return None
+    return _LISTENER.snapshot()
+
+###############################################################################
+#
+# Pass today's rain total (mm) on to the listener
+#
+def tempest_udp_seed_rain(rain_mm):
+    """Give the listener today's rain so far"""
+    if _LISTENER is not None:
+        _LISTENER.seed_rain_today(rain_mm)
+
+###############################################################################
+#
+# Send captured packets (one per line) to a listener, for testing
+#
+def tempest_udp_replay(file_name, host="127.0.0.1", port=TEMPEST_UDP_PORT, delay=0.0):
+    """Replay captured packets over UDP"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    num = 0
+    with open(file_name, "r") as packets:
+        for line in packets:
+            line = line.strip()
+            if not line:
+                continue
+            sock.sendto(line.encode('utf-8'), (host, port))
+            num += 1
+            if delay:
+                time.sleep(delay)
+    sock.close()
+    return num
+
+
+###############################################################################
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Tempest hub UDP tools")
+    PARSER.add_argument("--port", type=int, default=TEMPEST_UDP_PORT)
+    PARSER.add_argument("--listen", action="store_true", help="print records as they arrive")
+    PARSER.add_argument("--capture", metavar="FILE", help="append raw packets to FILE")
+    PARSER.add_argument("--replay", metavar="FILE", help="send the packets in FILE")
+    PARSER.add_argument("--host", default="127.0.0.1", help="where to --replay to")
+    PARSER.add_argument("--delay", type=float, default=0.0, help="seconds between packets")
+    ARGS = PARSER.parse_args()
+    if ARGS.replay:
+        print("Sent " + str(tempest_udp_replay(ARGS.replay, ARGS.host, ARGS.port,
+                                               ARGS.delay)) + " packets")
+        sys.exit(0)
+    SOCK = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    SOCK.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    SOCK.bind(("", ARGS.port))
+    while True:
+        (PACKET, _) = SOCK.recvfrom(4096)
+        if ARGS.capture:
+            with open(ARGS.capture, "a") as CAPTURE:
+                CAPTURE.write(PACKET.decode('utf-8', 'replace').strip() + "\n")
+        if ARGS.listen or not ARGS.capture:
+            for RECORD in parse_packet(PACKET):
+                print(RECORD)
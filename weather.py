@@ -40,17 +40,24 @@
 ### END LICENSE
 
 """ Fetches weather reports WeatherUnderground.com for display on small screens."""
+import sys
+from wg_profile import wg_profile_begin
+from wg_profile import wg_profile_mark
+from wg_profile import wg_profile_report
+if "--profile-startup" in sys.argv:
+    # Time the imports and everything else up to the first frame
+    wg_profile_begin()
 import os
-from urllib.request import urlretrieve
 import time
 import datetime
 import math
 import textwrap
-import pickle
+import threading
+import copy
+from collections import deque
+from collections import OrderedDict
 from pygame.locals import *
 import pygame
-from openpyxl import load_workbook
-from openpyxl import Workbook
 
 # My local packages
 from wg_helper import wg_trace_print
@@ -78,19 +85,50 @@ from wg_thingspeak import thingspeakgetfloat
 from wg_thingspeak import TS_BASEMENT_CHAN
 from wg_thingspeak import THINGSPEAK_FLOAT_ERROR
 from wg_thingspeak import thingspeaksendfloatnum
+from wg_thingspeak import thingspeakflush
 from thingspeak_channels_keys import TS_THERM_CHAN
 from thingspeak_channels_keys import TS_WEATHER_CHAN
 from wg_twilio import sendtext
-from dark_sky import getweatherdata
 from dark_sky import moonphaseurl
-from tempest import getPWSdata
+from weather_fetch import fetchweatherdata
+from weather_poll import poll_interval
+from weather_almanac import WeatherAlmanac
+from weather_ephemeris import ephemeris_almanac
+from weather_ephemeris import ephemeris_day
+from weather_ephemeris import ephemeris_time_str
+from weather_model import Observation
+from weather_model import c_to_f
+from weather_model import deg_to_compass
+from weather_model import forecast_condition
+from weather_model import hpa_to_inhg
+from weather_model import m_to_miles
+from weather_model import mm_to_in
+from weather_model import ms_to_mph
+from weather_records import records_get
+from weather_records import records_set_high
+from weather_records import records_set_low
+from weather_records import records_flush
+from weather_log import hourly_log_due
+from weather_log import hourly_log_append
+from weather_tsdb import tsdb_add
+from weather_tsdb import tsdb_save
+from weather_state import weather_state_load
+from weather_state import weather_state_save
+from weather_state import weather_snapshot_load
+from weather_state import weather_snapshot_save
+from tempest_udp import tempest_udp_start
+from wg_worker import WGWorker
+from wg_scheduler import WGScheduler
+from wg_lazy import wg_lazy_import
+from wg_metrics import wg_metrics_serve
+from wg_metrics import wg_metrics_summary
+from wg_metrics import wg_metrics_timer
 
 __version__ = "v3.2"
 TRACE = False       # write tracing lines to log file
 CONTROL_LOG = True  # write lines to show control functions
 ALERT = True        # For testing purposes, don't send text alerts
 FURNACE_TRACE = False # Trace messages for the furnace control code
-RECORD_TRACE = True # Trace messages for record high/low code
 
 # Config for climate control functions
 FLOOR_TEMP_DIFFERENTIAL = 5
@@ -127,17 +165,46 @@ COLOR_TEXT_RISING = COLOR_RED
 COLOR_TEXT_FALLING = COLOR_BLUE
 
 FONT_NORMAL = "FreeSans"
+FONT_MONO = "FreeMono"
 FONT_LOC_ON_RASPBERRY_PI = "/usr/share/fonts/truetype/freefont"
 TEXT_HEIGHT_SMALL = 0.06
 
 RUNNING_LOC = "./"
 
+# How often (seconds) the scheduled jobs run.  The forecast and current
+# conditions run between their fastest and slowest intervals depending on how
+# fast the weather is changing (see weather_poll).
+CURRENT_INTERVAL = 60           # Tempest current conditions
+CURRENT_FASTEST = 60            # (the Tempest only reports once a minute)
+CURRENT_SLOWEST = 5 * 60
+THERMOSTAT_INTERVAL = 60        # inside data and furnace fan control
+FORECAST_INTERVAL = 30 * 60     # forecast, alerts and almanac from all providers
+FORECAST_FASTEST = 10 * 60
+FORECAST_SLOWEST = 60 * 60
+THINGSPEAK_INTERVAL = 60        # send the queued ThingSpeak data
+HISTORY_INTERVAL = 60 * 60      # save the records and time series
+
+# SmDisplay.data entries that describe the screen, not the weather
+LAYOUT_KEYS = ('scaleicon', 'subwinth', 'tmdateth', 'tmdatesmth', 'tmdateypos', 'tmdateypossm')
+
+STATE_FLUSH_DELAY = 60  # seconds from a change to the history until it's saved
+
+# pygame events of our own
+EVT_TICK = pygame.USEREVENT + 1     # the clock's second has changed
+EVT_DATA = pygame.USEREVENT + 2     # the worker has published new data
+EVT_ALMANAC = pygame.USEREVENT + 3  # the sun has come up or gone down
+DISPLAY_TIMEOUT = 60    # seconds before going back to the weather screen
+
+METRICS_OVERLAY_LINES = 10  # calls shown on the debug overlay ('m' key)
+
+IMAGE_CACHE_SIZE = 32    # icons and logos kept ready to blit
+TEXT_CACHE_SIZE = 256    # rendered strings kept ready to blit
+
 TEMP_DEFAULT = -99.0
 BARO_DEFAULT = -99.0
 HUMID_DEFAULT = -99
 # These cache the record high/low so we don't have to use the
 # (slow) Excel access routines every time we need the values
-RECORD_DATA = [0, 0, 0, 0]
 
 # Control tabs
 TAB_LABELS = ["Weather", "Almanac", "Alert", "History", "Details"]
@@ -293,6 +360,8 @@ def furnacefancontrol():
 # equal to that highest setting, set the thermostat to halfway
 # between the highest and lowest setting for the day.
 #
+# forecast_high is in degrees F
+#
 def adjusttstatsetting(forecast_high):
     """Adjust the thermostat setting based on the weather forecast"""
     # what is the tstat's current setting?
@@ -312,7 +381,7 @@ def adjusttstatsetting(forecast_high):
         tstat_temp = tstat_status['t_heat']
         wg_trace_print("tstat_high = " + str(tstat_high) + ", tstat_temp = " + str(tstat_temp), TRACE)
         if tstat_temp == tstat_high:
-            high_temp = int(forecast_high.split('°')[0])
+            high_temp = int(round(forecast_high))
             wg_trace_print("forecast_high = " + str(forecast_high), TRACE)
             wg_trace_print("high_temp = " + str(high_temp), TRACE)
             if high_temp >= tstat_temp:
@@ -361,6 +430,40 @@ def updateinsidedata():
         if humid != RADTHERM_FLOAT_ERROR:
             thingspeaksendfloatnum(TS_THERM_CHAN, 2, "1", tmp, "2", humid,
                                    " ", 0, " ", 0, TRACE)
+            tsdb_add("indoor_temp", tmp)
+            tsdb_add("indoor_humidity", humid)
+
+###############################################################################
+#
+# The scheduled jobs (see SCHEDULER).  They all run on the worker thread.
+#
+def update_forecast():
+    """Update the forecast (and everything else) from all the providers"""
+    MYDISP.updateweather()
+    if MYDISP.work.forecast:
+        adjusttstatsetting(c_to_f(MYDISP.work.forecast[0].high_c))
+    SCHEDULER.set_interval("forecast",
+                           poll_interval(FORECAST_INTERVAL, FORECAST_FASTEST, FORECAST_SLOWEST,
+                                         ["DarkSky", "Tempest"], bool(MYDISP.work.alerts_sent)))
+
+def update_current():
+    """Update the current conditions from the Tempest"""
+    MYDISP.updateweather(["Tempest"])
+    SCHEDULER.set_interval("current",
+                           poll_interval(CURRENT_INTERVAL, CURRENT_FASTEST, CURRENT_SLOWEST,
+                                         ["Tempest"], bool(MYDISP.work.alerts_sent)))
+
+def update_thermostat():
+    """Update the inside data and control the furnace fan"""
+    updateinsidedata()
+    furnacefancontrol()
+
+def save_history():
+    """Save the records and the time series"""
+    records_flush()
+    # The scheduler already runs this every HISTORY_INTERVAL.  Without force,
+    # a run that came a little early (jitter) would skip the save.
+    tsdb_save(True)
 
 ###############################################################################
 #
@@ -376,6 +479,16 @@ def color_rising_falling(old, new, curr_color):
         retcolor = COLOR_TEXT_FALLING
     return retcolor
 
+###############################################################################
+#
+# A record high/low or its year for the screens ("NA" if there's no record
+# for the day yet)
+#
+###############################################################################
+def record_str(value):
+    """Return a record value as a string"""
+    return "NA" if value is None else "%d" % value
+
 ###############################################################################
 #
 #   Saves an URL file to a disk file to avoid Internet calls later
@@ -393,91 +506,41 @@ def saveurltofile(url, fil_name):
     # Does it already exist?
     if  not os.path.isfile(fil):
         # save the URL to a disk file
-        urlretrieve(url, fil)
+        wg_lazy_import("urllib.request").urlretrieve(url, fil)
     # return the fileneme
     return fil
 
 
-####################################################################
-#
-# Return True if the argument is a leap year.  False otherwise
-#
-#   arguments:
-#       year_arg: the year to determine if it is a leap year
-#
-def is_leap_year(year_arg):
-    """If year_arg is a leap year, return True, else return False"""
-    if (year_arg % 4) == 0:
-        if (year_arg % 100) == 0:
-            if (year_arg % 400) == 0:
-                return True
-            else:
-                return False
-        else:
-            return True
-    else:
-        return False
-
-
 ###########################################################################
 #
-# Return the record high/low temperature and the years it was set in a
-# 4 element array
-#
-#   arguments:
-#       mode:          0 - return current record high/low data
-#                      1 - set new record high
-#                      2 - set new record low
-#       high_temp_arg: the new high temperature (if setting)
-#       high_year_arg: the year to set the high temperature to or
-#                      zero if just getting the high temperature
-#       low_temp_arg:  the new high temperature (if setting)
-#       low_year_arg:  the year to set the high temperature to or
-#                      zero if just getting the high temperature
+# Everything the update engine produces for the display.  The worker thread
+# owns one of these and changes it as new data comes in.  The display only
+# ever sees finished copies of it (see SmDisplay.publish and
+# SmDisplay.apply_snapshot).
 #
 ###########################################################################
-def get_record_data(mode, high_temp_arg, high_year_arg, low_temp_arg,
-                    low_year_arg):
-    """if either year_arg is 0, return the record temps for today, else
-        set the high temp for today to temp_arg"""
-    global RECORD_DATA
-
-    if mode != 0 or RECORD_DATA[0] == 0:
-        # Either we need to get new data or we're setting a new high/low
-        wb = load_workbook(filename = "Records.xlsx", data_only=True)
-        ws = wb['Sheet1']
-        r = time.localtime().tm_yday + 1 # +1 for the spreadsheet header
-                                         # row
-        if r > 59 and not is_leap_year(time.localtime().tm_year):
-            # 59 = the number of days in January and February,
-            # excluding leap day
-            r += 1 # skip the leap day (it doesn't exist this year)
-        if mode == 0:
-            # Get the record high/low data from the spreadsheet
-            # return existing values
-            th = ws.cell(row=r, column=3).value
-            yh = ws.cell(row=r, column=4).value
-            tl = ws.cell(row=r, column=5).value
-            yl = ws.cell(row=r, column=6).value
-        elif mode == 1:
-            # Set a new record high
-            th = ws.cell(row=r, column=3).value = high_temp_arg
-            yh = ws.cell(row=r, column=4).value = high_year_arg
-            tl = ws.cell(row=r, column=5).value
-            yl = ws.cell(row=r, column=6).value
-            msg = "Recorded new record high of " + str(th)
-            wg_trace_print(msg, RECORD_TRACE)
-        else: # mode == 2
-            # Set a new record low
-            th = ws.cell(row=r, column=3).value
-            yh = ws.cell(row=r, column=4).value
-            tl = ws.cell(row=r, column=5).value = low_temp_arg
-            yl = ws.cell(row=r, column=6).value = low_year_arg
-            msg = "Recorded new record low of " + str(tl)
-            wg_trace_print(msg, RECORD_TRACE)
-        wb.save("Records.xlsx")
-        RECORD_DATA = [th, yh, tl, yl]
-    return RECORD_DATA
+class WeatherState:
+    """Weather data shared between the update engine and the display"""
+    FIELDS = ('data', 'temps', 'forecastdetails', 'sunrise', 'sunset',
+              'max_temps', 'min_temps', 'rainfall', 'curr_day', 'alerts_sent',
+              'obs', 'forecast')
+
+    def __init__(self):
+        # The latest numbers from the providers (see weather_model.py)
+        self.obs = Observation()
+        self.forecast = []
+        # ... and the strings the screens show, made once per update
+        self.data = dict()
+        self.temps = [['', ''], ['', ''], ['', ''], ['', '']]
+        self.forecastdetails = [' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ']
+        self.sunrise = '7:00 AM'
+        self.sunset = '8:00 PM'
+        # Remember min and max temperatures
+        self.max_temps = [0, 0, 0, 0, 0, 0, 0]
+        self.min_temps = [0, 0, 0, 0, 0, 0, 0]
+        self.rainfall = [0, 0, 0, 0, 0, 0, 0]
+        self.curr_day = int(time.strftime("%w"))
+        self.alerts_sent = []
 
 
 # Small LCD Display.
@@ -485,6 +548,58 @@ class SmDisplay:
     """Class for application"""
     screen = None
 
+    #######################################################################
+    #
+    # Hand a finished copy of the worker's state to the display.  Called on
+    # the worker thread whenever it has changed the state.
+    #
+    #######################################################################
+    def publish(self):
+        """Publish a snapshot of the working state for the display"""
+        # deque.append is atomic, and maxlen=1 throws away any snapshot the
+        # display hasn't picked up yet
+        self.snapshots.append(copy.deepcopy(self.work))
+        # Wake up the main loop (posting is safe from any thread)
+        try:
+            pygame.event.post(pygame.event.Event(EVT_DATA))
+        except pygame.error:
+            pass    # the display has already shut down
+
+    #######################################################################
+    #
+    # Pick up the latest snapshot (if there is one).  Called on the display
+    # thread before drawing so a frame never waits on the worker.
+    #
+    #######################################################################
+    def apply_snapshot(self):
+        """Switch the display over to the newest published snapshot"""
+        try:
+            snap = self.snapshots.pop()
+        except IndexError:
+            return False
+        for field in WeatherState.FIELDS:
+            setattr(self, field, getattr(snap, field))
+        self.data_version += 1
+        self.almanac.update(self.sunrise, self.sunset)
+        return True
+
+    #######################################################################
+    #
+    # Start a new day's min/max/rainfall.  Runs on the worker thread.
+    #
+    #######################################################################
+    def new_day(self):
+        """Reset today's history if the day has changed"""
+        st = self.work
+        today = int(time.strftime("%w"))
+        if st.curr_day != today: # it's a new day!
+            st.curr_day = today
+            st.max_temps[today] = 0
+            st.min_temps[today] = 0
+            st.rainfall[today] = 0
+            self.save_data()
+            self.publish()
+
     #######################################################################
     #
     # Handle weather alerts
@@ -492,14 +607,15 @@ class SmDisplay:
     #######################################################################
     def handle_alerts(self, weatherdata):
         """Send any alerts that we haven't already sent"""
+        st = self.work
         try:
             if not weatherdata['alerts']: # No alerts to deal with, clear the saved list
-                self.alerts_sent = []
+                st.alerts_sent = []
             else:
                 for alert in weatherdata['alerts']:
                     # check to see if we've already sent this one
                     send_it = True
-                    for already_sent in self.alerts_sent:
+                    for already_sent in st.alerts_sent:
                         if already_sent != weatherdata['alerts'].pop:
                             send_it = False
                             break
@@ -509,7 +625,7 @@ class SmDisplay:
                             sendtext(alert_msg)
                         # Update alert list after sending in case there was an error in sending
                         # it.  That way, we'll try to send it again next time.
-                        self.alerts_sent.append(alert)
+                        st.alerts_sent.append(alert)
         except:
             wg_error_print("UpdateWeather", "Alert Exception")
             wg_trace_pprint(weatherdata['alerts'], True)
@@ -518,41 +634,21 @@ class SmDisplay:
     #
     # Track some data for future research
     #
-    # Spreadsheet?  A new spreadsheet for each year, a new sheet for each
-    # month
+    # One line an hour in a log file for each month (see weather_log.py)
     #
     #######################################################################
     def log_research_data(self):
         """Keep track of a few pieces of data for further research"""
-        global RECORD_DATA
-
         try:
             # if it's the top of the hour
-            if time.localtime().tm_min < 10:
-                # save date, hour, thermostat temp, forecast data to .xlsx file
-                rightnow = datetime.datetime.now()
-                ss_name = str(rightnow.year) + "hourly_data.xlsx"
-                if not os.path.isfile(ss_name):
-                    # Create the spreadsheet file
-                    wb = Workbook()
-                    # Get rid of the default worksheet
-                    ws = wb['Sheet']
-                    wb.remove(ws)
-                else:
-                    wb = load_workbook(filename = ss_name, data_only=True)
-                ws_name = 'Sheet-' + str(rightnow.month)
-                if not ws_name in wb.sheetnames:
-                    # create the worksheet
-                    wb.create_sheet(ws_name)
-                ws = wb[ws_name]
+            if time.localtime().tm_min < 10 and hourly_log_due():
+                # save thermostat temp and forecast data
                 tstat_temp = radtherm_get_float("temp", TRACE)
-                ws.append([rightnow.month, rightnow.day, rightnow.year,
-                           rightnow.hour, tstat_temp, self.temps[0][0],
-                           self.temps[0][1], self.data['rain'][0]])
-                wb.save(ss_name)
-                # Reset record high/low so it'll get reloaded from the
-                # spreadsheet
-                RECORD_DATA = [0, 0, 0, 0]
+                if self.work.forecast:
+                    today = self.work.forecast[0]
+                    hourly_log_append([tstat_temp, int(round(c_to_f(today.high_c))),
+                                       int(round(c_to_f(today.low_c))),
+                                       self.work.data['rain'][0]])
         except:
             wg_error_print("UpdateWeather", "Tracking data output error.")
             # Don't know what else we can do!
@@ -581,6 +677,68 @@ class SmDisplay:
         self.fonts.append([font_name, size, osfont])
         return osfont
 
+    #######################################################################
+    #
+    # Load an image (icon, logo) from a file
+    # Args:
+    #   file_name = file in the running directory
+    #   scale = how much to grow or shrink the image
+    #
+    # Note, for efficiency, we keep the most recently used images already
+    # converted to the display's pixel format so drawing a frame never has
+    # to go to the disk or decode a GIF.
+    #
+    #######################################################################
+    def loadimage(self, file_name, scale=1.0):
+        """Load an image, using the cached copy if we have one"""
+        key = (file_name, scale)
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            return image
+        image = pygame.image.load(os.path.join(RUNNING_LOC, file_name))
+        if scale != 1.0:
+            (iwid, ihei) = image.get_size()
+            image = pygame.transform.scale(image, (int(iwid*scale), int(ihei*scale)))
+        if image.get_flags() & SRCALPHA:
+            image = image.convert_alpha()
+        else:
+            image = image.convert()
+        self.images[key] = image
+        if len(self.images) > IMAGE_CACHE_SIZE:
+            self.images.popitem(last=False)
+        return image
+
+    #######################################################################
+    #
+    # Render a string
+    # Args:
+    #   font_name = font to use (see loadfont)
+    #   size = font size
+    #   text = the string
+    #   color = text color
+    #   antialias = smooth the edges?
+    #
+    # Note, for efficiency, we keep the most recently rendered strings so
+    # only text that has changed has to be rasterized again.  Don't draw on
+    # the surface that's returned, it is shared.
+    #
+    #######################################################################
+    def rendertext(self, font_name, size, text, color, antialias=True):
+        """Render text, using the cached surface if we have one"""
+        key = (font_name, size, text, tuple(color), antialias)
+        txt = self.texts.get(key)
+        if txt is not None:
+            self.text_hits += 1
+            self.texts.move_to_end(key)
+            return txt
+        self.text_misses += 1
+        txt = self.loadfont(font_name, size).render(text, antialias, color)
+        self.texts[key] = txt
+        if len(self.texts) > TEXT_CACHE_SIZE:
+            self.texts.popitem(last=False)
+        return txt
+
 
     ####################################################################
     def __init__(self):
@@ -630,35 +788,47 @@ class SmDisplay:
         pygame.font.init()
         # Render the screen
         pygame.display.update()
-        self.data = dict()
+        # The worker thread's copy of the weather data.  The display only
+        # reads the snapshots published from it.
+        self.work = WeatherState()
+        self.snapshots = deque(maxlen=1)
+        self.data = self.work.data
+        self.data_version = 0       # bumped every time a snapshot is applied
+        # Off screen layers for the weather screen (see disp_weather)
+        self.weather_frame = None
+        self.weather_frame_alerts = False
+        self.weather_layer = None
+        self.weather_layer_version = -1
+        self.shown = None           # which tab is completely on the screen
+        self.clock_background = None    # what's under the time and date
+        # Sunrise and sunset, parsed when they change (see apply_snapshot)
+        self.almanac = WeatherAlmanac()
+        self.almanac_shown = None   # the countdown on the almanac screen
+        # The history is saved a little while after it changes
+        self.state_dirty = False
+        self.state_timer = None
+        # Nothing has been fetched yet; the display has to be able to draw
+        # these before the first update finishes
         self.data['curr_cond'] = ""
-        self.data['temp'] = str(TEMP_DEFAULT)
+        self.data['temp'] = '??'
         self.data['tempcolor'] = COLOR_TEXT_NORMAL
-        self.data['windchill'] = 0
-        self.data['wind_speed'] = 0
+        self.data['windchill'] = '0'
+        self.data['wind_speed'] = '0'
         self.data['vis'] = 0
-        self.data['baro'] = BARO_DEFAULT
+        self.data['baro'] = str(BARO_DEFAULT)
         self.data['barocolor'] = COLOR_TEXT_NORMAL
         self.data['wind_dir'] = 'S'
         self.data['gust'] = "N/A"
-        self.data['humid'] = HUMID_DEFAULT
+        self.data['humid'] = str(HUMID_DEFAULT)
         self.data['humidcolor'] = COLOR_TEXT_NORMAL
         self.data['update'] = ''
         self.data['day'] = ['', '', '', '']
         self.data['icon'] = [0, 0, 0, 0]
         self.data['rain'] = ['', '', '', '']
-        self.forecastdetails = [' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ']
-        self.temps = [['', ''], ['', ''], ['', ''], ['', '']]
-        self.sunrise = '7:00 AM'
-        self.sunset = '8:00 PM'
         self.data['moonrise'] = 'N/A'
         self.data['moonset'] = 'N/A'
         self.data['moonicon'] = ""
-        # Remember min and max temperatures
-        self.max_temps = [0, 0, 0, 0, 0, 0, 0]
-        self.min_temps = [0, 0, 0, 0, 0, 0, 0]
-        self.rainfall = [0, 0, 0, 0, 0, 0, 0]
-        self.curr_day = int(time.strftime("%w"))
+        self.data['stale'] = False      # showing the data saved by the last run
         # Remember if we are loading fonts from a file
         fonts = pygame.font.get_fonts()
         if str(fonts[0]) == "None":
@@ -666,7 +836,10 @@ class SmDisplay:
         else:
             self.load_fonts_from_file = False
         self.fonts = []
-        self.alerts_sent = []
+        self.images = OrderedDict()
+        self.texts = OrderedDict()
+        self.text_hits = 0
+        self.text_misses = 0
 
         if DISPLAY_SIZE == DISPLAY_SMALL:
             self.xmax = DISPLAY_SMALL_WIDTH - 35
@@ -695,7 +868,9 @@ class SmDisplay:
             self.data['tmdatesmth'] = 0.075
             self.data['tmdateypos'] = 1         # Time & Date Y Position
             self.data['tmdateypossm'] = 8       # Time & Date Y Position Small
-
+        # Start the display off with a copy of the (empty) working state
+        self.publish()
+        self.apply_snapshot()
 
     ####################################################################
     def __del__(self):
@@ -707,10 +882,13 @@ class SmDisplay:
     # arguments -
     #   which - which tab is currently being displayed (see the top of the
     #           file for enumerated list of tabs)
+    #   surf - surface to draw on (the screen if None)
     #
     ###########################################################################
-    def draw_tabs(self, which):
+    def draw_tabs(self, which, surf=None):
         """Draw the right hand tabs / buttons"""
+        if surf is None:
+            surf = self.screen
         button_height = (self.ymax*0.15)-2 # 15% of screen height
         p_top = 2
         p_bottom = p_top + button_height
@@ -723,10 +901,10 @@ class SmDisplay:
             color = COLOR_RED
         # draw the top line
         if which == 0:
-            pygame.draw.line(self.screen, color, (p_left+3, p_top), (p_right+2, p_top),
+            pygame.draw.line(surf, color, (p_left+3, p_top), (p_right+2, p_top),
                              BORDER_WIDTH)
         else:
-            pygame.draw.line(self.screen, COLOR_GREY, (p_left+3, p_top), (p_right+2, p_top),
+            pygame.draw.line(surf, COLOR_GREY, (p_left+3, p_top), (p_right+2, p_top),
                              BORDER_WIDTH)
         # draw the left, right, and bottom of each of the buttons
         for i in range(TAB_LAST + 1):
@@ -743,53 +921,57 @@ class SmDisplay:
                 txtclr = COLOR_GREY
                 lftclr = color
                 rgtclr = COLOR_GREY
-            pygame.draw.line(self.screen, lftclr, (p_left, p_top+3),
+            pygame.draw.line(surf, lftclr, (p_left, p_top+3),
                              (p_left, p_bottom-3), BORDER_WIDTH) # left
-            pygame.draw.line(self.screen, rgtclr, (p_right, p_top+3),
+            pygame.draw.line(surf, rgtclr, (p_right, p_top+3),
                              (p_right, p_bottom), BORDER_WIDTH) # right
             if which == i:     # redraw the top as it should have been white
-                pygame.draw.line(self.screen, color, (p_left+3, p_top),
+                pygame.draw.line(surf, color, (p_left+3, p_top),
                                  (p_right+2, p_top), BORDER_WIDTH)
-            pygame.draw.line(self.screen, rgtclr, (p_left+3, p_bottom),
+            pygame.draw.line(surf, rgtclr, (p_left+3, p_bottom),
                              (p_right+2, p_bottom), BORDER_WIDTH) # bottom
             p_top = p_top + button_height
             p_bottom = p_bottom + button_height
-            font = self.loadfont(FONT_NORMAL, int(self.ymax*TEXT_HEIGHT_SMALL))
-            txt = font.render(TAB_LABELS[i], True, txtclr)
+            fsize = int(self.ymax*TEXT_HEIGHT_SMALL)
+            txt = self.rendertext(FONT_NORMAL, fsize, TAB_LABELS[i], txtclr)
             (_, txt_hei) = txt.get_size()
-            self.screen.blit(txt, (self.xmax+BORDER_WIDTH,
+            surf.blit(txt, (self.xmax+BORDER_WIDTH,
                                    self.ymax*(0.15*(i+1))-BORDER_WIDTH-txt_hei))
 
     #######################################################################
     #
     # Draw the outline
+    # arguments -
+    #   surf - surface to draw on (the screen if None)
     #
     #######################################################################
-    def draw_screen_outline(self):
+    def draw_screen_outline(self, surf=None):
         """Draw the border lines"""
+        if surf is None:
+            surf = self.screen
         # If we have alerts, draw the outline in red
         if not self.alerts_sent:
             color = COLOR_WHITE
         else:
             color = COLOR_RED
         # Draw Screen Border
-        pygame.draw.line(self.screen, color, (0, 2), (self.xmax+2, 2),
+        pygame.draw.line(surf, color, (0, 2), (self.xmax+2, 2),
                          BORDER_WIDTH) # top border
-        pygame.draw.line(self.screen, color, (2, 2), (2, self.ymax),
+        pygame.draw.line(surf, color, (2, 2), (2, self.ymax),
                          BORDER_WIDTH) # left border
-        pygame.draw.line(self.screen, color, (0, self.ymax+2),
+        pygame.draw.line(surf, color, (0, self.ymax+2),
                          (self.xmax+2, self.ymax+2), BORDER_WIDTH) # Bottom border
-        pygame.draw.line(self.screen, color, (self.xmax, 2),
+        pygame.draw.line(surf, color, (self.xmax, 2),
                          (self.xmax, self.ymax), BORDER_WIDTH) # right border
         # Add Weather Underground logo to bottom right hand corner of the screen
-        icon = pygame.image.load(os.path.join(RUNNING_LOC, "dark-sky-logo.gif"))
+        icon = self.loadimage("dark-sky-logo.gif")
         (logo_wid, logo_hei) = icon.get_size()
-        self.screen.blit(icon, (self.xmax+BORDER_WIDTH, self.ymax-logo_hei+BORDER_WIDTH))
+        surf.blit(icon, (self.xmax+BORDER_WIDTH, self.ymax-logo_hei+BORDER_WIDTH))
         # Display version string
-        font = self.loadfont(FONT_NORMAL, int(self.ymax*TEXT_HEIGHT_SMALL))
-        txt = font.render(__version__, True, COLOR_TEXT_NORMAL)
+        fsize = int(self.ymax*TEXT_HEIGHT_SMALL)
+        txt = self.rendertext(FONT_NORMAL, fsize, __version__, COLOR_TEXT_NORMAL)
         (_, vstr_wid) = txt.get_size()
-        self.screen.blit(txt, (self.xmax+logo_wid+BORDER_WIDTH+2, self.ymax-vstr_wid))
+        surf.blit(txt, (self.xmax+logo_wid+BORDER_WIDTH+2, self.ymax-vstr_wid))
 
     ###########################################################################
     #
@@ -797,10 +979,32 @@ class SmDisplay:
     #
     ###########################################################################
     def save_data(self):
-        """save data to disk"""
-        pickle.dump(self.max_temps, open("max_temps.p", "wb"))
-        pickle.dump(self.min_temps, open("min_temps.p", "wb"))
-        pickle.dump(self.rainfall, open("rainfall.p", "wb"))
+        """Note that the history changed, it's saved STATE_FLUSH_DELAY seconds later"""
+        self.state_dirty = True
+        if self.state_timer is None:
+            # The worker saves it, it owns the data
+            self.state_timer = threading.Timer(STATE_FLUSH_DELAY, UPDATER.submit,
+                                               ("save_state", self.flush_data))
+            self.state_timer.daemon = True
+            self.state_timer.start()
+
+    ###########################################################################
+    #
+    # Write the history to disk if it has changed.  Runs on the worker thread
+    # (or after it has stopped).
+    #
+    ###########################################################################
+    def flush_data(self):
+        """Save the history to disk"""
+        if self.state_timer is not None:
+            self.state_timer.cancel()
+            self.state_timer = None
+        if self.state_dirty:
+            self.state_dirty = False
+            weather_state_save({'curr_day' : self.work.curr_day,
+                                'max_temps' : self.work.max_temps,
+                                'min_temps' : self.work.min_temps,
+                                'rainfall' : self.work.rainfall})
 
     ###########################################################################
     #
@@ -809,9 +1013,65 @@ class SmDisplay:
     ###########################################################################
     def restore_data(self):
         """restore saved data from disk"""
-        self.max_temps = pickle.load(open("max_temps.p", "rb"))
-        self.min_temps = pickle.load(open("min_temps.p", "rb"))
-        self.rainfall = pickle.load(open("rainfall.p", "rb"))
+        state = weather_state_load()
+        if state is not None:
+            self.work.max_temps = state['max_temps']
+            self.work.min_temps = state['min_temps']
+            self.work.rainfall = state['rainfall']
+            if state['date'] is None:
+                # From the old pickle files, save it in the new format
+                self.save_data()
+            elif state['date'] == datetime.date.today():
+                self.work.curr_day = state['curr_day']
+            else:
+                # Saved on an earlier day, so new_day() will start today over
+                self.work.curr_day = -1
+        self.restore_snapshot()
+        self.publish()
+
+    ###########################################################################
+    #
+    # Save the weather screen's data after a good update so the next start
+    # has something to show right away.  Runs on the worker thread.
+    #
+    ###########################################################################
+    def save_snapshot(self):
+        """Save the last good weather data"""
+        st = self.work
+        weather_snapshot_save({'data' : {key : value for (key, value) in st.data.items()
+                                         if key not in LAYOUT_KEYS},
+                               'temps' : st.temps,
+                               'forecastdetails' : st.forecastdetails,
+                               'sunrise' : st.sunrise,
+                               'sunset' : st.sunset,
+                               'alerts_sent' : st.alerts_sent})
+
+    ###########################################################################
+    #
+    # Start with the weather data saved by the last good update.  It's marked
+    # stale until an update from the providers replaces it.
+    #
+    ###########################################################################
+    def restore_snapshot(self):
+        """Load the last good weather data"""
+        snap = weather_snapshot_load()
+        if snap is None:
+            return
+        st = self.work
+        try:
+            for (key, value) in snap['data'].items():
+                if key not in LAYOUT_KEYS:
+                    st.data[key] = value
+            for key in ('tempcolor', 'barocolor', 'humidcolor'):
+                st.data[key] = tuple(st.data[key])  # json made them lists
+            st.temps = snap['temps']
+            st.forecastdetails = snap['forecastdetails']
+            st.sunrise = snap['sunrise']
+            st.sunset = snap['sunset']
+            st.alerts_sent = snap['alerts_sent']
+            st.data['stale'] = True
+        except (KeyError, TypeError, AttributeError):
+            wg_error_print("restore_snapshot", "Unusable snapshot, ignoring it")
 
     ###########################################################################
     #
@@ -827,19 +1087,53 @@ class SmDisplay:
             color = COLOR_RED
         pygame.draw.line(self.screen, color, (2, self.ymax*0.15),
                          (self.xmax, self.ymax*0.15), BORDER_WIDTH)
+        # Keep what's under the clock so tick_clock() can redraw just the clock
+        self.clock_background = self.screen.subsurface(self.clock_rect()).copy()
+        self.draw_clock()
+
+    ###########################################################################
+    #
+    # The part of the screen the time and date are drawn in (everything
+    # above the line drawn by draw_time_and_date)
+    #
+    ###########################################################################
+    def clock_rect(self):
+        """Return the rectangle the time and date are drawn in"""
+        return pygame.Rect(0, 0, self.xmax, int(self.ymax*0.15) - 2)
+
+    ###########################################################################
+    #
+    # Redraw only the time and date of a screen drawn with draw_time_and_date
+    #
+    ###########################################################################
+    def tick_clock(self):
+        """Update the time and date on the screen that's up"""
+        clock = self.clock_rect()
+        self.screen.blit(self.clock_background, clock)
+        self.draw_clock()
+        pygame.display.update(clock)
 
+    ###########################################################################
+    #
+    # Draw just the time and date text (everything above the line drawn by
+    # draw_time_and_date)
+    #
+    ###########################################################################
+    def draw_clock(self):
+        """Draw the time and date text"""
         # Time & Date
-        font = self.loadfont(FONT_NORMAL, int(self.ymax*self.data['tmdateth']))
-        sfont = self.loadfont(FONT_NORMAL, int(self.ymax*self.data['tmdatesmth']))
+        fsize = int(self.ymax*self.data['tmdateth'])
+        ssize = int(self.ymax*self.data['tmdatesmth'])
 
-        rtm1 = font.render(time.strftime("%a, %b %d   %I:%M", time.localtime()),
-                           True, COLOR_TEXT_NORMAL)
+        rtm1 = self.rendertext(FONT_NORMAL, fsize,
+                               time.strftime("%a, %b %d   %I:%M", time.localtime()),
+                               COLOR_TEXT_NORMAL)
         (tx1, _) = rtm1.get_size()
-        rtm2 = sfont.render(time.strftime("%S", time.localtime()),
-                            True, COLOR_TEXT_NORMAL)
+        rtm2 = self.rendertext(FONT_NORMAL, ssize, time.strftime("%S", time.localtime()),
+                               COLOR_TEXT_NORMAL)
         (tx2, _) = rtm2.get_size()
-        rtm3 = font.render(time.strftime(" %p", time.localtime()),
-                           True, COLOR_TEXT_NORMAL)
+        rtm3 = self.rendertext(FONT_NORMAL, fsize, time.strftime(" %p", time.localtime()),
+                               COLOR_TEXT_NORMAL)
         (tx3, _) = rtm3.get_size()
 
         tpos = self.xmax / 2 - (tx1 + tx2 + tx3) / 2
@@ -848,153 +1142,203 @@ class SmDisplay:
         self.screen.blit(rtm3, (tpos+tx1+tx2, self.data['tmdateypos']))
 
         if self.curr_day != int(time.strftime("%w")): # it's a new day!
-            self.curr_day = int(time.strftime("%w"))
-            self.max_temps[self.curr_day] = 0
-            self.min_temps[self.curr_day] = 0
-            self.rainfall[self.curr_day] = 0
-            self.save_data()
+            # Let the worker reset the history, it owns the data
+            UPDATER.submit("new_day", self.new_day)
+
+    ####################################################################
+    #
+    # Today's sun and moon from the ephemeris table.  It doesn't need the
+    # network, so the almanac keeps up even when the providers don't answer.
+    #
+    def update_almanac(self):
+        """Update the sun and moon times (runs on the worker thread)"""
+        st = self.work
+        try:
+            almanac = ephemeris_almanac()
+            if almanac.sunrise is not None and almanac.sunset is not None:
+                st.sunrise = almanac.sunrise.strftime('%I:%M %p')
+                st.sunset = almanac.sunset.strftime('%I:%M %p')
+            st.data['moonrise'] = ephemeris_time_str(almanac.moonrise)
+            st.data['moonset'] = ephemeris_time_str(almanac.moonset)
+            # There are only icons for days 0-27
+            age = int(round(28 * almanac.lunation))
+            if age > 27:
+                age = 0
+            ostr = 'moon' + str(age)
+            st.data['moonicon'] = saveurltofile(moonphaseurl() + ostr + '.gif', ostr)
+        except Exception: #pylint: disable=W0703
+            wg_error_print("update_almanac", "Unable to update the sun and moon " +
+                           "(Exc value = " + str(sys.exc_info()[1]) + ")")
 
     ####################################################################
     #
     # Get data from local station via weather source
-    def updateweather(self):
-        """Get data from the weather source"""
+    #
+    # Args:
+    #   providers = names of the providers to ask (None for all of them)
+    #
+    def updateweather(self, providers=None):
+        """Get data from the weather source (runs on the worker thread)"""
         wg_trace_print("in updateweather", TRACE)
-        if self.data['temp'] == '??':
+        self.new_day()
+        self.update_almanac()
+        st = self.work
+        # What's on the screen now, to color what has changed
+        obs = st.obs
+        if st.data['temp'] == '??' or obs.temp_c is None:
             oldtemp = TEMP_DEFAULT # keep it from crashing
         else:
-            oldtemp = float(self.data['temp'])
-        oldbaro = float(self.data['baro'])
-        oldhumid = float(self.data['humid'])
+            oldtemp = int(round(c_to_f(obs.temp_c)))
+        if obs.pressure_hpa is None:
+            oldbaro = BARO_DEFAULT
+        else:
+            oldbaro = round(hpa_to_inhg(obs.pressure_hpa), 2)
+        if obs.humidity is None:
+            oldhumid = HUMID_DEFAULT
+        else:
+            oldhumid = int(round(obs.humidity))
 
+        # Ask all the providers at once.  If one of them doesn't answer, we
+        # keep what we had for its fields and use what the others sent.
         weatherdata = dict()
-        if not getweatherdata(weatherdata):
-            self.data['temp'] = '??'
-            self.data['update'] = ''
+        if not fetchweatherdata(weatherdata, providers=providers):
+            if not st.data['stale']:
+                # Keep showing the saved data (marked stale) if that's what we have
+                st.data['temp'] = '??'
+                st.data['update'] = ''
             wg_error_print("updateweather", "Unable to get Weather Data")
-            return
-            
-        if not getPWSdata(weatherdata):
-            self.data['temp'] = '??'
-            self.data['update'] = ''
-            wg_error_print("updateweather", "Unable to get PWS Data")
+            self.publish()
             return
 
-        self.handle_alerts(weatherdata) # send out any new alerts
+        if 'alerts' in weatherdata:
+            self.handle_alerts(weatherdata) # send out any new alerts
 
         try:
-            self.data['update'] = weatherdata['observation_time']
-            wg_trace_print("New Weather " + self.data['update'], TRACE)
-            self.data['temp'] = "%d" % (weatherdata['temp_f'])
-            self.rainfall[self.curr_day] = weatherdata['precip_today_in']
-            wg_trace_print('temp is ' + self.data['temp'], TRACE)
-            if (self.max_temps[self.curr_day] == 0) and (self.min_temps[self.curr_day] == 0):
-                self.min_temps[self.curr_day] = float(self.data['temp'])
-                self.max_temps[self.curr_day] = float(self.data['temp'])
+            # Lay the new observation over the last one, so anything a
+            # provider didn't send this time keeps its last value
+            new_obs = weatherdata.get('obs')
+            if new_obs is not None:
+                obs.update_from(new_obs)
+            if obs.time is not None:
+                st.data['update'] = obs.time.strftime('Upd: %Y-%m-%d %H:%M:%S')
+            wg_trace_print("New Weather " + st.data['update'], TRACE)
+            temp = int(round(c_to_f(obs.temp_c)))
+            st.data['temp'] = "%d" % temp
+            if new_obs is not None and new_obs.rain_today_mm is not None:
+                # The history wants the rain since the last update
+                rain = round(mm_to_in(new_obs.rain_today_mm), 2)
+                tsdb_add("rain", max(rain - st.rainfall[st.curr_day], 0.0))
+                st.rainfall[st.curr_day] = rain
+            wg_trace_print('temp is ' + st.data['temp'], TRACE)
+            if (st.max_temps[st.curr_day] == 0) and (st.min_temps[st.curr_day] == 0):
+                st.min_temps[st.curr_day] = temp
+                st.max_temps[st.curr_day] = temp
                 self.save_data()
             # if the value changed from last time, what color should we now display?
-            if oldtemp == float(TEMP_DEFAULT):
-                self.data['tempcolor'] = COLOR_TEXT_NORMAL
+            if oldtemp == TEMP_DEFAULT:
+                st.data['tempcolor'] = COLOR_TEXT_NORMAL
             else:
-                self.data['tempcolor'] = color_rising_falling(oldtemp, float(self.data['temp']),
-                                                              self.data['tempcolor'])
+                st.data['tempcolor'] = color_rising_falling(oldtemp, temp, st.data['tempcolor'])
             # New record high or low?
-            old_high = int(get_record_data(0, 0, 0, 0, 0)[0])
-            if int(self.data['temp']) > old_high:
-                msg = ("Set new record high temperature of " +
-                       str(self.data['temp']) + ". Old record was " +
-                       str(old_high) + " set in " +
-                       get_record_data(0, 0, 0, 0, 0)[1] + ".")
-                sendtext(msg)
-                get_record_data(1, int(self.data['temp']),
-                                time.localtime().tm_year, 0, 0)
-            old_low = int(get_record_data(0, 0, 0, 0, 0)[2])
-            if int(self.data['temp']) < old_low:
-                msg = ("Set new record low temperature of " +
-                       str(self.data['temp']) + ". Old record was " +
-                       str(old_low) + " set in " +
-                       get_record_data(0, 0, 0, 0, 0)[3] + ".")
-                sendtext(msg)
-                get_record_data(2, 0, 0, int(self.data['temp']),
-                                time.localtime().tm_year)
-            if ((float(self.data['temp']) > oldtemp) and
-                    (float(self.data['temp']) > self.max_temps[self.curr_day])):
-                self.max_temps[self.curr_day] = float(self.data['temp']) # save the new max
+            (old_high, high_year, old_low, low_year) = records_get()
+            # (No text for the first record of a day, there's nothing to beat)
+            if old_high is None or temp > old_high:
+                if old_high is not None:
+                    msg = ("Set new record high temperature of " +
+                           str(temp) + ". Old record was " +
+                           str(old_high) + " set in " +
+                           str(high_year) + ".")
+                    sendtext(msg)
+                records_set_high(temp, time.localtime().tm_year)
+            if old_low is None or temp < old_low:
+                if old_low is not None:
+                    msg = ("Set new record low temperature of " +
+                           str(temp) + ". Old record was " +
+                           str(old_low) + " set in " +
+                           str(low_year) + ".")
+                    sendtext(msg)
+                records_set_low(temp, time.localtime().tm_year)
+            if (temp > oldtemp) and (temp > st.max_temps[st.curr_day]):
+                st.max_temps[st.curr_day] = temp # save the new max
                 self.save_data()
-            elif ((float(self.data['temp']) < oldtemp) and
-                  (float(self.data['temp']) < self.min_temps[self.curr_day])):
-                self.min_temps[self.curr_day] = float(self.data['temp']) # save the new min
+            elif (temp < oldtemp) and (temp < st.min_temps[st.curr_day]):
+                st.min_temps[st.curr_day] = temp # save the new min
                 self.save_data()
-            self.data['curr_cond'] = weatherdata['weather']
-            self.data['windchill'] = "%d" % (int(round(float(weatherdata['windchill']))))
-            self.data['wind_speed'] = "%d" % (int(weatherdata['wind_mph']))
-            self.data['baro'] = weatherdata['pressure_in']
+            if obs.summary is not None:
+                st.data['curr_cond'] = obs.summary
+            if obs.feels_like_c is not None:
+                st.data['windchill'] = "%d" % int(round(c_to_f(obs.feels_like_c)))
+            wind = ms_to_mph(obs.wind_ms)
+            gust = ms_to_mph(obs.gust_ms)
+            st.data['wind_speed'] = "%d" % int(wind)
+            st.data['gust'] = "%d" % int(round(gust))
+            if obs.wind_dir_deg is not None:
+                st.data['wind_dir'] = deg_to_compass(obs.wind_dir_deg)
+            baro = round(hpa_to_inhg(obs.pressure_hpa), 2)
+            st.data['baro'] = "%.2f" % baro
             # if the value changed from last time, what color should we now display?
             if oldbaro == BARO_DEFAULT:
-                self.data['barocolor'] = COLOR_TEXT_NORMAL
+                st.data['barocolor'] = COLOR_TEXT_NORMAL
             else:
-                self.data['barocolor'] = color_rising_falling(oldbaro, float(self.data['baro']),
-                                                              self.data['barocolor'])
-            self.data['wind_dir'] = weatherdata['wind_dir']
-            self.data['humid'] = weatherdata['relative_humidity'].rstrip('%')
+                st.data['barocolor'] = color_rising_falling(oldbaro, baro, st.data['barocolor'])
+            humid = int(round(obs.humidity))
+            st.data['humid'] = "%d" % humid
             wg_trace_print("Sending WU Data to ThingSpeak", TRACE)
             # Tell ThingSpeak what the temperature, humidity, & barometric pressure is
-            thingspeaksendfloatnum(TS_WEATHER_CHAN, 3, "1",
-                                   self.data['temp'], "2",
-                                   self.data['baro'], "3",
-                                   self.data['humid'], "", 0, TRACE)
+            thingspeaksendfloatnum(TS_WEATHER_CHAN, 3, "1", temp, "2", baro, "3", humid,
+                                   "", 0, TRACE)
             # if the value changed from last time, what color should we now display?
             if oldhumid == HUMID_DEFAULT:
-                self.data['humidcolor'] = COLOR_TEXT_NORMAL
+                st.data['humidcolor'] = COLOR_TEXT_NORMAL
             else:
-                self.data['humidcolor'] = color_rising_falling(oldhumid, float(self.data['humid']),
-                                                               self.data['humidcolor'])
-            self.data['vis'] = weatherdata['visibility_mi']
-            self.data['gust'] = '%s' % (int(round(float(weatherdata['wind_gust_mph']))))
-            wg_trace_print("forecast data", TRACE)
-            wg_trace_pprint(weatherdata['fc'], TRACE)
-            wg_trace_pprint(weatherdata['fctxt'], TRACE)
-            i = 0
-            for day in weatherdata['fc']:
-                self.data['day'][i] = day['name']
-                self.temps[i][0] = day['high_f']
-                self.temps[i][1] = day['low_f']
-                self.data['rain'][i] = day['icon']
-                self.data['icon'][i] = "./icons/" + day['icon_url']
-                i = i + 1
-                if i > 3:
-                    break
-            # There are two forecast details per day (day and night)
-            i = 0
-            for day in weatherdata['fctxt']:
-                self.forecastdetails[i] = day['fcttext']
-                i = i + 1
-                if i > 3:
-                    break
-            wg_trace_print("Sun and moon data", TRACE)
-            self.sunrise = weatherdata['sunrise']
-            self.sunset = weatherdata['sunset']
-            self.data['moonrise'] = weatherdata['moonrise']
-            self.data['moonset'] = weatherdata['moonset']
-            # There are only icons for days 0-27
-            if weatherdata['ageOfMoon'] > 27:
-                weatherdata['ageOfMoon'] = 0
-            ostr = 'moon'+str(weatherdata['ageOfMoon'])
-            self.data['moonicon'] = saveurltofile(moonphaseurl() + ostr + '.gif', ostr)
-            wg_trace_print('temp is ' + self.data['temp'], TRACE)
+                st.data['humidcolor'] = color_rising_falling(oldhumid, humid,
+                                                             st.data['humidcolor'])
+            if obs.visibility_m is not None:
+                st.data['vis'] = round(m_to_miles(obs.visibility_m), 1)
+            tsdb_add("temp", temp)
+            tsdb_add("humidity", humid)
+            tsdb_add("pressure", baro)
+            tsdb_add("wind", wind)
+            tsdb_add("gust", gust)
+            # Only the forecast provider sends the forecast.  Keep the last
+            # one we got if it didn't answer this time.
+            if 'forecast' in weatherdata:
+                wg_trace_print("forecast data", TRACE)
+                wg_trace_pprint(weatherdata['forecast'], TRACE)
+                st.forecast = weatherdata['forecast'][:4]
+                for (i, day) in enumerate(st.forecast):
+                    st.data['day'][i] = day.date.strftime("%A")
+                    st.temps[i] = ["%d°F" % round(c_to_f(day.high_c)),
+                                   "%d°F" % round(c_to_f(day.low_c))]
+                    st.data['rain'][i] = forecast_condition(day.icon)
+                    st.data['icon'][i] = "./icons/" + day.icon + ".gif"
+                    st.forecastdetails[i] = day.summary
+            wg_trace_print('temp is ' + st.data['temp'], TRACE)
+            st.data['stale'] = False
+            good = True
         except:
             wg_error_print("updateweather", "Weather Collection Error #2")
             wg_trace_pprint(weatherdata, True)
-            self.data['temp'] = '??'
-            self.data['update'] = ''
+            st.data['temp'] = '??'
+            st.data['update'] = ''
+            good = False
 
+        self.publish()
+        if good:
+            self.save_snapshot()
         self.log_research_data()
 
     ####################################################################
-    def disp_weather(self):
-        """OUtput weather screen display"""
-        # Fill the screen with black
-        self.screen.fill(COLOR_BACKGROUND)
+    #
+    # The weather screen is drawn in layers.  The frame (borders, tabs and
+    # labels) only changes with the alert color and the data only changes
+    # when a new snapshot comes in, so they are drawn off screen once.  Every
+    # second, only the clock is redrawn on top of them and only that part
+    # of the display is updated.
+    #
+    ####################################################################
+    def draw_weather_frame(self, surf):
+        """Draw the parts of the weather screen that don't depend on the data"""
         xmin = 2
         xmax = self.xmax
         ymax = self.ymax
@@ -1006,19 +1350,14 @@ class SmDisplay:
         lnclr = COLOR_TEXT_NORMAL
         fnt = FONT_NORMAL
 
-        tempchar = "F"
-        barpressstr = "\"Hg"
-        speedstr = "mph"
-        if self.data['temp'] != "??":
-            if (int(self.data['temp']) > 99) or (int(self.data['temp']) < -9):   # three digits
-                tempchar = ""              # get rid of the character for F or C
-
-        MYDISP.draw_screen_outline()
+        surf.fill(COLOR_BACKGROUND)
+        self.draw_screen_outline(surf)
         # .15 is 15% down from the top of the screen for date/time underline
-        pygame.draw.line(self.screen, color, (xmin, ymax*0.5), (xmax, ymax*0.5), BORDER_WIDTH)
-        pygame.draw.line(self.screen, color, (xmax*0.25, ymax*0.5), (xmax*0.25, ymax), BORDER_WIDTH)
-        pygame.draw.line(self.screen, color, (xmax*0.5, ymax*0.15), (xmax*0.5, ymax), BORDER_WIDTH)
-        pygame.draw.line(self.screen, color, (xmax*0.75, ymax*0.5), (xmax*0.75, ymax), BORDER_WIDTH)
+        pygame.draw.line(surf, color, (2, ymax*0.15), (xmax, ymax*0.15), BORDER_WIDTH)
+        pygame.draw.line(surf, color, (xmin, ymax*0.5), (xmax, ymax*0.5), BORDER_WIDTH)
+        pygame.draw.line(surf, color, (xmax*0.25, ymax*0.5), (xmax*0.25, ymax), BORDER_WIDTH)
+        pygame.draw.line(surf, color, (xmax*0.5, ymax*0.15), (xmax*0.5, ymax), BORDER_WIDTH)
+        pygame.draw.line(surf, color, (xmax*0.75, ymax*0.5), (xmax*0.75, ymax), BORDER_WIDTH)
 
         # remember rectangles for button presses
         FORECAST_BUTTONS[0][0] = xmin       # left
@@ -1031,23 +1370,51 @@ class SmDisplay:
             FORECAST_BUTTONS[i][2] = (xmax-xmin)*0.25               # width
             FORECAST_BUTTONS[i][3] = ymax - FORECAST_BUTTONS[i][1]  # height
 
-        # Time and date at the top of the scrren
-        MYDISP.draw_time_and_date()
         # Draw tabs
-        MYDISP.draw_tabs(TAB_WEATHER)
+        self.draw_tabs(TAB_WEATHER, surf)
+
+        # Condition labels
+        yst = 0.16    # Yaxis Start Pos
+        gap = 0.065   # Line Spacing Gap
+        xsp = 0.52    # Xaxis Start Pos
+        fsize = int(ymax*TEXT_HEIGHT_SMALL)
+        line = 0
+        for label in ('Feels Like', 'Windspeed:', 'Direction:', 'Barometer:', 'Humidity:'):
+            txt = self.rendertext(fnt, fsize, label, lnclr)
+            surf.blit(txt, (xmax*xsp, ymax*(yst+gap*line)))
+            line = line + 1
+
+    ####################################################################
+    def draw_weather_data(self, surf):
+        """Draw the weather data on top of the weather screen frame"""
+        xmax = self.xmax
+        ymax = self.ymax
+        lnclr = COLOR_TEXT_NORMAL
+        fnt = FONT_NORMAL
+
+        tempchar = "F"
+        barpressstr = "\"Hg"
+        speedstr = "mph"
+        if self.data['temp'] != "??":
+            if (int(self.data['temp']) > 99) or (int(self.data['temp']) < -9):   # three digits
+                tempchar = ""              # get rid of the character for F or C
 
         # Outside Temp
-        font = self.loadfont(fnt, int(ymax*(0.5-0.15)*0.9))
+        fsize = int(ymax*(0.5-0.15)*0.9)
         wg_trace_print('temp is ' + self.data['temp'], TRACE)
-        txt = font.render(self.data['temp'], True, self.data['tempcolor'])
+        if self.data['stale']:
+            tempcolor = COLOR_GREY  # not heard from the providers yet
+        else:
+            tempcolor = self.data['tempcolor']
+        txt = self.rendertext(fnt, fsize, self.data['temp'], tempcolor)
         (twid, _) = txt.get_size()
-        dfont = self.loadfont(fnt, int(ymax*(0.5-0.15)*0.5))
-        dtxt = dfont.render("°" + tempchar, True, lnclr)
+        dsize = int(ymax*(0.5-0.15)*0.5)
+        dtxt = self.rendertext(fnt, dsize, "°" + tempchar, lnclr)
         (tx2, _) = dtxt.get_size()
         magic = xmax*0.27 - (twid*1.02 + tx2) / 2
-        self.screen.blit(txt, (magic, ymax*0.15))
+        surf.blit(txt, (magic, ymax*0.15))
         magic = magic + (twid*1.02)
-        self.screen.blit(dtxt, (magic, ymax*0.2))
+        surf.blit(dtxt, (magic, ymax*0.2))
 
         # Conditions
         yst = 0.16    # Yaxis Start Pos
@@ -1055,47 +1422,36 @@ class SmDisplay:
         txthei = TEXT_HEIGHT_SMALL    # Text Height
         dshei = 0.05    # Degree Symbol Height
         dsyo = 0.01    # Degree Symbol Yaxis Offset
-        xsp = 0.52    # Xaxis Start Pos
         x2col = 0.78    # Second Column Xaxis Start Pos
 
-        font = self.loadfont(fnt, int(ymax*txthei))
-        txt = font.render('Feels Like', True, lnclr)
-        self.screen.blit(txt, (xmax*xsp, ymax*yst))
-        txt = font.render(self.data['windchill'], True, lnclr)
-        self.screen.blit(txt, (xmax*x2col, ymax*yst))
+        fsize = int(ymax*txthei)
+        txt = self.rendertext(fnt, fsize, self.data['windchill'], lnclr)
+        surf.blit(txt, (xmax*x2col, ymax*yst))
         (twid, _) = txt.get_size()
-        dfont = self.loadfont(fnt, int(ymax*dshei))
-        dtxt = dfont.render("°" + tempchar, True, lnclr)
-        self.screen.blit(dtxt, (xmax*x2col+twid*1.01, ymax*(yst+dsyo)))
+        dsize = int(ymax*dshei)
+        dtxt = self.rendertext(fnt, dsize, "°" + tempchar, lnclr)
+        surf.blit(dtxt, (xmax*x2col+twid*1.01, ymax*(yst+dsyo)))
 
-        txt = font.render('Windspeed:', True, lnclr)
-        self.screen.blit(txt, (xmax*xsp, ymax*(yst+gap*1)))
         if self.data['wind_speed'] == "calm":
-            txt = font.render(self.data['wind_speed'], True, lnclr)
+            txt = self.rendertext(fnt, fsize, self.data['wind_speed'], lnclr)
         else:
-            txt = font.render(self.data['wind_speed'] + " " + speedstr, True, lnclr)
-        self.screen.blit(txt, (xmax*x2col, ymax*(yst+gap*1)))
-
-        txt = font.render('Direction:', True, lnclr)
-        self.screen.blit(txt, (xmax*xsp, ymax*(yst+gap*2)))
-        txt = font.render(self.data['wind_dir'].upper(), True, lnclr)
-        self.screen.blit(txt, (xmax*x2col, ymax*(yst+gap*2)))
-
-        txt = font.render('Barometer:', True, lnclr)
-        self.screen.blit(txt, (xmax*xsp, ymax*(yst+gap*3)))
-        txt = font.render(self.data['baro'], True, self.data['barocolor'])
-        self.screen.blit(txt, (xmax*x2col, ymax*(yst+gap*3)))
+            txt = self.rendertext(fnt, fsize, self.data['wind_speed'] + " " + speedstr, lnclr)
+        surf.blit(txt, (xmax*x2col, ymax*(yst+gap*1)))
+
+        txt = self.rendertext(fnt, fsize, self.data['wind_dir'].upper(), lnclr)
+        surf.blit(txt, (xmax*x2col, ymax*(yst+gap*2)))
+
+        txt = self.rendertext(fnt, fsize, self.data['baro'], self.data['barocolor'])
+        surf.blit(txt, (xmax*x2col, ymax*(yst+gap*3)))
         (tx2, _) = txt.get_size()
-        txt = font.render(" " + barpressstr, True, lnclr)
-        self.screen.blit(txt, (xmax*x2col+tx2, ymax*(yst+gap*3)))
+        txt = self.rendertext(fnt, fsize, " " + barpressstr, lnclr)
+        surf.blit(txt, (xmax*x2col+tx2, ymax*(yst+gap*3)))
 
-        txt = font.render('Humidity:', True, lnclr)
-        self.screen.blit(txt, (xmax*xsp, ymax*(yst+gap*4)))
-        txt = font.render(self.data['humid'], True, self.data['humidcolor'])
-        self.screen.blit(txt, (xmax*x2col, ymax*(yst+gap*4)))
+        txt = self.rendertext(fnt, fsize, self.data['humid'], self.data['humidcolor'])
+        surf.blit(txt, (xmax*x2col, ymax*(yst+gap*4)))
         (tx2, _) = txt.get_size()
-        txt = font.render('%', True, lnclr)
-        self.screen.blit(txt, (xmax*x2col+tx2, ymax*(yst+gap*4)))
+        txt = self.rendertext(fnt, fsize, '%', lnclr)
+        surf.blit(txt, (xmax*x2col+tx2, ymax*(yst+gap*4)))
 
         swcent = 0.125           # Sub Window Centers
         swy = 0.510           # Sub Windows Yaxis Start
@@ -1103,7 +1459,7 @@ class SmDisplay:
         gap = 0.065           # Line Spacing Gap
         rpl = 5.95            # Rain percent line offset.
 
-        font = self.loadfont(fnt, int(ymax*txthei))
+        fsize = int(ymax*txthei)
 
         dyi = -1
         for _ in self.data['day']:
@@ -1113,36 +1469,61 @@ class SmDisplay:
                 dytxt = "Today"
             else:
                 dytxt = self.data['day'][dyi]
-            txt = font.render(dytxt + ':', True, lnclr)
+            txt = self.rendertext(fnt, fsize, dytxt + ':', lnclr)
             (twid, _) = txt.get_size()
-            self.screen.blit(txt, (xmax*swcent*((dyi*2)+1)-twid/2, ymax*(swy+gap*0)))
-            txt = font.render(self.temps[dyi][0] + ' / ' + self.temps[dyi][1], True, lnclr)
+            surf.blit(txt, (xmax*swcent*((dyi*2)+1)-twid/2, ymax*(swy+gap*0)))
+            txt = self.rendertext(fnt, fsize, self.temps[dyi][0] + ' / ' + self.temps[dyi][1],
+                                  lnclr)
             (twid, _) = txt.get_size()
-            self.screen.blit(txt, (xmax*swcent*((dyi*2)+1)-twid/2, ymax*(swy+gap*5)))
-            txt = font.render(self.data['rain'][dyi], True, lnclr)
+            surf.blit(txt, (xmax*swcent*((dyi*2)+1)-twid/2, ymax*(swy+gap*5)))
+            txt = self.rendertext(fnt, fsize, self.data['rain'][dyi], lnclr)
             (twid, _) = txt.get_size()
-            self.screen.blit(txt, (xmax*swcent*((dyi*2)+1)-twid/2, ymax*(swy+gap*rpl)))
+            surf.blit(txt, (xmax*swcent*((dyi*2)+1)-twid/2, ymax*(swy+gap*rpl)))
             try:
                 # icons have been saved to disk when we got the weather forecast/q/
                 # so as to avoid continually going out on the Internet
-                icon = pygame.image.load(os.path.join(RUNNING_LOC, self.data['icon'][dyi]))
-                (iwid, ihei) = icon.get_size()
                 if self.data['scaleicon']:
-                    icon2 = pygame.transform.scale(icon, (int(iwid*1.5), int(ihei*1.5)))
-                    (iwid, ihei) = icon2.get_size()
-                    icon = icon2
+                    icon = self.loadimage(self.data['icon'][dyi], 1.5)
+                else:
+                    icon = self.loadimage(self.data['icon'][dyi])
+                (iwid, ihei) = icon.get_size()
                 if ihei < 90:
                     yout = (90 - ihei) / 2
                 else:
                     yout = 0
-                self.screen.blit(icon, (xmax*swcent*((dyi*2)+1)-iwid/2, ymax*(swy+gap*1.2)+yout))
+                surf.blit(icon, (xmax*swcent*((dyi*2)+1)-iwid/2, ymax*(swy+gap*1.2)+yout))
             except:
                 # nothing.  We hope it works next time
                 wg_error_print("disp_weather",
-                               "Icon error: " + dytxt + " " + self.data['icon'][dyi])
+                               "Icon error: " + dytxt + " " + str(self.data['icon'][dyi]))
 
-        # Update the display
-        pygame.display.update()
+    ####################################################################
+    def disp_weather(self):
+        """OUtput weather screen display"""
+        alerts = bool(self.alerts_sent)
+        if self.weather_frame is None or self.weather_frame_alerts != alerts:
+            self.weather_frame = self.screen.copy()
+            self.draw_weather_frame(self.weather_frame)
+            self.weather_frame_alerts = alerts
+            self.weather_layer_version = -1
+        if self.weather_layer_version != self.data_version:
+            self.weather_layer = self.weather_frame.copy()
+            self.draw_weather_data(self.weather_layer)
+            self.weather_layer_version = self.data_version
+            self.shown = None # the whole screen has to be updated
+            wg_trace_print("text cache: %d hits, %d misses" %
+                           (self.text_hits, self.text_misses), TRACE)
+
+        clock = self.clock_rect()
+        if self.shown != TAB_WEATHER:
+            self.screen.blit(self.weather_layer, (0, 0))
+            self.draw_clock()
+            pygame.display.update()
+            self.shown = TAB_WEATHER
+        else:
+            self.screen.blit(self.weather_layer, clock, clock)
+            self.draw_clock()
+            pygame.display.update(clock)
 
     ####################################################################
     def disp_alert(self):
@@ -1159,13 +1540,13 @@ class SmDisplay:
         # Draw tabs
         MYDISP.draw_tabs(TAB_ALERT)
 
-        sfont = self.loadfont(FONT_NORMAL, int(self.ymax*self.data['subwinth']))
+        ssize = int(self.ymax*self.data['subwinth'])
         printline = 4
 
         # No alert, say so
         if not self.alerts_sent:
             printline = printline + 1
-            txt = sfont.render("No alert!", True, COLOR_TEXT_NORMAL)
+            txt = self.rendertext(FONT_NORMAL, ssize, "No alert!", COLOR_TEXT_NORMAL)
             self.screen.blit(txt, (self.xmax*0.05, self.ymax*0.05*printline))
         else:
             # Just do the last alert
@@ -1173,7 +1554,7 @@ class SmDisplay:
             for line in textwrap.wrap(self.alerts_sent[len(self.alerts_sent) - 1], 50,
                                       subsequent_indent="  "):
                 printline = printline + 1
-                txt = sfont.render(line, True, COLOR_TEXT_NORMAL)
+                txt = self.rendertext(FONT_NORMAL, ssize, line, COLOR_TEXT_NORMAL)
                 self.screen.blit(txt, (self.xmax*0.05, self.ymax*0.05*printline))
                 i = i + 1
                 if i == max_lines:
@@ -1181,15 +1562,24 @@ class SmDisplay:
 
         # Update the display
         pygame.display.update()
+        self.shown = TAB_ALERT
 
     ####################################################################
-    def sprint(self, ostr, font, xpix, lnum, clr):
-        """Print ostr in the requested font and color starting at the requested spot"""
-        fstr = font.render(ostr, True, clr)
+    def sprint(self, ostr, size, xpix, lnum, clr):
+        """Print ostr in the requested size and color starting at the requested spot"""
+        fstr = self.rendertext(FONT_NORMAL, size, ostr, clr)
         self.screen.blit(fstr, (xpix, self.ymax*0.075*lnum))
 
     ####################################################################
-    def disp_almanac(self, isindaylight, dayhrs, daymins, tdaylight, tdarkness):
+    def almanac_countdown(self):
+        """Return the time until the next sunrise or sunset, as shown"""
+        (isindaylight, _, _, tdaylight, tdarkness) = self.almanac.daylight()
+        if isindaylight:
+            return "Sunset in (Hrs:Min): %d:%02d" % stot(tdarkness)
+        return "Sunrise in (Hrs:Min): %d:%02d" % stot(tdaylight)
+
+    ####################################################################
+    def disp_almanac(self):
         """Display the almanac screen"""
         # Fill the screen with black
         self.screen.fill(COLOR_BACKGROUND)
@@ -1209,29 +1599,27 @@ class SmDisplay:
         # Draw tabs
         MYDISP.draw_tabs(TAB_ALMANAC)
 
-        sfont = self.loadfont(FONT_NORMAL, int(self.ymax*self.data['tmdatesmth']))
+        ssize = int(self.ymax*self.data['tmdatesmth'])
         printline = 3
         ostr = "Sun Rise/Set %s / %s" % (self.sunrise, self.sunset)
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
 
         printline = printline + 1
+        (_, dayhrs, daymins, _, _) = self.almanac.daylight()
         ostr = "Daylight (Hrs:Min): %d:%02d" % (dayhrs, daymins)
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
 
         printline = printline + 1
-        if isindaylight:
-            ostr = "Sunset in (Hrs:Min): %d:%02d" % stot(tdarkness)
-        else:
-            ostr = "Sunrise in (Hrs:Min): %d:%02d" % stot(tdaylight)
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.almanac_shown = self.almanac_countdown()
+        self.sprint(self.almanac_shown, ssize, xmax*0.05, printline, lcol)
 
         printline = printline + 1
         ostr = self.data['update']
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
 
         printline = printline + 1
         ostr = "Current Cond: %s" % self.data['curr_cond']
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
 
         printline = printline + 1
         ostr = (self.data['temp'] + "°" + tempchar + " " +
@@ -1241,7 +1629,7 @@ class SmDisplay:
         if self.data['gust'] != 'N/A':
             ostr = ostr + ' (g ' + str(self.data['gust']) + ') '
         ostr = ostr + speedstr
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
 
         printline = printline + 1
         if self.data['vis'] == 0:
@@ -1249,28 +1637,33 @@ class SmDisplay:
         else:
             ostr = ("Visability %s" % self.data['vis'] +
                     tempvisstr)
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
 
         printline = printline + 1
         ostr = "Moon Rise/Set %s / %s" % (self.data['moonrise'], self.data['moonset'])
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
         
         # Display record highs and lows
         printline = printline + 1
-        records = get_record_data(0, 0, 0, 0, 0)
-        ostr = "Record high / low %d (%d) / %d (%d)" % (records[0],
-                                                        records[1],
-                                                        records[2],
-                                                        records[3])
-        self.sprint(ostr, sfont, xmax*0.05, printline, lcol)
+        records = records_get()
+        ostr = "Record high / low %s (%s) / %s (%s)" % tuple(record_str(value)
+                                                             for value in records)
+        self.sprint(ostr, ssize, xmax*0.05, printline, lcol)
 
         # Moon phase
-        icon = pygame.image.load(os.path.join(RUNNING_LOC, self.data['moonicon']))
-        (iwid, ihei) = icon.get_size()
-        self.screen.blit(icon, (xmax-iwid-2, ymax-ihei))
+        # (there's no icon until the first update has downloaded it)
+        if self.data['moonicon']:
+            try:
+                icon = self.loadimage(self.data['moonicon'])
+                (iwid, ihei) = icon.get_size()
+                self.screen.blit(icon, (xmax-iwid-2, ymax-ihei))
+            except:
+                # nothing.  We hope it works next time
+                wg_error_print("disp_almanac", "Icon error: " + str(self.data['moonicon']))
 
         # Update the display
         pygame.display.update()
+        self.shown = TAB_ALMANAC
 
 
     ####################################################################
@@ -1285,16 +1678,14 @@ class SmDisplay:
         # Draw tabs
         MYDISP.draw_tabs(TAB_HISTORY)
 
-        sfont = self.loadfont(FONT_NORMAL, int(self.ymax*self.data['tmdatesmth']))
+        ssize = int(self.ymax*self.data['tmdatesmth'])
 
         # Display record highs and lows
-        wb = load_workbook(filename = "Records.xlsx", data_only=True)
-        ws = wb["Sheet1"]
-        records = get_record_data(0, 0, 0, 0, 0)
-        ostr = "Record high is %d on %d" % (records[0], records[1])
-        self.sprint(ostr, sfont, self.xmax*0.05, 3, COLOR_TEXT_NORMAL)
-        ostr = "Record low is %d on %d" % (records[2], records[3])
-        self.sprint(ostr, sfont, self.xmax*0.05, 4, COLOR_TEXT_NORMAL)
+        records = records_get()
+        ostr = "Record high is %s on %s" % (record_str(records[0]), record_str(records[1]))
+        self.sprint(ostr, ssize, self.xmax*0.05, 3, COLOR_TEXT_NORMAL)
+        ostr = "Record low is %s on %s" % (record_str(records[2]), record_str(records[3]))
+        self.sprint(ostr, ssize, self.xmax*0.05, 4, COLOR_TEXT_NORMAL)
         # Display daily min and max temps
         tempchar = "F"
         i = self.curr_day
@@ -1304,13 +1695,14 @@ class SmDisplay:
                 ostr = "%s - Min: %d°%s, Max: %d°%s, Rain: %s%s" % (DAY_NAMES[i], self.min_temps[i],
                                                         tempchar, self.max_temps[i], tempchar,
                                                         self.rainfall[i], rainunits)
-                self.sprint(ostr, sfont, self.xmax*0.05, 5+j, COLOR_TEXT_NORMAL)
+                self.sprint(ostr, ssize, self.xmax*0.05, 5+j, COLOR_TEXT_NORMAL)
             i = i - 1
             if i == -1:
                 i = 6
 
         # Update the display
         pygame.display.update()
+        self.shown = TAB_HISTORY
 
     ####################################################################
     #
@@ -1328,16 +1720,17 @@ class SmDisplay:
         MYDISP.draw_tabs(TAB_DETAILS)
 
         printline = 4
-        sfont = self.loadfont(FONT_NORMAL, int(self.ymax*self.data['subwinth']))
-        txt = sfont.render(self.data['day'][period], True, COLOR_TEXT_NORMAL)
+        ssize = int(self.ymax*self.data['subwinth'])
+        txt = self.rendertext(FONT_NORMAL, ssize, self.data['day'][period], COLOR_TEXT_NORMAL)
         self.screen.blit(txt, (self.xmax*0.05, self.ymax*0.05*printline))
         for oline in textwrap.wrap(self.forecastdetails[period], 50, subsequent_indent="  "):
             printline = printline + 1
-            txt = sfont.render(oline, True, COLOR_TEXT_NORMAL)
+            txt = self.rendertext(FONT_NORMAL, ssize, oline, COLOR_TEXT_NORMAL)
             self.screen.blit(txt, (self.xmax*0.05, self.ymax*0.05*printline))
 
         # Update the display
         pygame.display.update()
+        self.shown = TAB_DETAILS
 
     # Save a jpg image of the screen.
     ####################################################################
@@ -1346,6 +1739,30 @@ class SmDisplay:
         pygame.image.save(self.screen, "screenshot.jpeg")
         wg_trace_print("Screen capture complete.", TRACE)
 
+    ####################################################################
+    #
+    # Debug overlay: the calls that have taken the most time, drawn over
+    # the bottom of whatever screen is up.  The text changes every time, so
+    # it doesn't go through the text cache.
+    #
+    ####################################################################
+    def draw_metrics_overlay(self):
+        """Draw the timings of the slowest calls over the screen"""
+        font = self.loadfont(FONT_MONO, int(self.ymax * 0.03))
+        lines = (["kind     target               count err  avg ms  max ms last ms"] +
+                 wg_metrics_summary(METRICS_OVERLAY_LINES))
+        height = font.get_linesize() * len(lines) + 4
+        area = pygame.Rect(0, self.ymax - height, self.xmax, height)
+        shade = pygame.Surface(area.size)
+        shade.set_alpha(200)
+        shade.fill(COLOR_BACKGROUND)
+        self.screen.blit(shade, area)
+        for (i, line) in enumerate(lines):
+            self.screen.blit(font.render(line, True, COLOR_TEXT_NORMAL),
+                             (area.x + 2, area.y + 2 + i * font.get_linesize()))
+        pygame.display.update(area)
+        self.shown = None # redraw the whole screen when the overlay goes away
+
 # Helper function to which takes seconds and returns (hours, minutes).
 ############################################################################
 def stot(sec):
@@ -1355,68 +1772,65 @@ def stot(sec):
     return (hrs, minutes % 60)
 
 
-# Given a sunrise and sunset time string (sunrise example format '7:00 AM'),
-# return true if current local time is between sunrise and sunset. In other
-# words, return true if it's daytime and the sun is up. Also, return the
-# number of hours:minutes of daylight in this day. Lastly, return the number
-# of seconds until daybreak and sunset. If it's dark, daybreak is set to the
-# number of seconds until sunrise. If it daytime, sunset is set to the number
-# of seconds until the sun sets.
+###############################################################################
 #
-# So, five things are returned as:
-#  ( indaylight, Hours, Minutes, secToSun, secToDark).
-############################################################################
-def daylight(buff):
-    """Calculated daylight time"""
-    isindaylight = False  # Default return code.
-
-    # Get current datetime with tz's local day and time.
-    tnow = datetime.datetime.now()
-
-    # From a string like '7:00 AM', build a datetime variable for
-    # today with the hour and minute set to sunrise.
-    ttime = time.strptime(buff, '%I:%M %p')     # Temp Var
-    tsunrise = tnow                 # Copy time now.
-    # Overwrite hour and minute with sunrise hour and minute.
-    tsunrise = tsunrise.replace(hour=ttime.tm_hour, minute=ttime.tm_min, second=0)
-
-    # From a string like '8:00 PM', build a datetime variable for
-    # today with the hour and minute set to sunset.
-    ttime = time.strptime(MYDISP.sunset, '%I:%M %p')
-    tsunset = tnow                  # Copy time now.
-    # Overwrite hour and minute with sunset hour and minute.
-    tsunset = tsunset.replace(hour=ttime.tm_hour, minute=ttime.tm_min, second=0)
-
-    # Test if current time is between sunrise and sunset.
-    if tsunrise < tnow < tsunset:
-        isindaylight = True       # We're in Daytime
-        tdarkness = tsunset - tnow  # Delta seconds until dark.
-        tdaylight = 0           # Seconds until daylight
-    else:
-        isindaylight = False      # We're in Nighttime
-        tdarkness = 0           # Seconds until dark.
-        # Delta seconds until daybreak.
-        if tnow > tsunset:
-            # Must be evening - compute sunrise as time left today
-            # plus time from midnight tomorrow.
-            tmidnight = tnow.replace(hour=23, minute=59, second=59)
-            tnext = tnow.replace(hour=0, minute=0, second=0)
-            tdaylight = (tmidnight - tnow) + (tsunrise - tnext)
-        else:
-            # Else, must be early morning hours. Time to sunrise is
-            # just the delta between sunrise and now.
-            tdaylight = tsunrise - tnow
+# The sun has come up or gone down (called by MYDISP.almanac.check())
+#
+def almanac_event(event, when):
+    """Redraw for a sunrise or sunset"""
+    wg_trace_print("It's " + event + " (" + str(when) + ")", TRACE)
+    pygame.event.post(pygame.event.Event(EVT_ALMANAC))
 
-    # Compute the delta time (in seconds) between sunrise and set.
-    ddaysec = tsunset - tsunrise        # timedelta in seconds
-    (dayhrs, daymin) = stot(ddaysec)  # split into hours and minutes.
+###############################################################################
+#
+# Ask for an EVT_TICK just after the clock's next second starts.  Setting the
+# timer replaces the last one, so re-arming it on every tick keeps the ticks
+# lined up with the clock.
+#
+def arm_clock_tick():
+    """Set the timer for the next clock tick"""
+    pygame.time.set_timer(EVT_TICK, 1001 - int((time.time() % 1.0) * 1000))
 
-    return (isindaylight, dayhrs, daymin, tdaylight, tdarkness)
+###############################################################################
+#
+# Draw the screen for a mode.
+# Args:
+#   mode = 'w', 'a', '!', 'h' or 'd'
+#   full = redraw everything (new mode or new data), otherwise only what
+#          changes from one second to the next
+#
+def show_screen(mode, full):
+    """Draw (or update) the screen for a mode"""
+    if mode == 'w':
+        # disp_weather knows which parts of the screen have changed
+        with wg_metrics_timer("frame", "weather"):
+            MYDISP.disp_weather()
+    elif mode == 'a':
+        # The time until sunrise/sunset only changes once a minute
+        if (not full and MYDISP.shown == TAB_ALMANAC and
+                MYDISP.almanac_shown == MYDISP.almanac_countdown()):
+            MYDISP.tick_clock()
+            return
+        with wg_metrics_timer("frame", "almanac"):
+            MYDISP.disp_almanac()
+    else:
+        tab = {'!' : TAB_ALERT, 'h' : TAB_HISTORY, 'd' : TAB_DETAILS}[mode]
+        if not full and MYDISP.shown == tab:
+            MYDISP.tick_clock()
+            return
+        with wg_metrics_timer("frame", {'!' : "alert", 'h' : "history", 'd' : "details"}[mode]):
+            if mode == '!':
+                MYDISP.disp_alert()
+            elif mode == 'h':
+                MYDISP.disp_history()
+            else:
+                MYDISP.disp_details(DETAILS_DAY) # today by default
 
 #==============================================================
 #==============================================================
 
 # Create the .pid file for monit to monitor this process
+wg_profile_mark("imports")
 pid = str(os.getpid())
 pidfile = "/tmp/weather.pid"
 open(pidfile, 'w').write(pid)
@@ -1428,49 +1842,87 @@ DETAILS_DAY = 0
 
 # Create an instance of the lcd display class.
 MYDISP = SmDisplay()
+wg_profile_mark("SmDisplay()")
+# All network, thermostat and spreadsheet work is done in the background so
+# the display never waits on it
+UPDATER = WGWorker("updater", TRACE)
+# What runs when.  The first runs happen right away, in this order.
+SCHEDULER = WGScheduler(UPDATER, trace=TRACE)
+SCHEDULER.add("forecast", FORECAST_INTERVAL, update_forecast)
+SCHEDULER.add("thermostat", THERMOSTAT_INTERVAL, update_thermostat)
+SCHEDULER.add("current", CURRENT_INTERVAL, update_current, delay=CURRENT_INTERVAL)
+SCHEDULER.add("thingspeak", THINGSPEAK_INTERVAL, thingspeakflush, TRACE)
+SCHEDULER.add("history", HISTORY_INTERVAL, save_history, delay=HISTORY_INTERVAL)
 
 RUNNING = True      # Stay running while True
-SECS = 0           # Seconds Placeholder to pace display.
-DISPTO = 0      # Display timeout to automatically switch back to weather display.
+DISPTO = time.monotonic()   # When the mode was picked (to go back to the weather display)
+OVERLAY = False     # Show the debug overlay?
 
+# The history, and the weather saved by the last good update (shown as stale
+# until the first update finishes)
 MYDISP.restore_data()
-# Loads data from Weather.com into class variables.
-MYDISP.updateweather()
-wg_trace_print('temp is ' + MYDISP.data['temp'], TRACE)
-updateinsidedata()
-furnacefancontrol()
+wg_profile_mark("restore_data()")
+# Listen for the Tempest hub's broadcasts (we'll use the WeatherFlow servers
+# if we can't)
+tempest_udp_start()
+# Timings for Prometheus (see wg_metrics)
+wg_metrics_serve()
+# Load (or make, once a year) the sun and moon table before the first update
+UPDATER.submit("ephemeris", ephemeris_day)
+UPDATER.start()
+wg_profile_mark("start threads")
+
+MYDISP.almanac.add_listener(almanac_event)
+
+# The loop sleeps until something happens: a clock tick, new data from the
+# worker, or a key or touch.  Moving the mouse isn't something.
+pygame.event.set_blocked(MOUSEMOTION)
+arm_clock_tick()
+SCHEDULER.run_pending()     # the first updates start right away
+REDRAW = True       # Draw everything the first time around
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 while RUNNING:
-
-    # Look for mouse clicks on tab "buttons"
-    CLICK = pygame.mouse.get_pressed()
-    if CLICK[0] == 1: # mouse button pressed
-        MOUSE = pygame.mouse.get_pos()
-        # Not straight forward, but I'm taking advantage of the fact that all tabs are the same
-        # height and this is much faster than the more stright forward ways.
-        if MOUSE[0] > TAB_BUTTONS[0][0]:
-            # mouse is right of the left-hand-side of the column of buttons
-            if MOUSE[0] < TAB_BUTTONS[0][0] + TAB_BUTTONS[0][2]:
-                #  mouse is left of the right-hand-side of the column of buttons
-                # which button is it?
+    LAST_MODE = MODE
+    TICK = False
+    # Sleep until there's something to do (unless there's a redraw waiting)
+    EVENTS = pygame.event.get() if REDRAW else [pygame.event.wait()] + pygame.event.get()
+    for event in EVENTS:
+        if event.type == EVT_TICK:
+            TICK = True
+            arm_clock_tick()
+
+        elif event.type in (EVT_DATA, EVT_ALMANAC):
+            REDRAW = True
+
+        elif event.type == QUIT:
+            RUNNING = False
+
+        # Look for clicks on tab "buttons"
+        elif event.type == MOUSEBUTTONDOWN and event.button == 1:
+            MOUSE = event.pos
+            # Not straight forward, but I'm taking advantage of the fact that all tabs are the same
+            # height and this is much faster than the more stright forward ways.
+            if TAB_BUTTONS[0][0] < MOUSE[0] < TAB_BUTTONS[0][0] + TAB_BUTTONS[0][2]:
+                # mouse is in the column of buttons, which button is it?
                 TABNO = math.trunc(MOUSE[1] / TAB_BUTTONS[0][3]) # modulo button height
-                if TABNO == 0:
-                    MODE = 'w' # TAB_WEATHER
-                elif TABNO == 1:
-                    MODE = 'a' # TAB_ALMANAC
-                elif TABNO == 2:
-                    MODE = '!' # TAB_ALERT
-                elif TABNO == 3:
-                    MODE = 'h' # TAB_HISTORY
-                elif TABNO == 4:
-                    MODE = 'd' # TAB_DETAILS
                 if TABNO < 5:
-                    DISPTO = 0
-
-    # Look for and process keyboard events to change modes.
-    for event in pygame.event.get():
-        if event.type == pygame.KEYDOWN:
+                    MODE = ('w', 'a', '!', 'h', 'd')[TABNO]
+                    DISPTO = time.monotonic()
+            # Look for clicks on the forecast windows to display details
+            elif (MODE == 'w' and
+                  FORECAST_BUTTONS[0][1] < MOUSE[1] < FORECAST_BUTTONS[0][1] + FORECAST_BUTTONS[0][3]):
+                # Not straight forward, but I'm relying on all buttons being the same width
+                # and it is faster than the straight forward ways.
+                BUT = math.trunc(MOUSE[0] / FORECAST_BUTTONS[0][2]) # modulo button width
+                if BUT < 4:
+                    DETAILS_DAY = BUT
+                    MODE = 'd'
+                    DISPTO = time.monotonic()
+                    REDRAW = True
+
+        # Look for and process keyboard events to change modes.
+        elif event.type == pygame.KEYDOWN:
             # On 'q' or keypad enter key, quit the program.
             if ((event.key == K_KP_ENTER) or (event.key == K_q)):
                 RUNNING = False
@@ -1478,100 +1930,70 @@ while RUNNING:
             # On '1' key (unshifted !, set mode to 'alert'.
             elif event.key == K_1:
                 MODE = '!'
-                DISPTO = 0
+                DISPTO = time.monotonic()
 
             # On 'w' key, set mode to 'weather'.
             elif event.key == K_w:
                 MODE = 'w'
-                DISPTO = 0
 
             # On 's' key, save a screen shot.
             elif event.key == K_s:
                 MYDISP.screen_cap()
 
+            # On 'm' key, show or hide the timings (debug overlay)
+            elif event.key == K_m:
+                OVERLAY = not OVERLAY
+                MYDISP.shown = None
+                REDRAW = True
+
             # On 'a' key, set mode to 'almanac'.
             elif event.key == K_a:
                 MODE = 'a'
-                DISPTO = 0
+                DISPTO = time.monotonic()
 
             # On 'h' key, set mode to 'history'
             elif event.key == K_h:
                 MODE = 'h'
-                DISPTO = 0
+                DISPTO = time.monotonic()
 
             # On 'd' key, set mode to 'details'
             elif event.key == K_d:
                 DETAILS_DAY = 0
                 MODE = 'd'
-                DISPTO = 0
-
-    # Automatically switch back to weather display after a minute
-    if MODE != 'w':
-        DISPTO += 1
-        if DISPTO > 600:   # One minute timeout at 100ms loop rate.
-            MODE = 'w'
-    else:
-        DISPTO = 0
-        # Look for mouse clicks on the forecast windows to display details
-        MOUSE = pygame.mouse.get_pos()
-        CLICK = pygame.mouse.get_pressed()
-        if CLICK[0] == 1: # mouse click in 'weather' mode, might be a forecast button
-            # Not straight forward, but I'm relying on all buttons being the same width
-            # and it is faster than the straight forward ways.
-            if MOUSE[1] > FORECAST_BUTTONS[0][1]: # below the top of the row of buttons
-                if MOUSE[1] < FORECAST_BUTTONS[0][1] + FORECAST_BUTTONS[0][3]:
-                    # above bottom of the row of buttons
-                    BUT = math.trunc(MOUSE[0] / FORECAST_BUTTONS[0][2]) # modulo button width
-                    if BUT < 4:
-                        DETAILS_DAY = BUT
-                        MODE = 'd'
-
-    # Alert Display Mode
-    if MODE == '!':
-        # Update / Refresh the display after each second.
-        if SECS != time.localtime().tm_sec:
-            SECS = time.localtime().tm_sec
-            MYDISP.disp_alert()
-
-    # Weather Display Mode
-    if MODE == 'w':
-        # Update / Refresh the display after each second.
-        if SECS != time.localtime().tm_sec:
-            SECS = time.localtime().tm_sec
-            MYDISP.disp_weather()
-        # Every ten minutes, update the weather from the net.
-        if (time.localtime().tm_min % 10 == 0) and (time.localtime().tm_sec == 0):
-            MYDISP.updateweather()
-            updateinsidedata()
-            furnacefancontrol()
-            adjusttstatsetting(MYDISP.temps[0][0])
-
-    # History display mode
-    if MODE == 'h':
-        MYDISP.disp_history()
-
-    # Details display mode
-    if MODE == 'd':
-        MYDISP.disp_details(DETAILS_DAY) # today by default
-
-    # Almanac display mode
-    if MODE == 'a':
-        # Pace the screen updates to once per second.
-        if SECS != time.localtime().tm_sec:
-            SECS = time.localtime().tm_sec
+                DISPTO = time.monotonic()
+                REDRAW = True
 
-            (INDAYLIGHT, DAYHRS, DAYMINS, TDAYLIGHT, TDARKNESS) = daylight(MYDISP.sunrise)
+    if TICK:
+        # Sunrise or sunset?
+        MYDISP.almanac.check()
 
-            # Stat Screen Display.
-            MYDISP.disp_almanac(INDAYLIGHT, DAYHRS, DAYMINS, TDAYLIGHT, TDARKNESS)
-        # Refresh the weather data every ten minutes
-        if (time.localtime().tm_min % 10 == 0) and (time.localtime().tm_sec == 0):
-            MYDISP.updateweather()
-
-    (INDAYLIGHT, DAYHRS, DAYMINS, TDAYLIGHT, TDARKNESS) = daylight(MYDISP.sunrise)
-
-    # Loop timer.
-    pygame.time.wait(100)
+        # Start any updates that are due (whatever screen is up).  They run
+        # in the background; the screen is drawn with whatever we have
+        # meanwhile.
+        SCHEDULER.run_pending()
 
+        # Automatically switch back to weather display after a minute
+        if MODE != 'w' and time.monotonic() - DISPTO > DISPLAY_TIMEOUT:
+            MODE = 'w'
 
+    # Pick up any new data from the update engine
+    if MYDISP.apply_snapshot():
+        REDRAW = True
+
+    if RUNNING and (REDRAW or TICK or MODE != LAST_MODE):
+        show_screen(MODE, REDRAW or MODE != LAST_MODE)
+        REDRAW = False
+        # The overlay is drawn over the screen it covers
+        if OVERLAY:
+            MYDISP.draw_metrics_overlay()
+
+        # With --profile-startup, report once the first frame is up
+        wg_profile_mark("first frame")
+        wg_profile_report()
+
+# Give the update engine a chance to finish what it's doing
+UPDATER.stop(10)
+records_flush(True)
+tsdb_save(True)
+MYDISP.flush_data()
 pygame.quit()
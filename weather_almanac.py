@@ -0,0 +1,166 @@
+"""Sunrise and sunset, worked out once per update instead of every frame"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions for the almanac.  The providers give us
+# today's sunrise and sunset as strings ('7:00 AM').  They are parsed when
+# they change (or the day does) into today's and tomorrow's events, in
+# order, and we keep track of which one is next.  "Is it daylight?" and
+# "how long until the next event?" just look at the next event, and anyone
+# who cares can be called when the sun comes up or goes down.
+#
+# We only get today's times, so tomorrow's events come from the ephemeris
+# table (weather_ephemeris), and so does a new day's until the next update
+# brings its times.  If there's no table yet, today's times are used (they
+# are a minute or two off).
+#
+import datetime
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from weather_ephemeris import ephemeris_day
+
+WEATHER_ALMANAC_VERSION = "1.1"
+
+TRACE = False
+
+ALMANAC_SUNRISE = "sunrise"
+ALMANAC_SUNSET = "sunset"
+ALMANAC_TIME_FORMAT = '%I:%M %p'
+
+
+class WeatherAlmanac:
+    """Today's and tomorrow's sunrise and sunset, and which comes next"""
+
+    ###########################################################################
+    def __init__(self):
+        self.times = None       # (sunrise, sunset) strings the events came from
+        self.parsed = None      # the same as datetime.time
+        self.times_day = None   # date they came in
+        self.day = None         # date the events start on
+        self.events = []        # [(datetime, ALMANAC_SUNRISE or ALMANAC_SUNSET)]
+        self.day_length = datetime.timedelta(0)
+        self.next = 0           # index in events of the next one
+        self.listeners = []
+
+    ###########################################################################
+    #
+    # New sunrise and sunset strings (from a data update).  Nothing is parsed
+    # unless they, or the day, have changed.
+    #
+    def update(self, sunrise, sunset, now=None):
+        """Work out the events for a sunrise and sunset"""
+        if now is None:
+            now = datetime.datetime.now()
+        if (sunrise, sunset) == self.times and now.date() == self.day:
+            return
+        if (sunrise, sunset) != self.times:
+            try:
+                self.parsed = (datetime.datetime.strptime(sunrise, ALMANAC_TIME_FORMAT).time(),
+                               datetime.datetime.strptime(sunset, ALMANAC_TIME_FORMAT).time())
+            except (TypeError, ValueError):
+                wg_error_print("WeatherAlmanac", "Bad sunrise/sunset " + repr((sunrise, sunset)))
+                return
+            self.times = (sunrise, sunset)
+            self.times_day = now.date()
+            wg_trace_print("Almanac: sunrise " + sunrise + ", sunset " + sunset, TRACE)
+        self._plan(now)
+
+    ###########################################################################
+    #
+    # Lay out today's and tomorrow's events.  Tomorrow's (and today's, if the
+    # times we have are from yesterday) come from the ephemeris table if it
+    # has been made.
+    #
+    def _plan(self, now):
+        """Work out the events from now on"""
+        self.day = now.date()
+        self.events = []
+        for day in (self.day, self.day + datetime.timedelta(days=1)):
+            (rise, sets) = (datetime.datetime.combine(day, self.parsed[0]),
+                            datetime.datetime.combine(day, self.parsed[1]))
+            if day != self.times_day:
+                table = ephemeris_day(day, build=False)
+                if table is not None and table['sunrise'] and table['sunset']:
+                    (rise, sets) = (table['sunrise'], table['sunset'])
+            self.events.append((rise, ALMANAC_SUNRISE))
+            self.events.append((sets, ALMANAC_SUNSET))
+        self.day_length = self.events[1][0] - self.events[0][0]
+        self.next = 0
+        while self.next < len(self.events) and self.events[self.next][0] <= now:
+            self.next += 1
+
+    ###########################################################################
+    #
+    # Ask for func(event, when) to be called when the sun comes up or goes
+    # down (from check())
+    #
+    def add_listener(self, func):
+        """Call func(event, when) at each sunrise and sunset"""
+        self.listeners.append(func)
+
+    ###########################################################################
+    #
+    # Move past the events that have happened, telling the listeners.  Call
+    # this regularly (the main loop does, every second).
+    #
+    def check(self, now=None):
+        """Note any sunrise or sunset that has happened"""
+        if self.times is None:
+            return
+        if now is None:
+            now = datetime.datetime.now()
+        if now.date() != self.day:
+            # Tomorrow is today now
+            self._plan(now)
+            if self.next > 0:
+                return      # already past today's first event, don't report it late
+        while self.next < len(self.events) and self.events[self.next][0] <= now:
+            (when, event) = self.events[self.next]
+            self.next += 1
+            wg_trace_print("Almanac: " + event + " at " + str(when), TRACE)
+            for func in self.listeners:
+                func(event, when)
+
+    ###########################################################################
+    #
+    # The next event, (ALMANAC_SUNRISE or ALMANAC_SUNSET, datetime), or None
+    # if we don't know the times yet
+    #
+    def next_event(self, now=None):
+        """Return the next sunrise or sunset"""
+        self.check(now)
+        if self.next >= len(self.events):
+            return None
+        (when, event) = self.events[self.next]
+        return (event, when)
+
+    ###########################################################################
+    #
+    # Is the sun up?
+    #
+    def indaylight(self, now=None):
+        """Return True between sunrise and sunset"""
+        upcoming = self.next_event(now)
+        return upcoming is not None and upcoming[0] == ALMANAC_SUNSET
+
+    ###########################################################################
+    #
+    # The almanac screen's numbers:
+    #   (indaylight, hours of daylight, minutes of daylight,
+    #    time until sunrise, time until sunset)
+    # The time until sunrise is 0 during the day, the time until sunset is 0
+    # at night, and the other one is a timedelta.
+    #
+    def daylight(self, now=None):
+        """Return the daylight times for the almanac screen"""
+        if now is None:
+            now = datetime.datetime.now()
+        upcoming = self.next_event(now)
+        minutes = int(self.day_length.total_seconds()) // 60
+        if upcoming is None:
+            return (False, minutes // 60, minutes % 60, datetime.timedelta(0), 0)
+        (event, when) = upcoming
+        if event == ALMANAC_SUNSET:
+            return (True, minutes // 60, minutes % 60, 0, when - now)
+        return (False, minutes // 60, minutes % 60, when - now, 0)
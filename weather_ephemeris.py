@@ -0,0 +1,234 @@
+"""A year of sunrise, sunset, moonrise, moonset and moon phase, worked out once"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions for the sun and moon.  Rather than asking
+# ephem for the moon every time the weather is fetched, every day of the year
+# is worked out in one go for DS_LAT/DS_LON and saved in ephemeris.json.
+# Lookups just index the table, so they cost nothing and work without the
+# network.  A new table is made when the year (or the location) changes.
+#
+#   python3 weather_ephemeris.py --build [--year 2021]
+#   python3 weather_ephemeris.py --show 07-04
+#
+# Each day in the table is:
+#   sunrise, sunset, moonrise, moonset = seconds since the epoch (None if it
+#       doesn't happen that day, the moon skips a rise or set about once a
+#       month)
+#   lunation = how far through the moon's cycle at noon (0 = new, 0.5 = full)
+#   illumination = percent of the moon lit at noon
+#
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from wg_lazy import wg_lazy_import
+from wg_metrics import wg_metrics_timer
+from weather_model import Almanac
+from dark_sky_account_settings import DS_LAT
+from dark_sky_account_settings import DS_LON
+
+WEATHER_EPHEMERIS_VERSION = "1.1"
+
+TRACE = False
+
+EPHEMERIS_FILE = "ephemeris.json"
+EPHEMERIS_FORMAT_VERSION = 1
+
+EPHEMERIS_FIELDS = ('sunrise', 'sunset', 'moonrise', 'moonset', 'lunation', 'illumination')
+
+_TABLE = None           # {'version', 'year', 'lat', 'lon', 'days' : [[fields], ...]}
+_LOCK = threading.Lock()            # for _TABLE, only held for quick lookups
+_BUILD_LOCK = threading.Lock()      # so only one thread builds a table
+
+###############################################################################
+def _epoch(edate):
+    """Seconds since the epoch for an ephem.Date"""
+    return int(round((edate.datetime() - datetime.datetime(1970, 1, 1)).total_seconds()))
+
+###############################################################################
+def _event(observer, func, body, end):
+    """The time of the next rise or set before end, or None"""
+    ephem = wg_lazy_import("ephem")
+    try:
+        when = _epoch(func(body))
+    except ephem.CircumpolarError:
+        return None     # up (or down) all day
+    return when if when < end else None
+
+###############################################################################
+#
+# Work out a year's table
+#
+def ephemeris_build(year, lat=DS_LAT, lon=DS_LON):
+    """Compute the sun and moon for every day of a year"""
+    ephem = wg_lazy_import("ephem")
+    start = time.monotonic()
+    observer = ephem.Observer()
+    observer.lat = str(lat)
+    observer.lon = str(lon)
+    sun = ephem.Sun()
+    moon = ephem.Moon()
+    days = []
+    day = datetime.date(year, 1, 1)
+    while day.year == year:
+        midnight = time.mktime(day.timetuple())
+        end = time.mktime((day + datetime.timedelta(days=1)).timetuple())
+        observer.date = ephem.Date(datetime.datetime.utcfromtimestamp(midnight))
+        row = [_event(observer, observer.next_rising, sun, end),
+               _event(observer, observer.next_setting, sun, end),
+               _event(observer, observer.next_rising, moon, end),
+               _event(observer, observer.next_setting, moon, end)]
+        noon = ephem.Date(datetime.datetime.utcfromtimestamp((midnight + end) / 2))
+        new_moon = ephem.previous_new_moon(noon)
+        row.append(round((noon - new_moon) / (ephem.next_new_moon(noon) - new_moon), 4))
+        moon.compute(noon)
+        row.append(round(moon.phase, 1))
+        days.append(row)
+        day += datetime.timedelta(days=1)
+    wg_trace_print("Ephemeris for %d took %.1f seconds" % (year, time.monotonic() - start),
+                   TRACE)
+    return {'version' : EPHEMERIS_FORMAT_VERSION, 'year' : year,
+            'lat' : str(lat), 'lon' : str(lon), 'days' : days}
+
+###############################################################################
+def _table_ok(table, year):
+    """Is this table for the year and where we are?"""
+    return (isinstance(table, dict) and
+            table.get('version') == EPHEMERIS_FORMAT_VERSION and
+            table.get('year') == year and
+            table.get('lat') == str(DS_LAT) and table.get('lon') == str(DS_LON))
+
+###############################################################################
+def _table_save(table):
+    """Save the table safely"""
+    tmp_name = EPHEMERIS_FILE + ".tmp"
+    with wg_metrics_timer("write", EPHEMERIS_FILE) as timer:
+        try:
+            with open(tmp_name, "w", encoding='utf-8') as table_file:
+                json.dump(table, table_file, separators=(',', ':'))
+                table_file.flush()
+                os.fsync(table_file.fileno())
+            os.replace(tmp_name, EPHEMERIS_FILE)
+        except OSError as err:
+            wg_error_print("ephemeris", "Unable to save " + EPHEMERIS_FILE + ": " + str(err))
+            timer.failed = True
+
+###############################################################################
+#
+# The table for a year: the one in memory, else the saved one
+#
+def _table(year):
+    """Return the table for a year, or None (call with _LOCK held)"""
+    global _TABLE
+    if _table_ok(_TABLE, year):
+        return _TABLE
+    try:
+        with open(EPHEMERIS_FILE, "r", encoding='utf-8') as table_file:
+            table = json.load(table_file)
+        if _table_ok(table, year):
+            _TABLE = table
+            return _TABLE
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as err:
+        wg_error_print("ephemeris", "Unable to read " + EPHEMERIS_FILE + ": " + str(err))
+    return None
+
+###############################################################################
+#
+# Make a new table for a year.  It takes a few seconds on a Pi, so it's done
+# without holding _LOCK (lookups from the display aren't held up, they just
+# don't find a table until it's swapped in).
+#
+def _table_build(year):
+    """Build, save and start using the table for a year"""
+    global _TABLE
+    with _BUILD_LOCK:
+        with _LOCK:
+            table = _table(year)
+        if table is None:   # nobody else built it while we waited
+            table = ephemeris_build(year)
+            _table_save(table)
+            with _LOCK:
+                _TABLE = table
+    return table
+
+###############################################################################
+#
+# Look up a day (default today).  Returns a dictionary of EPHEMERIS_FIELDS,
+# with the times as local datetimes (or None), or None if there's no table
+# for the year and build isn't set.
+#
+def ephemeris_day(when=None, build=True):
+    """Return the sun and moon for a day"""
+    if when is None:
+        when = datetime.date.today()
+    with _LOCK:
+        table = _table(when.year)
+    if table is None and build:
+        table = _table_build(when.year)
+    if table is None:
+        return None
+    row = table['days'][when.timetuple().tm_yday - 1]
+    day = {}
+    for (field, value) in zip(EPHEMERIS_FIELDS, row):
+        if field in ('lunation', 'illumination') or value is None:
+            day[field] = value
+        else:
+            day[field] = datetime.datetime.fromtimestamp(value)
+    return day
+
+###############################################################################
+#
+# A day's sun and moon as an Almanac record (see weather_model.py), or None
+# if there's no table for the year and build isn't set
+#
+def ephemeris_almanac(when=None, build=True):
+    """Return the sun and moon for a day as an Almanac"""
+    day = ephemeris_day(when, build)
+    if day is None:
+        return None
+    return Almanac(sunrise=day['sunrise'], sunset=day['sunset'],
+                   moonrise=day['moonrise'], moonset=day['moonset'],
+                   lunation=day['lunation'])
+
+###############################################################################
+#
+# A time from the table the way the screens show them ('7:05 PM'), or "NA"
+#
+def ephemeris_time_str(when):
+    """Format a rise or set time"""
+    if when is None:
+        return "NA"
+    return "%d:%02d %s" % ((when.hour + 11) % 12 + 1, when.minute,
+                           "AM" if when.hour < 12 else "PM")
+
+
+###############################################################################
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Sun and moon table")
+    PARSER.add_argument("--build", action="store_true", help="make (or remake) the table")
+    PARSER.add_argument("--year", type=int, default=datetime.date.today().year,
+                        help="year of the table")
+    PARSER.add_argument("--show", metavar="MM-DD", help="print a day from the table")
+    ARGS = PARSER.parse_args()
+    if ARGS.build:
+        _TABLE = ephemeris_build(ARGS.year)
+        _table_save(_TABLE)
+        print("Built " + EPHEMERIS_FILE + " for " + str(ARGS.year))
+    if ARGS.show:
+        DAY = ephemeris_day(datetime.datetime.strptime(str(ARGS.year) + "-" + ARGS.show,
+                                                       "%Y-%m-%d").date())
+        for FIELD in EPHEMERIS_FIELDS:
+            if FIELD in ('lunation', 'illumination'):
+                print("%-12s %s" % (FIELD, DAY[FIELD]))
+            else:
+                print("%-12s %s" % (FIELD, ephemeris_time_str(DAY[FIELD])))
+    if not (ARGS.build or ARGS.show):
+        PARSER.print_help()
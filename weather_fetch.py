@@ -0,0 +1,102 @@
+"""Fetch the weather from all of the providers at the same time"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to ask all of the weather providers for
+# data at once and merge what comes back into the one structure weather.py
+# expects (see weather_model.py).  A provider that is slow or fails only
+# loses its own fields.
+#
+import concurrent.futures
+import sys
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from dark_sky import getweatherdata
+from tempest import getPWSdata
+from weather_poll import poll_budget_take
+from wg_metrics import wg_metrics_timer
+
+WEATHER_FETCH_VERSION = "1.4"
+
+TRACE = False
+
+FETCH_DEADLINE = 30.0   # seconds to wait for the providers
+
+# Providers in order of precedence, lowest first.  When two providers return
+# the same field, the later one wins (the Tempest is in my back yard, so its
+# current conditions beat DarkSky's).  Observations are merged field by
+# field, so DarkSky's summary and visibility survive the Tempest's update.
+FETCH_PROVIDERS = [("DarkSky", getweatherdata),
+                   ("Tempest", getPWSdata)]
+
+# Providers that take their own calls from their budget (weather_poll), one
+# per request they make, so we don't take one for them too
+FETCH_OWN_BUDGET = ("WeatherUnderground",)
+
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=len(FETCH_PROVIDERS),
+                                                  thread_name_prefix="fetch")
+
+###############################################################################
+#
+# Call one provider with its own dictionary so a provider that is still
+# running after the deadline can't change what we've already merged
+#
+def _fetch_one(name, func):
+    """Run a provider, returning its data or None if it failed"""
+    provdata = dict()
+    with wg_metrics_timer("provider", name) as timer:
+        if func(provdata):
+            return provdata
+        timer.failed = True
+    return None
+
+###############################################################################
+#
+# Get weather data from all the providers
+# Args:
+#   dsd = dictionary to merge the results into
+#   deadline = how many seconds to wait for the providers
+#   providers = names of the providers to ask (None for all of them)
+#
+# A provider that has used up today's calls (see weather_poll) is skipped
+# (the ones in FETCH_OWN_BUDGET check for themselves).
+#
+# Returns the names of the providers that answered in time (an empty list if
+# none did).
+#
+def fetchweatherdata(dsd, deadline=FETCH_DEADLINE, providers=None):
+    """Fetch from all the weather providers concurrently and merge the results"""
+    futures = []
+    for (name, func) in FETCH_PROVIDERS:
+        if providers is not None and name not in providers:
+            continue
+        if name not in FETCH_OWN_BUDGET and not poll_budget_take(name):
+            wg_error_print("fetchweatherdata", name + " has no calls left today")
+            continue
+        futures.append((name, _EXECUTOR.submit(_fetch_one, name, func)))
+    concurrent.futures.wait([future for (_, future) in futures], timeout=deadline)
+    sources = []
+    for (name, future) in futures:
+        if not future.done():
+            wg_error_print("fetchweatherdata", name + " did not answer within " +
+                           str(deadline) + " seconds")
+            continue
+        try:
+            provdata = future.result()
+        except Exception: #pylint: disable=W0703
+            wg_error_print("fetchweatherdata", name + " failed " +
+                           "(Exc type = " + str(sys.exc_info()[0]) + ") " +
+                           "(Exc value = " + str(sys.exc_info()[1]) + ")")
+            continue
+        if provdata is None:
+            wg_error_print("fetchweatherdata", "Unable to get " + name + " data")
+            continue
+        for (key, value) in provdata.items():
+            if hasattr(dsd.get(key), 'update_from'):
+                dsd[key].update_from(value)
+            else:
+                dsd[key] = value
+        sources.append(name)
+    wg_trace_print("Weather data from " + str(sources), TRACE)
+    return sources
@@ -0,0 +1,150 @@
+"""Hourly research data log"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions for the hourly research data.  Each hour
+# one line is appended to a CSV file for the month (2021-01hourly_data.csv),
+# so logging costs the same in December as it does in January.  The old
+# spreadsheet (one per year, a sheet per month) can be made from the logs:
+#   python3 weather_log.py --export 2021 [--out 2021hourly_data.xlsx]
+#
+import argparse
+import csv
+import datetime
+import io
+import os
+import threading
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from wg_lazy import wg_lazy_import
+from wg_metrics import wg_metrics_timer
+
+WEATHER_LOG_VERSION = "1.0"
+
+TRACE = False
+
+HOURLY_LOG_DIR = "."
+HOURLY_LOG_SUFFIX = "hourly_data.csv"
+
+# Columns: month, day, year, hour, thermostat temp, forecast high,
+# forecast low, forecast precipitation
+_LAST_HOUR = None           # (year, month, day, hour) of the last line logged
+_LOCK = threading.Lock()
+
+###############################################################################
+#
+# Name of the log file for a month
+#
+def hourly_log_name(year, month):
+    """Return the log file name for a month"""
+    return os.path.join(HOURLY_LOG_DIR, "%d-%02d%s" % (year, month, HOURLY_LOG_SUFFIX))
+
+###############################################################################
+#
+# What hour was logged last?  Read from the end of this month's log the first
+# time, so a restart doesn't log the same hour twice.
+#
+def _last_hour(when):
+    """Return (year, month, day, hour) of the last line logged, or None"""
+    global _LAST_HOUR
+    if _LAST_HOUR is None:
+        file_name = hourly_log_name(when.year, when.month)
+        if os.path.isfile(file_name):
+            with open(file_name, "rb") as log:
+                log.seek(0, os.SEEK_END)
+                log.seek(max(0, log.tell() - 256))
+                lines = log.read().decode('utf-8', 'replace').splitlines()
+            try:
+                row = next(csv.reader([lines[-1]]))
+                _LAST_HOUR = (int(row[2]), int(row[0]), int(row[1]), int(row[3]))
+            except (IndexError, ValueError, StopIteration):
+                pass
+    return _LAST_HOUR
+
+###############################################################################
+#
+# Has this hour been logged yet?
+#
+def hourly_log_due(when=None):
+    """Return True if nothing has been logged for this hour"""
+    if when is None:
+        when = datetime.datetime.now()
+    with _LOCK:
+        return _last_hour(when) != (when.year, when.month, when.day, when.hour)
+
+###############################################################################
+#
+# Log one hour's data.  Args:
+#   values = thermostat temp, forecast high, forecast low, forecast precip
+#   when = time of the data (default now)
+#
+# Returns False if this hour has already been logged.
+#
+def hourly_log_append(values, when=None):
+    """Append a line to the month's log"""
+    global _LAST_HOUR
+    if when is None:
+        when = datetime.datetime.now()
+    hour = (when.year, when.month, when.day, when.hour)
+    with _LOCK:
+        if _last_hour(when) == hour:
+            return False
+        line = io.StringIO()
+        csv.writer(line).writerow([when.month, when.day, when.year, when.hour] + list(values))
+        file_name = hourly_log_name(when.year, when.month)
+        with wg_metrics_timer("write", os.path.basename(file_name)), \
+             open(file_name, "a", newline='') as log:
+            log.write(line.getvalue())
+        _LAST_HOUR = hour
+    wg_trace_print("Logged " + line.getvalue().strip(), TRACE)
+    return True
+
+###############################################################################
+#
+# Make the year's spreadsheet (a sheet per month) from the monthly logs.
+# The rows are streamed into the spreadsheet, so it doesn't matter how big
+# the logs get.
+#
+def hourly_log_export(year, file_name=None):
+    """Write a year of logs to a spreadsheet, returns the number of rows"""
+    openpyxl = wg_lazy_import("openpyxl")
+    if file_name is None:
+        file_name = str(year) + "hourly_data.xlsx"
+    wb = openpyxl.Workbook(write_only=True)
+    rows = 0
+    for month in range(1, 13):
+        log_name = hourly_log_name(year, month)
+        if not os.path.isfile(log_name):
+            continue
+        ws = wb.create_sheet('Sheet-' + str(month))
+        with open(log_name, "r", newline='') as log:
+            for row in csv.reader(log):
+                ws.append([_cell_value(value) for value in row])
+                rows += 1
+    if rows == 0:
+        wg_error_print("hourly_log_export", "No logs for " + str(year))
+        return 0
+    with wg_metrics_timer("write", file_name):
+        wb.save(file_name)
+    return rows
+
+###############################################################################
+def _cell_value(value):
+    """Turn a CSV field back into a number if it was one"""
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+###############################################################################
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Hourly research data tools")
+    PARSER.add_argument("--export", type=int, metavar="YEAR", required=True,
+                        help="write the year's logs to a spreadsheet")
+    PARSER.add_argument("--out", metavar="XLSX", help="spreadsheet name")
+    ARGS = PARSER.parse_args()
+    print("Exported " + str(hourly_log_export(ARGS.export, ARGS.out)) + " rows")
@@ -0,0 +1,137 @@
+"""Typed records for what the weather providers send, in SI units"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions for the weather data.  Each provider
+# turns its reply into these records once, as numbers in SI units (C, hPa,
+# m/s, mm, m), so nothing after that has to parse "72°F" or float() the
+# same string again.  The display turns them into strings once per update.
+#
+# A field is None if the provider didn't send it; update_from() only copies
+# the fields that were sent, so one provider's data can be laid over
+# another's.
+#
+# A provider fills in a dictionary with:
+#   obs = Observation
+#   forecast = list of DailyForecast, today first
+#   alerts = list of alert strings
+# The Almanac comes from the ephemeris table (weather_ephemeris), not the
+# providers.
+#
+WEATHER_MODEL_VERSION = "1.0"
+
+COMPASS_POINTS = ("N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+                  "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW")
+
+###############################################################################
+#
+# Unit conversions
+#
+def c_to_f(temp_c):
+    """Celsius to Fahrenheit"""
+    return temp_c * 9.0 / 5.0 + 32.0
+
+def f_to_c(temp_f):
+    """Fahrenheit to Celsius"""
+    return (temp_f - 32.0) * 5.0 / 9.0
+
+def hpa_to_inhg(pressure_hpa):
+    """Hectopascals (millibars) to inches of mercury"""
+    return pressure_hpa / 33.8639
+
+def ms_to_mph(speed_ms):
+    """Meters per second to miles per hour"""
+    return speed_ms * 2.237
+
+def mph_to_ms(speed_mph):
+    """Miles per hour to meters per second"""
+    return speed_mph / 2.237
+
+def mm_to_in(length_mm):
+    """Millimeters to inches"""
+    return length_mm / 25.4
+
+def m_to_miles(length_m):
+    """Meters to miles"""
+    return length_m / 1609.344
+
+def miles_to_m(length_miles):
+    """Miles to meters"""
+    return length_miles * 1609.344
+
+def deg_to_compass(degrees):
+    """Wind direction in degrees to a compass point ("NNE")"""
+    return COMPASS_POINTS[int((degrees / 22.5) + .5) % 16]
+
+
+class _WeatherRecord:
+    """Fields that start out None, with update_from() to lay one over another"""
+    __slots__ = ()
+
+    ###########################################################################
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError("Unknown fields " + str(sorted(fields)))
+
+    ###########################################################################
+    def update_from(self, other):
+        """Copy the fields other has"""
+        for name in self.__slots__:
+            value = getattr(other, name)
+            if value is not None:
+                setattr(self, name, value)
+
+    ###########################################################################
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__,
+                           ", ".join("%s=%r" % (name, getattr(self, name))
+                                     for name in self.__slots__
+                                     if getattr(self, name) is not None))
+
+
+class Observation(_WeatherRecord):
+    """Current conditions"""
+    __slots__ = ('time',            # datetime of the observation
+                 'summary',         # "Partly Cloudy"
+                 'temp_c',
+                 'feels_like_c',
+                 'humidity',        # percent
+                 'pressure_hpa',
+                 'wind_ms',
+                 'gust_ms',
+                 'wind_dir_deg',
+                 'visibility_m',
+                 'rain_today_mm')
+
+
+class DailyForecast(_WeatherRecord):
+    """One day's forecast"""
+    __slots__ = ('date',            # datetime.date
+                 'high_c',
+                 'low_c',
+                 'icon',            # icon name (a file in icons/ without the .gif)
+                 'summary')         # the forecast in words
+
+
+class Almanac(_WeatherRecord):
+    """Today's sun and moon"""
+    __slots__ = ('sunrise',         # datetimes (None if it doesn't happen today)
+                 'sunset',
+                 'moonrise',
+                 'moonset',
+                 'lunation')        # how far through the moon's cycle (0 = new, 0.5 = full)
+
+###############################################################################
+#
+# What the forecast screen says for an icon
+#
+def forecast_condition(icon):
+    """Return the words for a forecast icon"""
+    if icon.startswith('partly-cloudy'):
+        return 'partly cloudy'
+    if icon.startswith('clear'):
+        return 'clear'
+    return icon
@@ -0,0 +1,167 @@
+"""How often to ask the weather providers, and how many calls are left today"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to poll faster when the weather is
+# changing and slower when it isn't.  How fast it's changing comes from the
+# last POLL_WINDOW seconds of the history (weather_tsdb): if the temperature,
+# pressure or wind moved more than its POLL_THRESHOLDS rate, or there is an
+# alert, we poll at the fastest interval; if everything moved less than
+# POLL_CALM of its rate, the slowest; otherwise the normal one.
+#
+# Providers that charge (or cut us off) after so many calls a day have a
+# budget in POLL_BUDGETS.  The calls made today are kept in poll_budget.json
+# so a restart doesn't start the count over, and the interval is stretched
+# if polling that fast would use up the budget before midnight.
+#
+import datetime
+import json
+import os
+import threading
+import time
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from weather_tsdb import tsdb_query
+from wg_metrics import wg_metrics_timer
+
+WEATHER_POLL_VERSION = "1.2"
+
+TRACE = False
+
+POLL_BUDGET_FILE = "poll_budget.json"
+POLL_BUDGETS = {"DarkSky" : 900,            # calls a day (DarkSky's free tier is 1000)
+                "WeatherUnderground" : 450} # one per station asked (free tier is 500)
+
+POLL_WINDOW = 30 * 60               # seconds of history to look at
+POLL_MIN_SPAN = 5 * 60              # seconds the samples must cover to be used
+POLL_THRESHOLDS = {"temp" : 3.0,        # F per hour
+                   "pressure" : 0.03,   # "Hg per hour
+                   "wind" : 10.0}       # mph per hour
+POLL_CALM = 0.25                    # fraction of the thresholds that is "stable"
+
+_CALLS = None                       # {'date' : "YYYY-MM-DD", 'calls' : {provider : n}}
+_LOCK = threading.Lock()
+
+###############################################################################
+#
+# How fast is the weather changing?  Returns the largest of each reading's
+# rate of change over its threshold (1.0 or more means "fast").  The rate is
+# over the time the samples cover (less than POLL_WINDOW just after startup
+# or a gap); a reading whose samples cover less than POLL_MIN_SPAN is left out.
+# Returns None if none of them has enough history to tell.
+#
+def poll_change_rate(now=None):
+    """Return how fast the readings are changing, relative to the thresholds"""
+    if now is None:
+        now = time.time()
+    rate = None
+    for (name, threshold) in POLL_THRESHOLDS.items():
+        samples = tsdb_query(name, now - POLL_WINDOW, now)
+        if len(samples) < 2:
+            continue
+        times = [when for (when, _) in samples]
+        span = max(times) - min(times)
+        if span < POLL_MIN_SPAN:
+            continue
+        values = [value for (_, value) in samples]
+        per_hour = (max(values) - min(values)) * 3600.0 / span
+        rate = max(rate or 0.0, per_hour / threshold)
+    return rate
+
+###############################################################################
+#
+# Load today's call counts (call with _LOCK held)
+#
+def _calls():
+    """Return today's call counts, starting over on a new day"""
+    global _CALLS
+    today = datetime.date.today().isoformat()
+    if _CALLS is None:
+        try:
+            with open(POLL_BUDGET_FILE, "r", encoding='utf-8') as budget_file:
+                _CALLS = json.load(budget_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            wg_error_print("poll_budget", "Unable to read " + POLL_BUDGET_FILE + ": " + str(err))
+    if not isinstance(_CALLS, dict) or _CALLS.get('date') != today:
+        _CALLS = {'date' : today, 'calls' : {}}
+    return _CALLS['calls']
+
+###############################################################################
+def _calls_save():
+    """Save today's call counts (call with _LOCK held)"""
+    tmp_name = POLL_BUDGET_FILE + ".tmp"
+    with wg_metrics_timer("write", POLL_BUDGET_FILE) as timer:
+        try:
+            with open(tmp_name, "w", encoding='utf-8') as budget_file:
+                json.dump(_CALLS, budget_file)
+                budget_file.flush()
+                os.fsync(budget_file.fileno())
+            os.replace(tmp_name, POLL_BUDGET_FILE)
+        except OSError as err:
+            wg_error_print("poll_budget", "Unable to save " + POLL_BUDGET_FILE + ": " + str(err))
+            timer.failed = True
+
+###############################################################################
+#
+# How many calls does a provider have left today?  None if it doesn't have a
+# budget.
+#
+def poll_budget_left(provider):
+    """Return the calls left in a provider's budget today"""
+    if provider not in POLL_BUDGETS:
+        return None
+    with _LOCK:
+        return max(POLL_BUDGETS[provider] - _calls().get(provider, 0), 0)
+
+###############################################################################
+#
+# Count a call to a provider.  Returns False (and doesn't count it) if the
+# provider's budget for today is used up.
+#
+def poll_budget_take(provider):
+    """Use one of a provider's calls for today"""
+    if provider not in POLL_BUDGETS:
+        return True
+    with _LOCK:
+        calls = _calls()
+        made = calls.get(provider, 0)
+        if made >= POLL_BUDGETS[provider]:
+            return False
+        calls[provider] = made + 1
+        _calls_save()
+    wg_trace_print(provider + " call " + str(made + 1) + " of " +
+                   str(POLL_BUDGETS[provider]) + " today", TRACE)
+    return True
+
+###############################################################################
+#
+# Pick a job's interval.
+# Args:
+#   normal, fastest, slowest = the job's intervals (seconds)
+#   providers = names of the providers the job calls (for their budgets)
+#   alert = is there an alert in effect?
+#
+def poll_interval(normal, fastest, slowest, providers=(), alert=False):
+    """Return how many seconds until a job should run again"""
+    rate = poll_change_rate()
+    if alert or (rate is not None and rate >= 1.0):
+        interval = fastest
+    elif rate is not None and rate <= POLL_CALM:
+        interval = slowest
+    else:
+        interval = normal       # changing some, or we can't tell yet
+
+    # Don't run out of calls before midnight
+    now = datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1),
+                                         datetime.time())
+    for provider in providers:
+        left = poll_budget_left(provider)
+        if left is not None:
+            interval = max(interval, (midnight - now).total_seconds() / max(left, 1))
+    wg_trace_print("Poll every %d seconds (change rate %s, alert %s)" %
+                   (interval, "?" if rate is None else "%.2f" % rate, alert), TRACE)
+    return interval
@@ -0,0 +1,355 @@
+"""Daily record high and low temperatures, kept in memory"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions for the record highs and lows.  The
+# records are read once into an array with one entry per day of the year
+# (including Feb 29).  Lookups never touch the disk; new records are written
+# back to the backend later, a few at a time, by records_flush().
+#
+# The records live in a SQLite database (records.db).  The old spreadsheet
+# is now only an import/export format:
+#   python3 weather_records.py --import Records.xlsx
+#   python3 weather_records.py --export Records.xlsx
+#   python3 weather_records.py --show 07-04 [--to 07-10]
+# If there is no database yet but there is a Records.xlsx, it is imported
+# the first time the records are needed.
+#
+# Records.xlsx layout: a header row, then one row per day (Jan 1 - Dec 31,
+# including Feb 29) with the record high in column 3, the year it was set in
+# column 4, the record low in column 5 and its year in column 6.
+#
+import argparse
+import array
+import datetime
+import os
+import sqlite3
+import sys
+import threading
+import time
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from wg_lazy import wg_lazy_import
+from wg_metrics import wg_metrics_timer
+
+WEATHER_RECORDS_VERSION = "2.1"
+
+RECORD_TRACE = True
+
+RECORDS_FILE = "Records.xlsx"
+RECORDS_SHEET = "Sheet1"
+RECORDS_DB = "records.db"
+RECORDS_DAYS = 366
+RECORDS_FLUSH_DELAY = 300   # seconds to wait before writing new records
+RECORDS_RETRY = 60          # seconds to wait before reading again after a failure
+
+RECORD_HIGH = 0             # offsets of the values for a day
+RECORD_HIGH_YEAR = 1
+RECORD_LOW = 2
+RECORD_LOW_YEAR = 3
+RECORD_FIELDS = 4
+RECORD_NONE = -32768        # no record for this day
+
+_BACKEND = None
+_RECORDS = None             # array('h') of RECORDS_DAYS * RECORD_FIELDS
+_DIRTY = set()              # days changed since the last flush
+_DIRTY_SINCE = None         # time.monotonic() of the oldest unsaved change
+_LOAD_FAILED = None         # time.monotonic() of the last failed read
+_LOCK = threading.RLock()
+
+###############################################################################
+#
+# Which entry is this date?  Every year uses the leap year layout, so Mar 1
+# is always the same entry.
+#
+def records_day_index(when=None):
+    """Return the record table index (0 - 365) for a date (default today)"""
+    if when is None:
+        when = datetime.date.today()
+    return datetime.date(2000, when.month, when.day).timetuple().tm_yday - 1
+
+
+class RecordsSQLite:
+    """Record highs and lows in a SQLite database, one row per day"""
+
+    ###########################################################################
+    def __init__(self, file_name=RECORDS_DB):
+        self.file_name = file_name
+
+    ###########################################################################
+    def _connect(self):
+        """Open the database, creating the table if it's new"""
+        conn = sqlite3.connect(self.file_name, timeout=10)
+        conn.execute("CREATE TABLE IF NOT EXISTS records ("
+                     "day INTEGER PRIMARY KEY, "
+                     "high INTEGER, high_year INTEGER, "
+                     "low INTEGER, low_year INTEGER)")
+        return conn
+
+    ###########################################################################
+    def exists(self):
+        """Has the database been created?"""
+        return os.path.isfile(self.file_name)
+
+    ###########################################################################
+    #
+    # Return the records for days first through last (table indexes) as a
+    # list of (day, [high, high year, low, low year]) with None for anything
+    # that hasn't been recorded
+    #
+    def get_range(self, first=0, last=RECORDS_DAYS - 1):
+        """Return the records for a range of days"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT day, high, high_year, low, low_year FROM records "
+                                "WHERE day BETWEEN ? AND ? ORDER BY day",
+                                (first, last)).fetchall()
+        finally:
+            conn.close()
+        return [(row[0], list(row[1:])) for row in rows]
+
+    ###########################################################################
+    def get(self, day):
+        """Return the records for one day (None if there aren't any)"""
+        rows = self.get_range(day, day)
+        return rows[0][1] if rows else None
+
+    ###########################################################################
+    #
+    # Save the records for several days in one transaction, so either all
+    # of them are saved or none are
+    #
+    def put(self, days):
+        """Save a list of (day, [high, high year, low, low year])"""
+        conn = self._connect()
+        try:
+            with conn, wg_metrics_timer("write", self.file_name):
+                conn.executemany("INSERT OR REPLACE INTO records "
+                                 "(day, high, high_year, low, low_year) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 [(day,) + tuple(values) for (day, values) in days])
+        finally:
+            conn.close()
+
+
+###############################################################################
+#
+# Read the records from a spreadsheet in the Records.xlsx layout.  Returns a
+# list of (day, [high, high year, low, low year]).
+#
+def records_read_xlsx(file_name=RECORDS_FILE):
+    """Read the records from a spreadsheet"""
+    openpyxl = wg_lazy_import("openpyxl")
+    wb = openpyxl.load_workbook(filename=file_name, read_only=True, data_only=True)
+    ws = wb[RECORDS_SHEET]
+    days = []
+    for (day, row) in enumerate(ws.iter_rows(min_row=2, max_row=RECORDS_DAYS + 1,
+                                             min_col=3, max_col=6, values_only=True)):
+        days.append((day, [None if value is None else int(value) for value in row]))
+    wb.close()
+    return days
+
+###############################################################################
+#
+# Write records to a spreadsheet in the Records.xlsx layout.  An existing
+# spreadsheet keeps everything but the record columns.
+#
+def records_write_xlsx(days, file_name=RECORDS_FILE):
+    """Write a list of (day, [high, high year, low, low year]) to a spreadsheet"""
+    openpyxl = wg_lazy_import("openpyxl")
+    if os.path.isfile(file_name):
+        wb = openpyxl.load_workbook(filename=file_name)
+        ws = wb[RECORDS_SHEET]
+    else:
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = RECORDS_SHEET
+        ws.append(["Month", "Day", "High", "Year", "Low", "Year"])
+        for day in range(RECORDS_DAYS):
+            date = datetime.date(2000, 1, 1) + datetime.timedelta(days=day)
+            ws.append([date.month, date.day])
+    for (day, values) in days:
+        for (field, value) in enumerate(values):
+            ws.cell(row=day + 2, column=field + 3).value = value
+    tmp_name = file_name + ".tmp"
+    with wg_metrics_timer("write", file_name):
+        wb.save(tmp_name)
+        os.replace(tmp_name, file_name)
+
+###############################################################################
+#
+# The backend the records are kept in
+#
+def records_backend():
+    """Return the records backend, importing Records.xlsx if it's new"""
+    global _BACKEND
+    with _LOCK:
+        if _BACKEND is None:
+            backend = RecordsSQLite()
+            if not backend.exists() and os.path.isfile(RECORDS_FILE):
+                wg_trace_print("Importing records from " + RECORDS_FILE, RECORD_TRACE)
+                backend.put(records_read_xlsx(RECORDS_FILE))
+            _BACKEND = backend
+        return _BACKEND
+
+###############################################################################
+#
+# Read the whole table from the backend.  Returns None if it can't be read
+# (it's tried again RECORDS_RETRY seconds later).  Nothing may be set until
+# it has been read, or the empty table would be written over the real
+# records.
+#
+def _records_load():
+    """Load the record table into memory (once)"""
+    global _RECORDS, _LOAD_FAILED
+    with _LOCK:
+        if _RECORDS is not None:
+            return _RECORDS
+        if _LOAD_FAILED is not None and time.monotonic() - _LOAD_FAILED < RECORDS_RETRY:
+            return None
+        records = array.array('h', [RECORD_NONE]) * (RECORDS_DAYS * RECORD_FIELDS)
+        try:
+            for (day, values) in records_backend().get_range():
+                for (field, value) in enumerate(values):
+                    if value is not None:
+                        records[day * RECORD_FIELDS + field] = value
+        except Exception as err: #pylint: disable=W0703
+            wg_error_print("records_load", "Unable to read the records: " + str(err))
+            _LOAD_FAILED = time.monotonic()
+            return None
+        _RECORDS = records
+        _LOAD_FAILED = None
+        return _RECORDS
+
+###############################################################################
+#
+# Return the record high/low temperature and the years they were set in a
+# 4 element list (None for anything that hasn't been recorded, or for
+# everything if the records can't be read)
+#
+def records_get(when=None):
+    """Return [high, high year, low, low year] for a date (default today)"""
+    base = records_day_index(when) * RECORD_FIELDS
+    with _LOCK:
+        records = _records_load()
+        if records is None:
+            return [None] * RECORD_FIELDS
+        values = records[base:base + RECORD_FIELDS]
+    return [None if value == RECORD_NONE else value for value in values]
+
+###############################################################################
+#
+# Return the records for the dates first through last (wrapping around the
+# end of the year) as a list of (month, day, [high, high year, low, low year])
+#
+def records_range(first, last):
+    """Return the records for a range of dates"""
+    days = []
+    date = datetime.date(2000, first.month, first.day)
+    last = datetime.date(2000, last.month, last.day)
+    while True:
+        days.append((date.month, date.day, records_get(date)))
+        if date == last:
+            return days
+        date += datetime.timedelta(days=1)
+        if date.year != 2000:
+            date = datetime.date(2000, 1, 1)
+
+###############################################################################
+#
+# Set a new record for today.  Returns False (and sets nothing) if the
+# records haven't been read.
+#
+def _records_set(field, temp, year):
+    """Set a record (high or low) and its year"""
+    global _DIRTY_SINCE
+    day = records_day_index()
+    base = day * RECORD_FIELDS + field
+    with _LOCK:
+        records = _records_load()
+        if records is None:
+            return False
+        records[base] = int(temp)
+        records[base + 1] = int(year)
+        _DIRTY.add(day)
+        if _DIRTY_SINCE is None:
+            _DIRTY_SINCE = time.monotonic()
+    return True
+
+def records_set_high(temp, year):
+    """Set a new record high for today"""
+    if _records_set(RECORD_HIGH, temp, year):
+        wg_trace_print("Recorded new record high of " + str(temp), RECORD_TRACE)
+
+def records_set_low(temp, year):
+    """Set a new record low for today"""
+    if _records_set(RECORD_LOW, temp, year):
+        wg_trace_print("Recorded new record low of " + str(temp), RECORD_TRACE)
+
+###############################################################################
+#
+# Write any new records to the backend.  Nothing is written until the oldest
+# change is RECORDS_FLUSH_DELAY seconds old (so a cold morning that sets a
+# new low every few minutes is one write), unless force is set.
+#
+# Returns the number of days written.
+#
+def records_flush(force=False):
+    """Save new records to the backend"""
+    global _DIRTY_SINCE
+    with _LOCK:
+        if not _DIRTY or _RECORDS is None:
+            return 0
+        if not force and time.monotonic() - _DIRTY_SINCE < RECORDS_FLUSH_DELAY:
+            return 0
+        days = sorted(_DIRTY)
+        values = [(day, [None if value == RECORD_NONE else value
+                         for value in _RECORDS[day * RECORD_FIELDS:(day + 1) * RECORD_FIELDS]])
+                  for day in days]
+        _DIRTY.clear()
+        _DIRTY_SINCE = None
+    try:
+        records_backend().put(values)
+    except Exception as err: #pylint: disable=W0703
+        wg_error_print("records_flush", "Unable to save the records: " + str(err))
+        with _LOCK:
+            # Try again next time
+            _DIRTY.update(days)
+            if _DIRTY_SINCE is None:
+                _DIRTY_SINCE = time.monotonic()
+        return 0
+    wg_trace_print("Saved records for " + str(len(days)) + " day(s)", RECORD_TRACE)
+    return len(days)
+
+
+###############################################################################
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Record high/low tools")
+    PARSER.add_argument("--db", default=RECORDS_DB, help="records database")
+    PARSER.add_argument("--import", dest="import_file", metavar="XLSX",
+                        help="replace the database's records with the spreadsheet's")
+    PARSER.add_argument("--export", metavar="XLSX", help="write the records to a spreadsheet")
+    PARSER.add_argument("--show", metavar="MM-DD", help="print the records for a day")
+    PARSER.add_argument("--to", metavar="MM-DD", help="with --show, the last day to print")
+    ARGS = PARSER.parse_args()
+    BACKEND = RecordsSQLite(ARGS.db)
+    if ARGS.import_file:
+        DAYS = records_read_xlsx(ARGS.import_file)
+        BACKEND.put(DAYS)
+        print("Imported " + str(len(DAYS)) + " days from " + ARGS.import_file)
+    if ARGS.export:
+        DAYS = BACKEND.get_range()
+        records_write_xlsx(DAYS, ARGS.export)
+        print("Exported " + str(len(DAYS)) + " days to " + ARGS.export)
+    if ARGS.show:
+        FIRST = datetime.datetime.strptime("2000-" + ARGS.show, "%Y-%m-%d").date()
+        LAST = FIRST
+        if ARGS.to:
+            LAST = datetime.datetime.strptime("2000-" + ARGS.to, "%Y-%m-%d").date()
+        _BACKEND = BACKEND
+        for (MONTH, DAY, VALUES) in records_range(FIRST, LAST):
+            print("%02d-%02d high %s (%s) low %s (%s)" % ((MONTH, DAY) + tuple(VALUES)))
+    if not (ARGS.import_file or ARGS.export or ARGS.show):
+        PARSER.print_help()
+        sys.exit(1)
@@ -0,0 +1,172 @@
+"""Weather data saved between runs (weekly history, last good weather screen)"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to save the history screen's data.  It
+# all goes in one small binary file:
+#   header = magic, format version, date saved (ordinal), day of the week
+#   data = 7 max temps, 7 min temps, 7 rainfall amounts (doubles)
+#   trailer = CRC-32 of the header and data
+# The file is written to a temp file, flushed to the SD card and renamed over
+# the old one, so a power cut leaves either the old file or the new one.
+#
+# The old max_temps.p, min_temps.p and rainfall.p pickles are read if there
+# is no state file yet.
+#
+# The last good weather screen (current conditions, forecast, almanac,
+# alerts) is also saved, in snapshot.json, so the display has something to
+# show as soon as it starts.
+#
+import datetime
+import json
+import os
+import pickle
+import struct
+import zlib
+from wg_helper import wg_error_print
+from wg_metrics import wg_metrics_timer
+
+WEATHER_STATE_VERSION = "1.2"
+
+STATE_FILE = "weather_state.dat"
+STATE_MAGIC = b'WGST'
+STATE_FORMAT_VERSION = 1
+STATE_DAYS = 7
+
+SNAPSHOT_FILE = "snapshot.json"
+
+_HEADER = struct.Struct("<4sHiB")
+_DATA = struct.Struct("<%dd" % (STATE_DAYS * 3))
+_CRC = struct.Struct("<I")
+
+###############################################################################
+#
+# Pack the state into the file format
+#
+def _state_pack(state):
+    """Return the bytes for a state dictionary"""
+    body = (_HEADER.pack(STATE_MAGIC, STATE_FORMAT_VERSION, state['date'].toordinal(),
+                         state['curr_day']) +
+            _DATA.pack(*[float(value) for value in
+                         state['max_temps'] + state['min_temps'] + state['rainfall']]))
+    return body + _CRC.pack(zlib.crc32(body))
+
+###############################################################################
+#
+# Unpack the file format, returns None if it isn't a good state file
+#
+def _state_unpack(raw):
+    """Return the state dictionary for the bytes from a state file"""
+    if len(raw) < _HEADER.size + _CRC.size:
+        return None
+    (body, crc) = (raw[:-_CRC.size], _CRC.unpack(raw[-_CRC.size:])[0])
+    if zlib.crc32(body) != crc:
+        return None
+    (magic, version, date, curr_day) = _HEADER.unpack_from(body)
+    if magic != STATE_MAGIC or version != STATE_FORMAT_VERSION:
+        return None
+    values = list(_DATA.unpack_from(body, _HEADER.size))
+    return {'date' : datetime.date.fromordinal(date),
+            'curr_day' : curr_day,
+            'max_temps' : values[0:STATE_DAYS],
+            'min_temps' : values[STATE_DAYS:STATE_DAYS*2],
+            'rainfall' : values[STATE_DAYS*2:STATE_DAYS*3]}
+
+###############################################################################
+#
+# Read the state from the old pickle files
+#
+def _state_load_pickles():
+    """Return the state saved by older versions, or None"""
+    try:
+        with open("max_temps.p", "rb") as max_file:
+            max_temps = pickle.load(max_file)
+        with open("min_temps.p", "rb") as min_file:
+            min_temps = pickle.load(min_file)
+        with open("rainfall.p", "rb") as rain_file:
+            rainfall = pickle.load(rain_file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    return {'date' : None, 'curr_day' : None,
+            'max_temps' : max_temps, 'min_temps' : min_temps, 'rainfall' : rainfall}
+
+###############################################################################
+#
+# Load the saved state.  Returns a dictionary with:
+#   date = the date it was saved (None if it came from the old pickles)
+#   curr_day = day of the week it was saved (None if from the old pickles)
+#   max_temps, min_temps, rainfall = a value for each day of the week
+# or None if there isn't any saved state.
+#
+def weather_state_load(file_name=STATE_FILE):
+    """Load the saved min/max/rainfall"""
+    try:
+        with open(file_name, "rb") as state_file:
+            state = _state_unpack(state_file.read())
+        if state is None:
+            wg_error_print("weather_state_load", file_name + " is damaged, ignoring it")
+        return state
+    except FileNotFoundError:
+        return _state_load_pickles()
+    except OSError as err:
+        wg_error_print("weather_state_load", "Unable to read " + file_name + ": " + str(err))
+        return None
+
+###############################################################################
+#
+# Save the state (see weather_state_load)
+#
+def weather_state_save(state, file_name=STATE_FILE):
+    """Save the min/max/rainfall safely"""
+    if state.get('date') is None:
+        state = dict(state, date=datetime.date.today())
+    tmp_name = file_name + ".tmp"
+    with wg_metrics_timer("write", file_name) as timer:
+        try:
+            with open(tmp_name, "wb") as state_file:
+                state_file.write(_state_pack(state))
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.replace(tmp_name, file_name)
+        except OSError as err:
+            wg_error_print("weather_state_save", "Unable to save " + file_name + ": " + str(err))
+            timer.failed = True
+            return False
+    return True
+
+###############################################################################
+#
+# Save the last good weather data (a dictionary of things json can write)
+#
+def weather_snapshot_save(snapshot, file_name=SNAPSHOT_FILE):
+    """Save the weather screen's data safely"""
+    tmp_name = file_name + ".tmp"
+    with wg_metrics_timer("write", file_name) as timer:
+        try:
+            with open(tmp_name, "w", encoding='utf-8') as snap_file:
+                json.dump(snapshot, snap_file)
+                snap_file.flush()
+                os.fsync(snap_file.fileno())
+            os.replace(tmp_name, file_name)
+        except (OSError, TypeError, ValueError) as err:
+            wg_error_print("weather_snapshot_save",
+                           "Unable to save " + file_name + ": " + str(err))
+            timer.failed = True
+            return False
+    return True
+
+###############################################################################
+#
+# Load the last good weather data, None if there isn't any
+#
+def weather_snapshot_load(file_name=SNAPSHOT_FILE):
+    """Load the saved weather screen's data"""
+    try:
+        with open(file_name, "r", encoding='utf-8') as snap_file:
+            return json.load(snap_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        wg_error_print("weather_snapshot_load", "Unable to read " + file_name + ": " + str(err))
+        return None
@@ -0,0 +1,245 @@
+"""Time series of the station's readings with hourly, daily and monthly rollups"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to keep a history of the readings.  The
+# last TSDB_RAW_SIZE samples of each series are kept in a ring buffer, and
+# hourly, daily and monthly min/max/sum/count are updated as each sample
+# comes in, so asking for "the highs for the last year" reads a few hundred
+# precomputed buckets instead of every sample.
+#
+# Series:
+#   temp, humidity, pressure, wind, gust = outside readings (F, %, "Hg, mph)
+#   rain = rain since the last sample (inches, so a bucket's sum is its rain)
+#   indoor_temp, indoor_humidity = thermostat readings (F, %)
+#
+import array
+import datetime
+import os
+import pickle
+import threading
+import time
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from wg_metrics import wg_metrics_timer
+
+WEATHER_TSDB_VERSION = "1.0"
+
+TRACE = False
+
+TSDB_FILE = "tsdb.p"
+TSDB_SAVE_INTERVAL = 3600   # seconds between saves
+TSDB_SERIES = ("temp", "humidity", "pressure", "wind", "gust", "rain",
+               "indoor_temp", "indoor_humidity")
+TSDB_RAW_SIZE = 4320        # three days of one minute samples
+
+TSDB_HOUR = "hour"
+TSDB_DAY = "day"
+TSDB_MONTH = "month"
+TSDB_ROLLUP_SIZE = {TSDB_HOUR : 24 * 92,    # about three months
+                    TSDB_DAY : 366 * 5,     # five years
+                    TSDB_MONTH : 12 * 50}   # fifty years
+
+_TSDB = None
+_LAST_SAVE = None           # time.monotonic() of the last save
+_LOCK = threading.Lock()
+
+###############################################################################
+#
+# Buckets are numbered in local time: hours and days since 1/1/1 and months
+# since year 0
+#
+def _bucket(resolution, when):
+    """Return the bucket number for a timestamp"""
+    local = datetime.datetime.fromtimestamp(when)
+    if resolution == TSDB_HOUR:
+        return local.toordinal() * 24 + local.hour
+    if resolution == TSDB_DAY:
+        return local.toordinal()
+    return local.year * 12 + local.month - 1
+
+def _bucket_start(resolution, bucket):
+    """Return the timestamp a bucket starts at"""
+    if resolution == TSDB_HOUR:
+        start = datetime.datetime.fromordinal(bucket // 24).replace(hour=bucket % 24)
+    elif resolution == TSDB_DAY:
+        start = datetime.datetime.fromordinal(bucket)
+    else:
+        start = datetime.datetime(bucket // 12, bucket % 12 + 1, 1)
+    return time.mktime(start.timetuple())
+
+
+class TSRollup:
+    """min/max/sum/count for each hour, day or month, in a ring of buckets"""
+
+    ###########################################################################
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.size = TSDB_ROLLUP_SIZE[resolution]
+        self.keys = array.array('q', [-1]) * self.size  # bucket in each slot
+        self.mins = array.array('d', [0.0]) * self.size
+        self.maxs = array.array('d', [0.0]) * self.size
+        self.sums = array.array('d', [0.0]) * self.size
+        self.counts = array.array('l', [0]) * self.size
+
+    ###########################################################################
+    def add(self, when, value):
+        """Fold a sample into its bucket"""
+        bucket = _bucket(self.resolution, when)
+        slot = bucket % self.size
+        if self.keys[slot] != bucket:
+            if self.keys[slot] > bucket:
+                return      # older than anything we keep
+            self.keys[slot] = bucket
+            self.mins[slot] = value
+            self.maxs[slot] = value
+            self.sums[slot] = value
+            self.counts[slot] = 1
+            return
+        if value < self.mins[slot]:
+            self.mins[slot] = value
+        if value > self.maxs[slot]:
+            self.maxs[slot] = value
+        self.sums[slot] += value
+        self.counts[slot] += 1
+
+    ###########################################################################
+    #
+    # Return a list of (start time, min, max, mean, sum, count) for the
+    # buckets between start and end that have samples
+    #
+    def query(self, start, end):
+        """Return the buckets for a time range"""
+        first = max(_bucket(self.resolution, start), _bucket(self.resolution, end) - self.size + 1)
+        rows = []
+        for bucket in range(first, _bucket(self.resolution, end) + 1):
+            slot = bucket % self.size
+            if self.keys[slot] == bucket:
+                rows.append((_bucket_start(self.resolution, bucket), self.mins[slot],
+                             self.maxs[slot], self.sums[slot] / self.counts[slot],
+                             self.sums[slot], self.counts[slot]))
+        return rows
+
+
+class TimeSeries:
+    """The recent samples of one reading and their rollups"""
+
+    ###########################################################################
+    def __init__(self, name):
+        self.name = name
+        self.size = TSDB_RAW_SIZE
+        self.times = array.array('d', [0.0]) * self.size
+        self.values = array.array('d', [0.0]) * self.size
+        self.next = 0           # slot for the next sample
+        self.count = 0          # number of slots in use
+        self.rollups = {resolution : TSRollup(resolution) for resolution in TSDB_ROLLUP_SIZE}
+
+    ###########################################################################
+    def add(self, when, value):
+        """Add a sample"""
+        self.times[self.next] = when
+        self.values[self.next] = value
+        self.next = (self.next + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        for rollup in self.rollups.values():
+            rollup.add(when, value)
+
+    ###########################################################################
+    def raw(self, start, end):
+        """Return the (time, value) samples between start and end"""
+        rows = []
+        for i in range(self.count):
+            slot = (self.next - self.count + i) % self.size
+            if start <= self.times[slot] <= end:
+                rows.append((self.times[slot], self.values[slot]))
+        return rows
+
+
+###############################################################################
+#
+# The store, loaded from TSDB_FILE the first time it's needed
+#
+def _tsdb():
+    """Return the dictionary of series (call with _LOCK held)"""
+    global _TSDB, _LAST_SAVE
+    if _TSDB is None:
+        _LAST_SAVE = time.monotonic()
+        if os.path.isfile(TSDB_FILE):
+            try:
+                with open(TSDB_FILE, "rb") as tsdb_file:
+                    _TSDB = pickle.load(tsdb_file)
+            except Exception as err: #pylint: disable=W0703
+                wg_error_print("tsdb", "Unable to read " + TSDB_FILE + ": " + str(err))
+        if _TSDB is None:
+            _TSDB = {}
+        for name in TSDB_SERIES:
+            if name not in _TSDB:
+                _TSDB[name] = TimeSeries(name)
+    return _TSDB
+
+###############################################################################
+#
+# Add a sample.
+# Args:
+#   name = series name (see TSDB_SERIES)
+#   value = the reading
+#   when = timestamp of the reading (default now)
+#
+def tsdb_add(name, value, when=None):
+    """Add a reading to a series"""
+    if when is None:
+        when = time.time()
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        wg_error_print("tsdb_add", "Bad " + name + " value: " + repr(value))
+        return
+    with _LOCK:
+        _tsdb()[name].add(when, value)
+    wg_trace_print("tsdb " + name + " = " + str(value), TRACE)
+
+###############################################################################
+#
+# Read a series.
+# Args:
+#   name = series name
+#   start, end = timestamps
+#   resolution = None for the raw samples [(time, value)], or TSDB_HOUR,
+#                TSDB_DAY or TSDB_MONTH for
+#                [(start time, min, max, mean, sum, count)]
+#
+def tsdb_query(name, start, end, resolution=None):
+    """Return the samples or rollups for a time range"""
+    with _LOCK:
+        series = _tsdb()[name]
+        if resolution is None:
+            return series.raw(start, end)
+        return series.rollups[resolution].query(start, end)
+
+###############################################################################
+#
+# Save the store (no more than once every TSDB_SAVE_INTERVAL seconds unless
+# force is set).  Call from the worker thread.
+#
+def tsdb_save(force=False):
+    """Save the time series to disk"""
+    global _LAST_SAVE
+    with _LOCK:
+        if _TSDB is None:
+            return
+        if not force and time.monotonic() - _LAST_SAVE < TSDB_SAVE_INTERVAL:
+            return
+        with wg_metrics_timer("write", TSDB_FILE) as timer:
+            try:
+                tmp_name = TSDB_FILE + ".tmp"
+                with open(tmp_name, "wb") as tsdb_file:
+                    pickle.dump(_TSDB, tsdb_file, pickle.HIGHEST_PROTOCOL)
+                    tsdb_file.flush()
+                    os.fsync(tsdb_file.fileno())
+                os.replace(tmp_name, TSDB_FILE)
+            except OSError as err:
+                wg_error_print("tsdb_save", "Unable to save " + TSDB_FILE + ": " + str(err))
+                timer.failed = True
+        _LAST_SAVE = time.monotonic()
@@ -0,0 +1,189 @@
+"""Helper module to interface with WeatherUnderground personal weather stations."""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to interface with WeatherUnderground
+#
+# http://api.wunderground.com/api/<key>/alerts/conditions/forecast/q/MA/pws:KMATEWKS6.json
+#
+# All of the nearby stations in WU_PWS are asked at once and the newest
+# observation wins, so asking several costs about the same as asking one.
+# Each reply is decoded once; only the parts we use are kept, as weather_model
+# records (see getwudata).  The sun and moon come from the ephemeris table
+# (weather_ephemeris), so they aren't asked for.
+#
+# To use it, add ("WeatherUnderground", getwudata) to FETCH_PROVIDERS in
+# weather_fetch.py.  Each station asked is one call from the
+# "WeatherUnderground" budget in weather_poll.py (weather_fetch leaves the
+# counting to us, see FETCH_OWN_BUDGET).
+#
+import concurrent.futures
+import datetime
+import json
+import sys
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from wg_http import wg_http_request
+from weather_model import DailyForecast
+from weather_model import Observation
+from weather_model import f_to_c
+from weather_poll import poll_budget_take
+# WeatherUnderground - requires an account
+from weather_underground_account_settings import WU_API_KEY
+from weather_underground_account_settings import WU_STATE_CODE
+from weather_underground_account_settings import WU_PWS
+
+WEATHER_UNDERGROUND_VERSION = "2.1"
+
+TRACE = False
+
+WU_BUDGET = "WeatherUnderground"    # name of the calls budget in weather_poll
+WU_DEADLINE = 20.0                  # seconds to wait for the stations
+
+# WeatherUnderground's icon names and the icons we have (DarkSky's, see
+# forecast_condition in weather_model.py)
+WU_ICONS = {"chanceflurries" : "snow",
+            "chancerain" : "rain",
+            "chancesleet" : "sleet",
+            "chancesnow" : "snow",
+            "chancetstorms" : "rain",
+            "clear" : "clear-day",
+            "cloudy" : "cloudy",
+            "flurries" : "snow",
+            "fog" : "fog",
+            "hazy" : "fog",
+            "mostlycloudy" : "cloudy",
+            "mostlysunny" : "partly-cloudy-day",
+            "partlycloudy" : "partly-cloudy-day",
+            "partlysunny" : "partly-cloudy-day",
+            "rain" : "rain",
+            "sleet" : "sleet",
+            "snow" : "snow",
+            "sunny" : "clear-day",
+            "tstorms" : "rain"}
+
+_LAST_EPOCH = 0         # time of the newest observation we've used
+
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(WU_PWS), 1),
+                                                  thread_name_prefix="wu")
+
+###############################################################################
+#
+# WeatherUnderground sends most numbers as strings, and "", "NA" or "--" (or
+# -9999) when a station doesn't have one.  Returns a float or None.
+#
+def _number(value, strip=""):
+    """Return a WeatherUnderground value as a number"""
+    try:
+        number = float(str(value).strip().rstrip(strip))
+    except (TypeError, ValueError):
+        return None
+    return None if number <= -999 else number
+
+###############################################################################
+#
+# Ask one station.  Returns (observation_epoch, station, weather data), or
+# None if it failed, has no temperature or sent something we can't read
+# (so one bad station can't spoil the others).
+#
+def _ask_station(pws):
+    """Get one station's data"""
+    if not poll_budget_take(WU_BUDGET):
+        wg_error_print("getwudata", pws + " skipped, no calls left today")
+        return None
+    try:
+        ret = wg_http_request('GET', 'http://api.wunderground.com/api/' + WU_API_KEY +
+                              '/alerts/conditions/forecast/q/' + WU_STATE_CODE +
+                              '/pws:' + pws + '.json', service="WeatherUnderground")
+        reply = json.loads(ret.data.decode('utf-8'))
+        parts = {key : reply[key] for key in ('current_observation', 'forecast')}
+        parts['alerts'] = reply.get('alerts', [])
+        curr = parts['current_observation']
+        if _number(curr.get('temp_c')) is None:
+            wg_error_print("getwudata", pws + " temp_c is None")
+            return None
+        epoch = int(curr['observation_epoch'])
+        wud = dict()
+        _fill_wu_data(wud, parts)
+        return (epoch, pws, wud)
+    except Exception: #pylint: disable=W0703
+        wg_error_print("getwudata", "Weather Collection Error #1 (PWS = " + pws + ") " +
+                       "(Exc type = " + str(sys.exc_info()[0]) + ") " +
+                       "(Exc value = " + str(sys.exc_info()[1]) + ")")
+        return None
+
+###############################################################################
+def _station_result(future):
+    """A finished _ask_station's result, or None if it raised"""
+    try:
+        return future.result()
+    except Exception: #pylint: disable=W0703
+        wg_error_print("getwudata", "Station failed (Exc value = " +
+                       str(sys.exc_info()[1]) + ")")
+        return None
+
+###############################################################################
+#
+# Turn a station's reply into the weather data (see weather_model.py)
+#
+def _fill_wu_data(dsd, parts):
+    """Convert a WeatherUnderground reply to weather_model records"""
+    curr = parts['current_observation']
+    wind_kph = _number(curr.get('wind_kph'))
+    gust_kph = _number(curr.get('wind_gust_kph'))
+    visibility_km = _number(curr.get('visibility_km'))
+    dsd['obs'] = Observation(time=datetime.datetime.fromtimestamp(int(curr['observation_epoch'])),
+                             summary=curr.get('weather') or None,
+                             temp_c=_number(curr['temp_c']),
+                             feels_like_c=_number(curr.get('feelslike_c')),
+                             humidity=_number(curr.get('relative_humidity'), "%"),
+                             pressure_hpa=_number(curr.get('pressure_mb')),
+                             wind_ms=None if wind_kph is None else wind_kph / 3.6,
+                             gust_ms=None if gust_kph is None else gust_kph / 3.6,
+                             wind_dir_deg=_number(curr.get('wind_degrees')),
+                             visibility_m=None if visibility_km is None else visibility_km * 1000,
+                             rain_today_mm=_number(curr.get('precip_today_metric')))
+
+    # The text forecast has a day and a night for each day, we want the days
+    forecast = parts['forecast']
+    texts = [period['fcttext'] for period in forecast['txt_forecast']['forecastday'][::2]]
+    dsd['forecast'] = []
+    for (i, day) in enumerate(forecast['simpleforecast']['forecastday'][:4]):
+        date = day['date']
+        dsd['forecast'].append(
+            DailyForecast(date=datetime.date(int(date['year']), int(date['month']),
+                                             int(date['day'])),
+                          high_c=f_to_c(_number(day['high']['fahrenheit'])),
+                          low_c=f_to_c(_number(day['low']['fahrenheit'])),
+                          icon=WU_ICONS.get(day['icon'], "cloudy"),
+                          summary=texts[i] if i < len(texts) else day['conditions']))
+        wg_trace_print("Forecast " + repr(dsd['forecast'][-1]), TRACE)
+
+    dsd['alerts'] = [alert['message'] for alert in parts['alerts']]
+
+###############################################################################
+#
+# Get weather data from the WeatherUnderground stations in WU_PWS (see
+# weather_model.py for what goes in dsd).  Returns False if none of them
+# answered with an observation newer than the last one we used.
+#
+def getwudata(dsd):
+    """Return the newest weather data from the nearby stations"""
+    global _LAST_EPOCH
+    futures = [_EXECUTOR.submit(_ask_station, pws) for pws in WU_PWS]
+    (done, _) = concurrent.futures.wait(futures, timeout=WU_DEADLINE)
+    replies = [reply for reply in (_station_result(future) for future in done)
+               if reply is not None]
+    if not replies:
+        wg_error_print("getwudata", "No station answered")
+        return False
+    (epoch, pws, wud) = max(replies, key=lambda reply: reply[0])
+    if epoch <= _LAST_EPOCH:
+        wg_error_print("getwudata", "No station has data newer than the last weather data")
+        return False
+    dsd.update(wud)
+    _LAST_EPOCH = epoch
+    wg_trace_print("WeatherUnderground data from " + pws + " (" +
+                   str(len(replies)) + " of " + str(len(WU_PWS)) + " answered)", TRACE)
+    return True
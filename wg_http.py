@@ -0,0 +1,121 @@
+"""Shared, pooled HTTP client used by all of my provider modules"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to share one HTTP connection pool between
+# the thermostat, ThingSpeak, DarkSky and Tempest code.  Connections to each
+# host are kept alive and reused from one update cycle to the next instead of
+# paying for a new TCP/TLS handshake on every call.
+#
+import threading
+import time
+from urllib.parse import urlsplit
+from wg_lazy import wg_lazy_import
+from wg_metrics import wg_metrics_bytes
+from wg_metrics import wg_metrics_observe
+
+WG_HTTP_VERSION = "1.3"
+
+HTTP_NUM_POOLS = 8              # Number of hosts we keep a pool for
+HTTP_MAXSIZE_PER_HOST = 4       # Keep-alive connections (and concurrent requests) per host
+                                # (the WeatherUnderground stations are all asked at once)
+HTTP_CONNECT_TIMEOUT = 5.0      # seconds
+HTTP_READ_TIMEOUT = 20.0        # seconds (the thermostat can be very slow)
+HTTP_POOL_TIMEOUT = 30.0        # seconds to wait for a free connection to a busy host
+
+_PMAN = None
+_PMAN_LOCK = threading.Lock()
+
+# Per-host request counters.  Each entry is a dictionary with:
+#   count = number of requests made
+#   errors = number of requests that raised an exception
+#   total = total seconds spent in requests
+#   max = longest request (seconds)
+#   last = most recent request (seconds)
+HTTP_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+###############################################################################
+#
+# Return the one PoolManager for this process, creating it on first use
+#
+def wg_http_pool():
+    """Return the shared PoolManager"""
+    global _PMAN
+    if _PMAN is None:
+        with _PMAN_LOCK:
+            if _PMAN is None:
+                urllib3 = wg_lazy_import("urllib3")
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+                _PMAN = urllib3.PoolManager(num_pools=HTTP_NUM_POOLS,
+                                            maxsize=HTTP_MAXSIZE_PER_HOST,
+                                            block=True,
+                                            timeout=urllib3.Timeout(
+                                                connect=HTTP_CONNECT_TIMEOUT,
+                                                read=HTTP_READ_TIMEOUT))
+    return _PMAN
+
+###############################################################################
+#
+# Remember how long a request to a host took
+#
+def _record_request(host, service, elapsed, failed):
+    """Update the per-host latency counters and the metrics"""
+    wg_metrics_observe("http", service or host, elapsed, failed)
+    with _STATS_LOCK:
+        stats = HTTP_STATS.get(host)
+        if stats is None:
+            stats = {'count' : 0, 'errors' : 0, 'total' : 0.0, 'max' : 0.0, 'last' : 0.0}
+            HTTP_STATS[host] = stats
+        stats['count'] += 1
+        if failed:
+            stats['errors'] += 1
+        stats['total'] += elapsed
+        stats['last'] = elapsed
+        if elapsed > stats['max']:
+            stats['max'] = elapsed
+
+###############################################################################
+#
+# Make an HTTP request through the shared pool.
+# Args:
+#   method = 'GET', 'POST', etc.
+#   url = the complete URL (including any query string)
+#   body = request body for POSTs
+#   headers = dictionary of request headers
+#   timeout = override the default connect/read timeouts (seconds or
+#             urllib3.Timeout)
+#   service = name for the metrics (default the host name)
+#
+# Returns the urllib3 response (the data has already been read).  Exceptions
+# are passed on to the caller, as they were with a private PoolManager.
+#
+def wg_http_request(method, url, body=None, headers=None, timeout=None, service=None):
+    """Make an HTTP request using the shared connection pool"""
+    host = urlsplit(url).hostname or ""
+    kwargs = {'body' : body, 'headers' : headers, 'pool_timeout' : HTTP_POOL_TIMEOUT}
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    start = time.monotonic()
+    failed = True
+    try:
+        ret = wg_http_pool().urlopen(method, url, **kwargs)
+        failed = False
+        if isinstance(body, str):
+            sent = len(body.encode('utf-8'))    # bytes, not characters
+        else:
+            sent = len(body) if body else 0
+        wg_metrics_bytes(service or host, len(ret.data or b""), sent)
+        return ret
+    finally:
+        _record_request(host, service, time.monotonic() - start, failed)
+
+###############################################################################
+#
+# Return a copy of the per-host latency counters
+#
+def wg_http_stats():
+    """Return a snapshot of the per-host request counters"""
+    with _STATS_LOCK:
+        return {host : dict(stats) for host, stats in HTTP_STATS.items()}
@@ -0,0 +1,33 @@
+"""Import heavy packages the first time they're needed"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to put off importing big packages
+# (twilio, ephem, urllib3, openpyxl) until they are used, so the display
+# comes up without waiting for them to load from the SD card.
+#
+import importlib
+import threading
+import time
+
+WG_LAZY_VERSION = "1.0"
+
+# Seconds each lazily imported module took to load
+WG_LAZY_TIMES = {}
+
+_LOCK = threading.Lock()
+
+###############################################################################
+#
+# Import a module (the first time) and return it
+#
+def wg_lazy_import(name):
+    """Return the module, importing it if it hasn't been yet"""
+    with _LOCK:
+        if name not in WG_LAZY_TIMES:
+            start = time.monotonic()
+            module = importlib.import_module(name)
+            WG_LAZY_TIMES[name] = time.monotonic() - start
+            return module
+    return importlib.import_module(name)
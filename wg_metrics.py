@@ -0,0 +1,207 @@
+"""Timings, error counts and bytes transferred for everything slow we do"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to time the provider calls, HTTP
+# requests, file writes, background jobs and screen draws.  Each kind of
+# thing (kind) and what it was for (target) gets a latency histogram and an
+# error count, and each HTTP host gets the bytes sent and received.
+#
+# The numbers are served in the Prometheus text format:
+#   curl http://weatherpi:9111/metrics
+# and wg_metrics_summary() gives a few lines for the on-screen overlay.
+#
+#   with wg_metrics_timer("write", "tsdb.p"):
+#       ...
+#
+import http.server
+import threading
+import time
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+
+WG_METRICS_VERSION = "1.1"
+
+WG_METRICS_HOST = "127.0.0.1"   # only this machine ("" for all interfaces, to
+                                # let Prometheus scrape from elsewhere)
+WG_METRICS_PORT = 9111          # 0 to not serve the metrics
+WG_METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (kind, target) -> dictionary with:
+#   buckets = count of the calls that took <= each of WG_METRICS_BUCKETS
+#   count = number of calls
+#   errors = number of calls that failed
+#   sum = total seconds
+#   max = longest call (seconds)
+#   last = most recent call (seconds)
+_CALLS = {}
+_BYTES = {}                     # (target, 'in' or 'out') -> bytes
+_LOCK = threading.Lock()
+_SERVER = None
+
+###############################################################################
+#
+# Record one call.
+# Args:
+#   kind = what sort of call ("provider", "http", "write", "job", "frame")
+#   target = what it was for (provider name, host, file name, ...)
+#   seconds = how long it took
+#   failed = did it fail?
+#
+def wg_metrics_observe(kind, target, seconds, failed=False):
+    """Add a call to the latency histogram and error count"""
+    with _LOCK:
+        stats = _CALLS.get((kind, target))
+        if stats is None:
+            stats = {'buckets' : [0] * len(WG_METRICS_BUCKETS), 'count' : 0, 'errors' : 0,
+                     'sum' : 0.0, 'max' : 0.0, 'last' : 0.0}
+            _CALLS[(kind, target)] = stats
+        for (i, bound) in enumerate(WG_METRICS_BUCKETS):
+            if seconds <= bound:
+                stats['buckets'][i] += 1
+        stats['count'] += 1
+        if failed:
+            stats['errors'] += 1
+        stats['sum'] += seconds
+        stats['last'] = seconds
+        if seconds > stats['max']:
+            stats['max'] = seconds
+
+###############################################################################
+#
+# Record bytes received from (and sent to) a host
+#
+def wg_metrics_bytes(target, received, sent=0):
+    """Add to a host's byte counts"""
+    with _LOCK:
+        _BYTES[(target, 'in')] = _BYTES.get((target, 'in'), 0) + received
+        _BYTES[(target, 'out')] = _BYTES.get((target, 'out'), 0) + sent
+
+
+class _WGMetricsTimer:
+    """Time a with block; it failed if it raised or the block set failed"""
+
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target = target
+        self.failed = False
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wg_metrics_observe(self.kind, self.target, time.monotonic() - self.start,
+                           self.failed or exc_type is not None)
+        return False
+
+###############################################################################
+#
+# Time a with block (see wg_metrics_observe for the args).  Exceptions are
+# counted as errors and passed on; set .failed for failures that don't raise.
+#
+def wg_metrics_timer(kind, target):
+    """Return a context manager that times a call"""
+    return _WGMetricsTimer(kind, target)
+
+###############################################################################
+#
+# Return a copy of the call statistics, {(kind, target) : dictionary}
+#
+def wg_metrics_stats():
+    """Return a snapshot of the call statistics"""
+    with _LOCK:
+        return {key : dict(stats, buckets=list(stats['buckets'])) for (key, stats) in _CALLS.items()}
+
+###############################################################################
+def _label(value):
+    """Quote a Prometheus label value"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+###############################################################################
+#
+# Everything in the Prometheus text format
+#
+def wg_metrics_text():
+    """Return the metrics as Prometheus text"""
+    with _LOCK:
+        calls = sorted(_CALLS.items())
+        transferred = sorted(_BYTES.items())
+    lines = ["# HELP wg_call_seconds How long each call took",
+             "# TYPE wg_call_seconds histogram"]
+    for ((kind, target), stats) in calls:
+        labels = "kind=" + _label(kind) + ",target=" + _label(target)
+        for (bound, count) in zip(WG_METRICS_BUCKETS, stats['buckets']):
+            lines.append("wg_call_seconds_bucket{%s,le=\"%g\"} %d" % (labels, bound, count))
+        lines.append("wg_call_seconds_bucket{%s,le=\"+Inf\"} %d" % (labels, stats['count']))
+        lines.append("wg_call_seconds_sum{%s} %f" % (labels, stats['sum']))
+        lines.append("wg_call_seconds_count{%s} %d" % (labels, stats['count']))
+    lines += ["# HELP wg_call_errors_total Calls that failed",
+              "# TYPE wg_call_errors_total counter"]
+    for ((kind, target), stats) in calls:
+        lines.append("wg_call_errors_total{kind=%s,target=%s} %d" %
+                     (_label(kind), _label(target), stats['errors']))
+    lines += ["# HELP wg_bytes_total Bytes received from and sent to each host",
+              "# TYPE wg_bytes_total counter"]
+    for ((target, direction), count) in transferred:
+        lines.append("wg_bytes_total{target=%s,direction=%s} %d" %
+                     (_label(target), _label(direction), count))
+    return "\n".join(lines) + "\n"
+
+###############################################################################
+#
+# A few lines for the debug overlay, slowest (by total time) first:
+#   "kind target  count err  avg ms  max ms  last ms"
+#
+def wg_metrics_summary(top=10):
+    """Return the busiest calls as lines of text"""
+    with _LOCK:
+        calls = sorted(_CALLS.items(), key=lambda item: -item[1]['sum'])[:top]
+    return ["%-8s %-20.20s %5d %3d %7.1f %7.1f %7.1f" %
+            (kind, target, stats['count'], stats['errors'],
+             stats['sum'] * 1000.0 / stats['count'], stats['max'] * 1000.0,
+             stats['last'] * 1000.0)
+            for ((kind, target), stats) in calls]
+
+
+class _WGMetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Answer /metrics"""
+
+    def do_GET(self): #pylint: disable=C0103
+        """Send the metrics"""
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = wg_metrics_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): #pylint: disable=W0622
+        """Don't log every scrape"""
+
+###############################################################################
+#
+# Serve the metrics on a background thread.  Returns False if the port
+# couldn't be opened (the station runs fine without it).
+#
+def wg_metrics_serve(port=WG_METRICS_PORT, host=WG_METRICS_HOST):
+    """Start the metrics HTTP server"""
+    global _SERVER
+    if _SERVER is not None or not port:
+        return _SERVER is not None
+    try:
+        _SERVER = http.server.ThreadingHTTPServer((host, port), _WGMetricsHandler)
+    except OSError as err:
+        wg_error_print("wg_metrics_serve", "Unable to serve metrics on port " +
+                       str(port) + ": " + str(err))
+        return False
+    _SERVER.daemon_threads = True
+    threading.Thread(target=_SERVER.serve_forever, name="metrics", daemon=True).start()
+    wg_trace_print("Serving metrics on " + (host or "all interfaces") + " port " + str(port),
+                   True)
+    return True
@@ -0,0 +1,105 @@
+"""Measure where the time goes while the program starts"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to time each module's import and each
+# step of startup.  Nothing is timed unless wg_profile_begin() is called
+# (weather.py does when it's run with --profile-startup).
+#
+import builtins
+import sys
+import threading
+import time
+from wg_helper import wg_trace_print
+from wg_lazy import WG_LAZY_TIMES
+
+WG_PROFILE_VERSION = "1.2"
+
+_START = None           # time.monotonic() profiling started
+_IMPORTS = {}           # module name -> seconds (not counting what it imported)
+_MARKS = []             # (label, seconds since the last mark)
+_LAST_MARK = None
+_LOCAL = threading.local()  # .stack = time spent in nested imports, one entry per
+                            # level (each thread has its own, they import at once)
+_IMPORTS_LOCK = threading.Lock()
+_REAL_IMPORT = builtins.__import__
+_REPORTED = False
+
+###############################################################################
+#
+# Time an import.  Only the first import of a module costs anything, so only
+# those are recorded.
+#
+def _timed_import(name, globs=None, locs=None, fromlist=(), level=0):
+    """builtins.__import__ that records how long new modules take"""
+    if level != 0 or name in sys.modules:
+        return _REAL_IMPORT(name, globs, locs, fromlist, level)
+    stack = getattr(_LOCAL, 'stack', None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    stack.append(0.0)
+    start = time.monotonic()
+    try:
+        return _REAL_IMPORT(name, globs, locs, fromlist, level)
+    finally:
+        elapsed = time.monotonic() - start
+        nested = stack.pop()
+        with _IMPORTS_LOCK:
+            _IMPORTS[name] = _IMPORTS.get(name, 0.0) + elapsed - nested
+        if stack:
+            stack[-1] += elapsed
+
+###############################################################################
+#
+# Start timing
+#
+def wg_profile_begin():
+    """Start timing imports and startup steps"""
+    global _START, _LAST_MARK
+    if _START is None:
+        _START = time.monotonic()
+        _LAST_MARK = _START
+        builtins.__import__ = _timed_import
+
+###############################################################################
+#
+# Note that a step of startup is done
+#
+def wg_profile_mark(label):
+    """Record the time since the last mark"""
+    global _LAST_MARK
+    if _START is None or _REPORTED:
+        return
+    now = time.monotonic()
+    _MARKS.append((label, now - _LAST_MARK))
+    _LAST_MARK = now
+
+###############################################################################
+#
+# Stop timing and report the slowest imports, the lazy imports done so far
+# (see wg_lazy, they don't go through __import__) and the startup steps (to
+# the log and stdout).  Only the first call reports.
+#
+def wg_profile_report(top=25):
+    """Report the startup profile"""
+    global _REPORTED
+    if _START is None or _REPORTED:
+        return
+    _REPORTED = True
+    builtins.__import__ = _REAL_IMPORT
+    lines = ["Startup profile: %.3f seconds to the first frame" % (time.monotonic() - _START)]
+    lines.append("  Imports (seconds, not counting the modules they import):")
+    with _IMPORTS_LOCK:
+        imports = sorted(_IMPORTS.items(), key=lambda item: -item[1])[:top]
+    for (name, elapsed) in imports:
+        lines.append("    %-30s %.3f" % (name, elapsed))
+    lines.append("  Lazy imports so far (seconds, including the modules they import):")
+    for (name, elapsed) in sorted(WG_LAZY_TIMES.items(), key=lambda item: -item[1]):
+        lines.append("    %-30s %.3f" % (name, elapsed))
+    lines.append("  Startup steps:")
+    for (label, elapsed) in _MARKS:
+        lines.append("    %-30s %.3f" % (label, elapsed))
+    for line in lines:
+        print(line)
+        wg_trace_print(line, True)
@@ -9,11 +9,13 @@
 import datetime
 import pprint
 import json
-from urllib3 import PoolManager
+import threading
+import time
 from wg_helper import wg_error_print
 from wg_helper import wg_trace_print
+from wg_http import wg_http_request
 
-WG_RADIO_THERMOSTAT_VERSION = "2.1"
+WG_RADIO_THERMOSTAT_VERSION = "2.3"
 
 # The name (URL) of your Radio Thermostat
 TSTAT_IP = "thermostat-76-8C-C9"
@@ -45,6 +47,98 @@ RADTHERM_STR_SUCCESS = "SUCCESS"
 RADTHERM_STATUS_ERROR = {"error" : -1}
 RADTHERM_STATUS_SUCCESS = {"success" : 0}
 
+# The thermostat's web server is slow (seconds per request), so everything we
+# read from it is cached for this many seconds.  That's short enough that an
+# update cycle sees current data but every reader in the cycle shares one
+# request.
+RADTHERM_CACHE_TTL = 30.0
+
+# Cached thermostat responses, keyed by resource ("" = /tstat).  Each entry is
+# (time.monotonic() when read, decoded response)
+_RADTHERM_CACHE = {}
+# Requests in progress, keyed by resource.  Each entry is
+# [threading.Event, response, exception, generation] so that anyone else
+# asking for the same resource waits for (and shares) the one request.
+_RADTHERM_INFLIGHT = {}
+# Bumped by radtherm_invalidate().  A reply to a request that started before
+# the latest invalidate may be out of date, so it isn't cached or shared.
+_RADTHERM_GENERATION = 0
+_RADTHERM_LOCK = threading.Lock()
+
+# When the thermostat is busy it answers -1 for the temperature and humidity
+# (and the callers ask again), so those replies aren't cached
+RADTHERM_PLAUSIBLE_KEYS = ("temp", "humidity")
+
+###############################################################################
+def _radtherm_cacheable(retval):
+    """Is this reply worth keeping?"""
+    if 'error' in retval:
+        return False
+    for key in RADTHERM_PLAUSIBLE_KEYS:
+        if key in retval and not retval[key] > 0:
+            return False
+    return True
+
+###############################################################################
+#
+# GET a thermostat resource, using the cached copy if it's fresh enough.
+# Args:
+#   resource = what follows /tstat in the URL ("" for the status)
+#   max_age = how many seconds old the cached copy can be
+#
+# Returns the decoded response.  Exceptions are passed on to the caller.
+#
+def _radtherm_get(resource, max_age=RADTHERM_CACHE_TTL):
+    """GET /tstat<resource>, from the cache if possible"""
+    with _RADTHERM_LOCK:
+        entry = _RADTHERM_CACHE.get(resource)
+        if entry is not None and (time.monotonic() - entry[0]) < max_age:
+            return entry[1]
+        inflight = _RADTHERM_INFLIGHT.get(resource)
+        if inflight is None or inflight[3] != _RADTHERM_GENERATION:
+            inflight = [threading.Event(), None, None, _RADTHERM_GENERATION]
+            _RADTHERM_INFLIGHT[resource] = inflight
+            owner = True
+        else:
+            owner = False
+    if not owner:
+        # Someone else is already asking, use their answer
+        inflight[0].wait()
+        if inflight[2] is not None:
+            raise inflight[2]
+        return inflight[1]
+    try:
+        ret = wg_http_request('GET', 'http://' + TSTAT_IP + '/tstat' + resource,
+                              service="Radio Thermostat")
+        retval = json.loads(ret.data.decode('utf-8'))
+        inflight[1] = retval
+        if _radtherm_cacheable(retval):
+            with _RADTHERM_LOCK:
+                if inflight[3] == _RADTHERM_GENERATION:
+                    _RADTHERM_CACHE[resource] = (time.monotonic(), retval)
+        return retval
+    except Exception as err:
+        inflight[2] = err
+        raise
+    finally:
+        with _RADTHERM_LOCK:
+            if _RADTHERM_INFLIGHT.get(resource) is inflight:
+                del _RADTHERM_INFLIGHT[resource]
+        inflight[0].set()
+
+###############################################################################
+#
+# Forget everything we've cached.  Called after we change a setting since the
+# thermostat may change other values along with it.  A GET that is already
+# on its way won't be cached, and anyone asking after this waits for a new one.
+#
+def radtherm_invalidate():
+    """Throw away the cached thermostat data"""
+    global _RADTHERM_GENERATION
+    with _RADTHERM_LOCK:
+        _RADTHERM_GENERATION += 1
+        _RADTHERM_CACHE.clear()
+
 ###############################################################################
 #
 # Get the status of the thermostat.  This includes:
@@ -60,17 +154,16 @@ RADTHERM_STATUS_SUCCESS = {"success" : 0}
 #   time = json object containing day of week, hour, minute
 #   t_type_post = target temp post type (deprecated, do not use)
 #
+# The status is read at most once every RADTHERM_CACHE_TTL seconds.
+#
 def radtherm_status():
     """Return the status of the thermostat"""
     try:
-        pman = PoolManager()
-        url = 'http://' + TSTAT_IP +'/tstat'
-        ret = pman.request('GET', url)
-        retval = json.loads(ret.data.decode('utf-8'))
+        retval = _radtherm_get("")
         if 'error' in retval:
             wg_error_print("radtherm_status", " Unsuccessful status request (error)")
             return RADTHERM_STATUS_ERROR
-        return retval
+        return dict(retval)
     except Exception: #pylint: disable=W0703
         wg_error_print("radtherm_status", " Unsuccessful status request (exception)")
         return RADTHERM_STATUS_ERROR
@@ -82,24 +175,21 @@ def radtherm_status():
 # Args:
 #   what = string of what data value you want.  Legal values include:
 #       temp = current temperature
+#       humidity = current relative humidity
+#       t_heat = target heat setpoint
 #   trace = true or false, print trace messages
 #
 def radtherm_get_float(what, trace):
     """Get the value of a piece of floating point data from the thermostat"""
     try:
-        if what == "temp":
-            resource = "temp"
+        if what in ("temp", "t_heat"):
+            resource = ""   # part of the status
         elif what == "humidity":
-            resource = "humidity"
-        elif what == "t_heat":
-            resource = ""
+            resource = "/humidity"
         else:
             wg_error_print("radtherm_get_float", " Invalid 'what' argument " + what)
             return RADTHERM_FLOAT_ERROR
-        pman = PoolManager()
-        url = 'http://' + TSTAT_IP +'/tstat/' + resource
-        ret = pman.request('GET', url)
-        retval = json.loads(ret.data.decode('utf-8'))
+        retval = _radtherm_get(resource)
         if trace:
             pprt = pprint.PrettyPrinter(indent=4)
             pprt.pprint(retval)
@@ -125,16 +215,13 @@ def radtherm_get_int(what, trace):
     """Get the value of a piece of integer data from the thermostat"""
     try:
         if what in ("fmode", "tmode", "hold"):
-            resource = what
+            resource = ""   # part of the status
         elif what == "mode":
-            resource = "save_energy/"
+            resource = "/save_energy/"
         else:
             wg_error_print("radtherm_get_int", " Invalid 'what' argument " + what)
             return RADTHERM_INT_ERROR
-        pman = PoolManager()
-        url = 'http://' + TSTAT_IP +'/tstat/' + resource
-        ret = pman.request('GET', url)
-        retval = json.loads(ret.data.decode('utf-8'))
+        retval = _radtherm_get(resource)
         if trace:
             pprt = pprint.PrettyPrinter(indent=4)
             pprt.pprint(retval)
@@ -160,17 +247,19 @@ def radtherm_set_float(what, value, trace):
         if what != "t_heat":
             wg_error_print("radtherm_set_float", " Invalid 'what' argument " + what)
             return RADTHERM_FLOAT_ERROR
-        pman = PoolManager()
         encoded_body = json.dumps({what: value})
-        ret = pman.request_encode_url('POST', 'http://' + TSTAT_IP +'/tstat',
-                                      headers={'Content-Type': 'application/json'},
-                                      body=encoded_body)
+        ret = wg_http_request('POST', 'http://' + TSTAT_IP +'/tstat',
+                              headers={'Content-Type': 'application/json'},
+                              body=encoded_body, service="Radio Thermostat")
+        # The thermostat may have changed more than what we set
+        radtherm_invalidate()
         retval = json.loads(ret.data.decode('utf-8'))
         if 'success' not in retval:
             wg_error_print("radtherm_set_float", " Unsuccessful POST request (error) of " + what)
             return RADTHERM_FLOAT_ERROR
         return RADTHERM_FLOAT_SUCCESS
     except Exception: #pylint: disable=W0703
+        radtherm_invalidate()
         wg_error_print("radtherm_set_float", " Unsuccessful POST request (exception) of " + what)
         return RADTHERM_FLOAT_ERROR
 
@@ -199,17 +288,19 @@ def radtherm_set_int(what, value, trace):
         else:
             wg_error_print("radtherm_set_int", " Invalid 'what' argument " + what)
             return RADTHERM_INT_ERROR
-        pman = PoolManager()
         encoded_body = json.dumps({what: value})
-        ret = pman.request_encode_url('POST', 'http://' + TSTAT_IP + '/tstat' + resource,
-                                      headers={'Content-Type': 'application/json'},
-                                      body=encoded_body)
+        ret = wg_http_request('POST', 'http://' + TSTAT_IP + '/tstat' + resource,
+                              headers={'Content-Type': 'application/json'},
+                              body=encoded_body, service="Radio Thermostat")
+        # The thermostat may have changed more than what we set
+        radtherm_invalidate()
         retval = json.loads(ret.data.decode('utf-8'))
         if 'success' not in retval:
             wg_error_print("radtherm_set_int", " Unsuccessful POST request (error) of " + what)
             return RADTHERM_INT_ERROR
         return RADTHERM_INT_SUCCESS
     except Exception: #pylint: disable=W0703
+        radtherm_invalidate()
         wg_error_print("radtherm_set_int", " Unsuccessful POST request (exception) of " + what)
         return RADTHERM_INT_ERROR
 
@@ -236,11 +327,10 @@ def radtherm_set_str(what, value, trace):
         else:
             wg_error_print("radtherm_set_str", " Invalid 'what' argument " + what)
             return RADTHERM_STR_ERROR
-        pman = PoolManager()
         encoded_body = json.dumps({"line": line, "message": value})
-        ret = pman.request_encode_url('POST', 'http://' + TSTAT_IP + '/tstat' + resource,
-                                      headers={'Content-Type': 'application/json'},
-                                      body=encoded_body)
+        ret = wg_http_request('POST', 'http://' + TSTAT_IP + '/tstat' + resource,
+                              headers={'Content-Type': 'application/json'},
+                              body=encoded_body, service="Radio Thermostat")
         retval = json.loads(ret.data.decode('utf-8'))
         if 'success' not in retval:
             wg_error_print("radtherm_set_str", " Unsuccessful POST request (error) of " + what)
@@ -253,35 +343,130 @@ def radtherm_set_str(what, value, trace):
 
 ###############################################################################
 #
-# Return the lowest temperature in today's program
+# The thermostat's weekly programs hardly ever change, so they are read once
+# (all seven days of both the heat and cool programs) and kept.  They are
+# re-read after RADTHERM_PROGRAM_TTL seconds or when the status we already
+# have shows a different program_mode.
+#
+# Each program is a dictionary keyed by day ("0" = Monday ... "6" = Sunday) of
+# [minutes after midnight, temp, minutes after midnight, temp, ...] lists.
+#
+RADTHERM_PROGRAM_TTL = 6 * 60 * 60
+RADTHERM_PROGRAM_MODES = ("heat", "cool")
+
+# mode -> {'time' : time.monotonic() when read, 'program_mode' : status
+#          program_mode when read, 'program' : the weekly program}
+_RADTHERM_PROGRAMS = {}
+_RADTHERM_PROGRAM_LOCK = threading.Lock()
+
+###############################################################################
+#
+# What program_mode does the status we already have show (no request)?
+#
+def _radtherm_cached_program_mode():
+    """Return the program_mode from the cached status, None if we don't know"""
+    with _RADTHERM_LOCK:
+        entry = _RADTHERM_CACHE.get("")
+    if entry is None:
+        return None
+    return entry[1].get('program_mode')
+
+###############################################################################
+#
+# Read one weekly program from the thermostat
 # Args:
+#   mode = "heat" or "cool"
 #   trace = true or false, print trace messages
 #
-def radtherm_get_todays_lowest_setting(trace):
-    """Figure out the lowest temp setting in today's program."""
-    days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+def _radtherm_read_program(mode, trace):
+    """GET /tstat/program/<mode>, retrying a few times"""
     num_tries = 1
     retval = {}
-    prog = RADTHERM_FLOAT_ERROR
-    try:
-        pman = PoolManager()
-        wkdy = datetime.datetime.today().weekday()
-        url = 'http://' + TSTAT_IP +'/tstat/program/heat/' + days[wkdy]
-        while num_tries < 6 and retval.get(str(wkdy), 'error') == 'error':
-            ret = pman.request('GET', url)
-            retval = json.loads(ret.data.decode('utf-8'))
-            if trace:
-                pprt = pprint.PrettyPrinter(indent=4)
-                pprt.pprint(retval)
-            if retval.get(str(wkdy), 'error') != 'error':
-                prog = min((retval[str(wkdy)])[1::2]) # 1,3,5, etc. elements are temps
-            num_tries += 1
-        return prog
-    except Exception as err: #pylint: disable=W0703
-        wg_error_print("radtherm_get_todays_highest_setting",
-                       str(err))
-        wg_error_print(err.response.text)
-        return prog
+    url = 'http://' + TSTAT_IP + '/tstat/program/' + mode
+    while num_tries < 6:
+        ret = wg_http_request('GET', url, service="Radio Thermostat")
+        retval = json.loads(ret.data.decode('utf-8'))
+        if trace:
+            pprt = pprint.PrettyPrinter(indent=4)
+            pprt.pprint(retval)
+        if all(str(day) in retval for day in range(7)):
+            return retval
+        num_tries += 1
+    wg_error_print("radtherm_get_program", " Unsuccessful " + mode + " program request")
+    return None
+
+###############################################################################
+#
+# Return the weekly program, from memory unless it's time to re-read it.
+# Args:
+#   mode = "heat" or "cool"
+#   trace = true or false, print trace messages
+#
+# Returns None if the program can't be read.
+#
+def radtherm_get_program(mode, trace):
+    """Return the weekly heat or cool program"""
+    if mode not in RADTHERM_PROGRAM_MODES:
+        wg_error_print("radtherm_get_program", " Invalid 'mode' argument " + mode)
+        return None
+    with _RADTHERM_PROGRAM_LOCK:
+        entry = _RADTHERM_PROGRAMS.get(mode)
+        program_mode = _radtherm_cached_program_mode()
+        if entry is not None and entry['program_mode'] is None:
+            entry['program_mode'] = program_mode # first time we've known it
+        if (entry is not None and
+                (time.monotonic() - entry['time']) < RADTHERM_PROGRAM_TTL and
+                (program_mode is None or program_mode == entry['program_mode'])):
+            return entry['program']
+        try:
+            program = _radtherm_read_program(mode, trace)
+        except Exception as err: #pylint: disable=W0703
+            wg_error_print("radtherm_get_program", str(err))
+            program = None
+        if program is None:
+            # Better an old program than none at all
+            if entry is not None:
+                return entry['program']
+            return None
+        _RADTHERM_PROGRAMS[mode] = {'time' : time.monotonic(),
+                                    'program_mode' : program_mode,
+                                    'program' : program}
+        wg_trace_print("Read the " + mode + " program", trace)
+        return program
+
+###############################################################################
+#
+# Forget the weekly programs so they are re-read the next time they're needed
+#
+def radtherm_invalidate_program():
+    """Throw away the cached weekly programs"""
+    with _RADTHERM_PROGRAM_LOCK:
+        _RADTHERM_PROGRAMS.clear()
+
+###############################################################################
+#
+# Return the temperatures in today's program (the 1,3,5, etc. elements)
+#
+def _radtherm_todays_temps(mode, trace):
+    """Return the list of setpoints in today's program"""
+    program = radtherm_get_program(mode, trace)
+    if program is None:
+        return None
+    return program[str(datetime.datetime.today().weekday())][1::2]
+
+###############################################################################
+#
+# Return the lowest temperature in today's program
+# Args:
+#   trace = true or false, print trace messages
+#   mode = "heat" or "cool" program
+#
+def radtherm_get_todays_lowest_setting(trace, mode="heat"):
+    """Figure out the lowest temp setting in today's program."""
+    temps = _radtherm_todays_temps(mode, trace)
+    if not temps:
+        return RADTHERM_FLOAT_ERROR
+    return min(temps)
 
 
 ###############################################################################
@@ -289,30 +474,41 @@ def radtherm_get_todays_lowest_setting(trace):
 # Return the highest temperature in today's program
 # Args:
 #   trace = true or false, print trace messages
+#   mode = "heat" or "cool" program
 #
-def radtherm_get_todays_highest_setting(trace):
+def radtherm_get_todays_highest_setting(trace, mode="heat"):
     """Figure out the highest temp setting in today's program."""
-    days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-    num_tries = 1
-    retval = {}
-    prog = RADTHERM_FLOAT_ERROR
-    try:
-        pman = PoolManager()
-        wkdy = datetime.datetime.today().weekday()
-        url = 'http://' + TSTAT_IP +'/tstat/program/heat/' + days[wkdy]
-        while num_tries < 6 and retval.get(str(wkdy), 'error') == 'error':
-            ret = pman.request('GET', url)
-            retval = json.loads(ret.data.decode('utf-8'))
-            if trace:
-                pprt = pprint.PrettyPrinter(indent=4)
-                pprt.pprint(retval)
-            if retval.get(str(wkdy), 'error') != 'error':
-                prog = max((retval[str(wkdy)])[1::2]) # 1,3,5, etc. elements are the temps
-            num_tries += 1
-        return prog
-    except Exception as err: #pylint: disable=W0703
-        wg_error_print("radtherm_get_todays_highest_setting",
-                       str(err))
-        if hasattr('err', 'response'):
-            wg_error_print(err.response.text)
-        return prog
+    temps = _radtherm_todays_temps(mode, trace)
+    if not temps:
+        return RADTHERM_FLOAT_ERROR
+    return max(temps)
+
+
+###############################################################################
+#
+# Return the temperature the program calls for at a given time
+# Args:
+#   trace = true or false, print trace messages
+#   mode = "heat" or "cool" program
+#   when = datetime to look up (now if None)
+#
+def radtherm_get_program_setting(trace, mode="heat", when=None):
+    """Figure out the program's setpoint for the current (or given) time."""
+    program = radtherm_get_program(mode, trace)
+    if program is None:
+        return RADTHERM_FLOAT_ERROR
+    if when is None:
+        when = datetime.datetime.now()
+    wkdy = when.weekday()
+    minutes = when.hour * 60 + when.minute
+    periods = program[str(wkdy)]
+    setting = RADTHERM_FLOAT_ERROR
+    for i in range(0, len(periods) - 1, 2):
+        if periods[i] <= minutes:
+            setting = periods[i + 1]
+    if setting == RADTHERM_FLOAT_ERROR:
+        # Before today's first period, so yesterday's last one is still running
+        periods = program[str((wkdy + 6) % 7)]
+        if len(periods) > 1:
+            setting = periods[-1]
+    return setting
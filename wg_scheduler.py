@@ -0,0 +1,120 @@
+"""Run jobs on the worker thread at regular intervals"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to run jobs every so many seconds.  Times
+# are kept on the monotonic clock, so changing the system time (or the Pi
+# setting its clock from the network after boot) doesn't make jobs run early,
+# late or twice.  Each run is moved a little (jitter) so jobs that share an
+# interval don't all hit the network at once, and a job that is still
+# running when it's due again is skipped rather than queued up behind itself.
+#
+import random
+import threading
+import time
+from wg_helper import wg_trace_print
+
+WG_SCHEDULER_VERSION = "1.1"
+
+class WGScheduler:
+    """Submit jobs to a WGWorker at regular intervals"""
+
+    ###########################################################################
+    #
+    # Args:
+    #   worker = the WGWorker to run the jobs on
+    #   jitter = how much to move each run, as a fraction of the interval
+    #   trace = trace the runs and skips
+    #
+    def __init__(self, worker, jitter=0.05, trace=False):
+        self.worker = worker
+        self.jitter = jitter
+        self.trace = trace
+        self.tasks = {}     # name -> dictionary (see add)
+        self.lock = threading.Lock()    # jobs may change their own intervals
+
+    ###########################################################################
+    #
+    # Add a job.
+    # Args:
+    #   name = job name (the same job is never queued twice)
+    #   interval = seconds between runs
+    #   func, args = what to run
+    #   delay = seconds until the first run
+    #
+    def add(self, name, interval, func, *args, delay=0.0):
+        """Schedule func(*args) every interval seconds"""
+        now = time.monotonic()
+        with self.lock:
+            self.tasks[name] = {'interval' : interval,
+                                'func' : func,
+                                'args' : args,
+                                'due' : now + delay,    # when it should run, without jitter
+                                'next' : now + delay,   # when it will run
+                                'runs' : 0,
+                                'skips' : 0}
+
+    ###########################################################################
+    #
+    # Change how often a job runs.  The next run is moved up if it would now
+    # be too far away.  Safe to call from a job.
+    #
+    def set_interval(self, name, interval):
+        """Change a job's interval"""
+        with self.lock:
+            task = self.tasks[name]
+            if task['interval'] != interval:
+                wg_trace_print("scheduler: " + name + " every " + str(int(interval)) +
+                               " seconds", self.trace)
+            task['interval'] = interval
+            latest = time.monotonic() + interval
+            if task['due'] > latest:
+                task['due'] = latest
+                task['next'] = latest
+
+    ###########################################################################
+    #
+    # Run a job as soon as possible (the next call to run_pending)
+    #
+    def run_soon(self, name):
+        """Make a job due now"""
+        with self.lock:
+            task = self.tasks[name]
+            task['due'] = task['next'] = time.monotonic()
+
+    ###########################################################################
+    #
+    # Submit the jobs that are due.  Call this often (the main loop does).
+    #
+    def run_pending(self):
+        """Submit any jobs that are due"""
+        now = time.monotonic()
+        with self.lock:
+            for (name, task) in self.tasks.items():
+                if now < task['next']:
+                    continue
+                if self.worker.submit(name, task['func'], *task['args']):
+                    task['runs'] += 1
+                    wg_trace_print("scheduler: " + name + " submitted", self.trace)
+                else:
+                    task['skips'] += 1
+                    wg_trace_print("scheduler: " + name + " still running, skipped", self.trace)
+                task['due'] += task['interval']
+                if task['due'] <= now:
+                    # We fell behind (or the job took longer than its interval),
+                    # don't try to catch up with a burst of runs
+                    task['due'] = now + task['interval']
+                spread = task['interval'] * self.jitter
+                task['next'] = task['due'] + random.uniform(-spread, spread)
+
+    ###########################################################################
+    #
+    # Seconds until the next job is due (for a loop that wants to sleep)
+    #
+    def next_due(self):
+        """Return the seconds until the next job is due"""
+        with self.lock:
+            if not self.tasks:
+                return None
+            return max(0.0, min(task['next'] for task in self.tasks.values()) - time.monotonic())
@@ -8,12 +8,16 @@
 # Copyright (C) 2018, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
 #
 # Helper functiona and definitions to interface with a ThingSpeak account
+import datetime
 import json
-from urllib3 import PoolManager
+import os
+import threading
+import time
 
 from wg_helper import wg_error_print
 from wg_helper import wg_trace_print
 from wg_helper import wg_trace_pprint
+from wg_http import wg_http_request
 
 # You'll need to create your own TSChannelsAndKeys.py file
 from thingspeak_channels_keys import TS_BASEMENT_CHAN
@@ -23,7 +27,7 @@ from thingspeak_channels_keys import TS_WEATHER_API_KEY
 from thingspeak_channels_keys import TS_THERM_API_KEY
 from thingspeak_channels_keys import TS_BASEMENT_API_READKEY
 
-WGTHINGSPEAK_VERSION = "2.0"
+WGTHINGSPEAK_VERSION = "2.2"
 
 THINGSPEAK_FLOAT_ERROR = -999.0
 
@@ -40,16 +44,15 @@ def thingspeakgetfloat(chan, field, trace):
         else:
             wg_error_print("thingspeakgetfloat", "Invalid channel arg: " + str(chan))
             return THINGSPEAK_FLOAT_ERROR
-        pman = PoolManager()
         # Get the requested field from the specified ThingSpeak channel
-        retstruct = pman.request('GET', 'http://api.thingspeak.com/channels/' +
-                                 chan +
-                                 '/fields/' +
-                                 field +
-                                 '.json?api_key=' +
-                                 key +
-                                 '&results=' +
-                                 nresults)
+        retstruct = wg_http_request('GET', 'http://api.thingspeak.com/channels/' +
+                                    chan +
+                                    '/fields/' +
+                                    field +
+                                    '.json?api_key=' +
+                                    key +
+                                    '&results=' +
+                                    nresults, service="ThingSpeak")
         decodestruct = json.loads(retstruct.data.decode('utf-8'))
         retval = decodestruct['feeds'][0]['field'+field]
         wg_trace_print("field " + field + " of " + chanstr + " channel = " +
@@ -62,39 +65,223 @@ def thingspeakgetfloat(chan, field, trace):
 
 ###############################################################################
 #
-# Send 2 pieced of data to a ThingSpeak channel
+# Data sent to ThingSpeak is queued and uploaded in bulk by thingspeakflush.
+# Every queued point is also appended to a spool file so nothing is lost if
+# the network is down or the program is restarted before it's uploaded.
+#
+THINGSPEAK_SPOOL_FILE = "thingspeak_spool.txt"
+THINGSPEAK_REJECTED_FILE = "thingspeak_rejected.txt"  # points ThingSpeak refused
+THINGSPEAK_SPOOL_MAX = 50000        # points kept while ThingSpeak can't be reached
+THINGSPEAK_BULK_MAX = 960           # points per bulk update request
+THINGSPEAK_BULK_INTERVAL = 15.0     # seconds between bulk updates to a channel
+
+# What happened to a bulk update
+THINGSPEAK_SENT = "sent"
+THINGSPEAK_RETRY = "retry"          # network trouble, 429 or 5xx: try again later
+THINGSPEAK_REJECTED = "rejected"    # any other 4xx: sending it again won't help
+
+# Queued points.  Each is a dictionary with:
+#   chan = channel number
+#   created_at = ISO 8601 time the data was queued
+#   fields = dictionary of ThingSpeak field name ("field1", ...) to value
+_TS_QUEUE = []
+_TS_QUEUE_LOADED = False
+_TS_LAST_BULK = {}                  # chan -> time.monotonic() of the last bulk update
+_TS_LOCK = threading.Lock()
+
+###############################################################################
+#
+# Return the write key and name of a channel (None, None if we can't write it)
+#
+def _thingspeak_write_key(chan):
+    """Look up a channel's write API key"""
+    if chan == TS_THERM_CHAN:
+        return (TS_THERM_API_KEY, "thermostat")
+    if chan == TS_WEATHER_CHAN:
+        return (TS_WEATHER_API_KEY, "WeatherUnderground")
+    return (None, None)
+
+###############################################################################
+#
+# Read any points left in the spool file by the last run.  Call with _TS_LOCK
+# held.
+#
+def _thingspeak_load_spool():
+    """Load unsent points from the spool file"""
+    global _TS_QUEUE_LOADED
+    if _TS_QUEUE_LOADED:
+        return
+    _TS_QUEUE_LOADED = True
+    if not os.path.isfile(THINGSPEAK_SPOOL_FILE):
+        return
+    with open(THINGSPEAK_SPOOL_FILE, "r") as spool:
+        for line in spool:
+            try:
+                _TS_QUEUE.append(json.loads(line))
+            except ValueError:
+                # A partial line from a power failure mid-write
+                wg_error_print("thingspeak spool", "Skipping bad line: " + line.strip())
+    del _TS_QUEUE[:-THINGSPEAK_SPOOL_MAX]
+
+###############################################################################
+#
+# Rewrite the spool file with what's left in the queue.  Call with _TS_LOCK
+# held.
+#
+def _thingspeak_rewrite_spool():
+    """Replace the spool file with the current queue"""
+    tmp_name = THINGSPEAK_SPOOL_FILE + ".tmp"
+    with open(tmp_name, "w") as spool:
+        for point in _TS_QUEUE:
+            spool.write(json.dumps(point) + "\n")
+        spool.flush()
+        os.fsync(spool.fileno())
+    os.replace(tmp_name, THINGSPEAK_SPOOL_FILE)
+
+###############################################################################
+#
+# Queue a point for a ThingSpeak channel
+# Args:
+#   chan = channel to send to
+#   fields = dictionary of field number ("1" - "8") to value
+#   trace = true or false, print trace messages
+#
+def thingspeakqueue(chan, fields, trace):
+    """Queue data for a channel to be sent by thingspeakflush"""
+    (key, _) = _thingspeak_write_key(chan)
+    if key is None:
+        wg_error_print("thingspeakqueue", "Invalid channel arg: " + str(chan))
+        return
+    point = {'chan' : chan,
+             'created_at' : datetime.datetime.now().astimezone().isoformat(timespec='seconds'),
+             'fields' : {'field' + field : value for (field, value) in fields.items()}}
+    with _TS_LOCK:
+        _thingspeak_load_spool()
+        _TS_QUEUE.append(point)
+        try:
+            with open(THINGSPEAK_SPOOL_FILE, "a") as spool:
+                spool.write(json.dumps(point) + "\n")
+        except OSError:
+            wg_error_print("thingspeakqueue", "Unable to write to " + THINGSPEAK_SPOOL_FILE)
+        if len(_TS_QUEUE) > THINGSPEAK_SPOOL_MAX:
+            wg_error_print("thingspeakqueue", "Spool full, dropping the oldest points")
+            del _TS_QUEUE[:-THINGSPEAK_SPOOL_MAX]
+            try:
+                _thingspeak_rewrite_spool()
+            except OSError:
+                wg_error_print("thingspeakqueue", "Unable to rewrite " + THINGSPEAK_SPOOL_FILE)
+    wg_trace_print("Queued " + str(point), trace)
+
+###############################################################################
+#
+# Send 2 pieced of data to a ThingSpeak channel.  The data is queued and sent
+# the next time thingspeakflush is called.
 #
 def thingspeaksendfloatnum(chan, numfields, field1, value1, field2, value2,
                            field3, value3, field4, value4, trace):
     """Update a floating point value on a channel field"""
+    if numfields < 1 or numfields > 4:
+        wg_error_print("thingspeaksendfloatnum",
+                       "Invalid numfields arg (1, 2, or 3 expected): " +
+                       str(numfields))
+        return
+    fields = [(field1, value1), (field2, value2), (field3, value3), (field4, value4)]
+    thingspeakqueue(chan, dict(fields[:numfields]), trace)
+
+###############################################################################
+#
+# Send one bulk update to a channel
+# Args:
+#   chan = channel to send to
+#   points = list of queued points for that channel
+#   trace = true or false, print trace messages
+#
+# Returns THINGSPEAK_SENT, THINGSPEAK_RETRY or THINGSPEAK_REJECTED
+#
+def _thingspeak_bulk_update(chan, points, trace):
+    """POST queued points to a channel's bulk update API"""
+    (key, chanstr) = _thingspeak_write_key(chan)
+    updates = []
+    for point in points:
+        update = {'created_at' : point['created_at']}
+        update.update(point['fields'])
+        updates.append(update)
     try:
-        if numfields < 1 or numfields > 4:
-            wg_error_print("thingspeaksendfloatnum",
-                           "Invalid numfields arg (1, 2, or 3 expected): " +
-                           str(numfields))
-            return
-        if chan == TS_THERM_CHAN:
-            key = TS_THERM_API_KEY
-            chanstr = "thermostat"
-        elif chan == TS_WEATHER_CHAN:
-            key = TS_WEATHER_API_KEY
-            chanstr = "WeatherUnderground"
-        else:
-            wg_error_print("thingspeaksendfloatnum", "Invalid channel arg: " + str(chan))
-        pman = PoolManager()
-        req = ('http://api.thingspeak.com/update?api_key=' + key + '&field' +
-               field1 + '=' + str(value1))
-        if numfields > 1:
-            req = req + '&field' + field2 + '=' + str(value2)
-        if numfields > 2:
-            req = req + '&field' + field3 + '=' + str(value3)
-        if numfields > 3:
-            req = req + '&field' + field4 + '=' + str(value4)
-        # Get the requested field from the specified ThingSpeak channel
-        retstruct = pman.request('GET', req)
+        retstruct = wg_http_request('POST', 'https://api.thingspeak.com/channels/' +
+                                    str(chan) + '/bulk_update.json',
+                                    headers={'Content-Type': 'application/json'},
+                                    body=json.dumps({'write_api_key' : key,
+                                                     'updates' : updates}),
+                                    service="ThingSpeak")
         wg_trace_print("STATUS = " + str(retstruct.status), trace)
         wg_trace_pprint(retstruct.data, trace)
-        wg_trace_pprint(retstruct.headers, trace)
-    except:
-        wg_error_print("ThingSpeakSendFloat",
+        if retstruct.status in (200, 202):
+            return THINGSPEAK_SENT
+        wg_error_print("thingspeakflush", "Bulk update to " + chanstr +
+                       " channel failed (status = " + str(retstruct.status) + ")")
+        if 400 <= retstruct.status < 500 and retstruct.status != 429:
+            return THINGSPEAK_REJECTED
+    except Exception: #pylint: disable=W0703
+        wg_error_print("thingspeakflush",
                        "Exception sending data to " + chanstr + " channel")
+    return THINGSPEAK_RETRY
+
+###############################################################################
+#
+# Put points ThingSpeak refused in THINGSPEAK_REJECTED_FILE (so they can be
+# looked at) instead of sending them forever
+#
+def _thingspeak_park(points):
+    """Save rejected points out of the way"""
+    wg_error_print("thingspeakflush", "ThingSpeak rejected " + str(len(points)) +
+                   " point(s), moved to " + THINGSPEAK_REJECTED_FILE)
+    try:
+        with open(THINGSPEAK_REJECTED_FILE, "a") as rejected:
+            for point in points:
+                rejected.write(json.dumps(point) + "\n")
+    except OSError:
+        wg_error_print("thingspeakflush", "Unable to write to " + THINGSPEAK_REJECTED_FILE)
+
+###############################################################################
+#
+# Upload the queued points.  Each channel gets at most one bulk update every
+# THINGSPEAK_BULK_INTERVAL seconds; anything not sent stays queued, unless
+# ThingSpeak rejected it (see _thingspeak_park).
+# Args:
+#   trace = true or false, print trace messages
+#
+# Returns the number of points sent
+#
+def thingspeakflush(trace):
+    """Send queued data to ThingSpeak in bulk"""
+    with _TS_LOCK:
+        _thingspeak_load_spool()
+        chans = []
+        for point in _TS_QUEUE:
+            if point['chan'] not in chans:
+                chans.append(point['chan'])
+    sent = 0
+    for chan in chans:
+        last = _TS_LAST_BULK.get(chan)
+        if last is not None and (time.monotonic() - last) < THINGSPEAK_BULK_INTERVAL:
+            continue
+        with _TS_LOCK:
+            points = [point for point in _TS_QUEUE if point['chan'] == chan]
+        points = points[:THINGSPEAK_BULK_MAX]
+        _TS_LAST_BULK[chan] = time.monotonic()
+        result = _thingspeak_bulk_update(chan, points, trace)
+        if result == THINGSPEAK_RETRY:
+            continue
+        if result == THINGSPEAK_REJECTED:
+            _thingspeak_park(points)
+        with _TS_LOCK:
+            done = set(id(point) for point in points)
+            _TS_QUEUE[:] = [point for point in _TS_QUEUE if id(point) not in done]
+            try:
+                _thingspeak_rewrite_spool()
+            except OSError:
+                wg_error_print("thingspeakflush", "Unable to rewrite " + THINGSPEAK_SPOOL_FILE)
+        if result == THINGSPEAK_SENT:
+            sent = sent + len(points)
+    wg_trace_print("Sent " + str(sent) + " points to ThingSpeak", trace)
+    return sent
@@ -6,15 +6,18 @@
 #
 # Helper functiona and definitions to interface with a Twilio account
 """Interface to a Twilio.com account"""
-from twilio.rest import Client
 
 # SMS texting facility - requires a Twilio account
 from twilio_account_settings import TWILIO_ACT
 from twilio_account_settings import TWILIO_AUTH_TOKEN
 from twilio_account_settings import CELL_PHONE
 from twilio_account_settings import FROM_PHONE
+from wg_lazy import wg_lazy_import
+from wg_metrics import wg_metrics_timer
 
-WG_TWILIO_VERSION = "2.0"
+WG_TWILIO_VERSION = "2.2"
+
+_CLIENT = None
 
 ####################################################################
 #
@@ -22,7 +25,11 @@ WG_TWILIO_VERSION = "2.0"
 #
 def sendtext(text_message):
     """Send a text_message to the cell number in account settings file"""
-    client = Client(TWILIO_ACT, TWILIO_AUTH_TOKEN)
-    client.messages.create(to=CELL_PHONE,
-                           from_=FROM_PHONE,
-                           body=text_message)
+    global _CLIENT
+    with wg_metrics_timer("provider", "Twilio"):
+        if _CLIENT is None:
+            # twilio is slow to import, so wait until there's something to send
+            _CLIENT = wg_lazy_import("twilio.rest").Client(TWILIO_ACT, TWILIO_AUTH_TOKEN)
+        _CLIENT.messages.create(to=CELL_PHONE,
+                                from_=FROM_PHONE,
+                                body=text_message)
@@ -0,0 +1,100 @@
+"""Background worker thread for slow (network, disk) jobs"""
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2021, Wayne Geiser (geiserw@gmail.com).  All Rights Reserved
+#
+# Helper functiona and definitions to run jobs off of the main (display)
+# thread.  Jobs are run one at a time, in the order they were submitted, so
+# they never have to worry about each other.  A job is known by its name and
+# the same job is never queued twice.
+#
+import queue
+import sys
+import threading
+import time
+from wg_helper import wg_error_print
+from wg_helper import wg_trace_print
+from wg_metrics import wg_metrics_observe
+
+WG_WORKER_VERSION = "1.1"
+
+class WGWorker:
+    """Run submitted jobs, one at a time, on a background thread"""
+
+    ###########################################################################
+    def __init__(self, name="worker", trace=False):
+        self.name = name
+        self.trace = trace
+        self.jobs = queue.Queue()
+        self.pending = set()    # names of the jobs queued or running
+        self.lock = threading.Lock()
+        self.thread = None
+
+    ###########################################################################
+    #
+    # Start the worker thread
+    #
+    def start(self):
+        """Start running jobs"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+
+    ###########################################################################
+    #
+    # Ask for a job to be run.  Returns False if a job with the same name is
+    # already waiting or running (the caller doesn't have to keep track).
+    #
+    def submit(self, job_name, func, *args):
+        """Queue func(*args) to be run on the worker thread"""
+        with self.lock:
+            if job_name in self.pending:
+                return False
+            self.pending.add(job_name)
+        self.jobs.put((job_name, func, args))
+        return True
+
+    ###########################################################################
+    #
+    # Is the named job waiting or running?
+    #
+    def busy(self, job_name):
+        """Return True if job_name is queued or running"""
+        with self.lock:
+            return job_name in self.pending
+
+    ###########################################################################
+    #
+    # Stop the worker once the jobs already queued are done
+    #
+    def stop(self, timeout=None):
+        """Finish the queued jobs and stop the thread"""
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+    ###########################################################################
+    def _run(self):
+        """Worker thread main loop"""
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            (job_name, func, args) = job
+            start = time.monotonic()
+            failed = False
+            try:
+                func(*args)
+            except Exception: #pylint: disable=W0703
+                failed = True
+                wg_error_print(self.name, "Job " + job_name + " failed " +
+                               "(Exc type = " + str(sys.exc_info()[0]) + ") " +
+                               "(Exc value = " + str(sys.exc_info()[1]) + ")")
+            finally:
+                with self.lock:
+                    self.pending.discard(job_name)
+            elapsed = time.monotonic() - start
+            wg_metrics_observe("job", job_name, elapsed, failed)
+            wg_trace_print(self.name + ": " + job_name + " took " +
+                           "%.2f seconds" % elapsed, self.trace)